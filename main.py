@@ -1,7 +1,11 @@
-import asyncio
 import sys, os, io
 import json
 import socket
+import signal
+import ssl
+import time
+import urllib.request
+from subprocess import Popen, TimeoutExpired
 
 from dotenv import load_dotenv
 load_dotenv()
@@ -19,52 +23,243 @@ if not (py in ['python', 'python3']):
   print("Error en la ruta ejecutable: " + py)
   exit(0)
 
-otropy = 'python' if py == 'python3' else 'python3'
+RAIZ = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(RAIZ, 'servidor'))
+from pidfiles import leerPid, escribirPid, borrarArchivo, procesoVivo, reinicioPedido
 
-def esEntero(x):
+def valorEntorno(clave, default):
   try:
-    int(x)
+    return float(os.environ[clave]) if clave in os.environ else default
   except ValueError:
-    return False
-  return True
-
-def obtener_pid(s):
-  for x in s.split(' '):
-    if len(x) > 0 and esEntero(x):
-      return x
-  return None
-
-def a_eliminar(pids, s):
-  for p in pids:
-    if s.endswith(py + " server.py -p" + str(PUERTO_INICIAL+p)) or s.endswith(otropy + " server.py -p" + str(PUERTO_INICIAL+p)):
-      return True
-  return False
-
-def kill_previous(pids):
-  from subprocess import PIPE, Popen
-  p = Popen('ps -x', stdout=PIPE, stderr=PIPE, universal_newlines=True, shell=True)
-  out = p.communicate()[0]
-  # print(out)
-  for s in out.split('\n'):
-    if a_eliminar(pids, s):
-      pid = obtener_pid(s)
-      if not (pid is None):
-        if int(pid) != os.getpid():
-          print("kill " + pid)
-          os.system("kill -9 " + pid)
-
-async def main(i):
-  process = await asyncio.create_subprocess_exec(py, 'server.py', '-p' + str(PUERTO_INICIAL+i))
-  print(f'subprocess: {process}')
+    return default
+
+INTERVALO = 1 # Cada cuántos segundos reviso el estado de los servidores
+INTERVALO_SALUD = valorEntorno('INTERVALO_SALUD', 10) # Cada cuántos segundos hago el health check
+FALLAS_SALUD = 3 # Cuántos health checks seguidos pueden fallar antes de reiniciar el servidor
+TIMEOUT_SALUD = 5
+TIMEOUT_ARRANQUE = valorEntorno('TIMEOUT_ARRANQUE', 120) # Cuánto tiempo tiene un servidor para empezar a responder
+TIMEOUT_TERMINAR = 10 # Cuánto espero después del SIGTERM antes de mandar SIGKILL
+BACKOFF_INICIAL = 1
+BACKOFF_MAXIMO = 60
+TIEMPO_ESTABLE = 60 # Si un servidor estuvo vivo este tiempo, se resetea el backoff
 
 def mi_ip():
   s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
   s.connect(('8.8.8.8', 1))  # connect() for UDP doesn't send packets
   return s.getsockname()[0]
 
+def esServidor(pid):
+  # Antes de matar un pid leído de un archivo, me fijo que siga siendo un server.py (el pid se pudo haber reusado)
+  try:
+    f = open('/proc/' + str(pid) + '/cmdline', 'rb')
+    cmdline = f.read()
+    f.close()
+    return b'server.py' in cmdline
+  except OSError:
+    return procesoVivo(pid)
+
+def esperarFin(pid, timeout):
+  limite = time.monotonic() + timeout
+  while time.monotonic() < limite:
+    if not procesoVivo(pid):
+      return True
+    time.sleep(0.1)
+  return not procesoVivo(pid)
+
+def terminar(pid):
+  # SIGTERM y, si no termina a tiempo, SIGKILL. Después mato lo que quede en su grupo (los workers del modo prefork)
+  try:
+    pgid = os.getpgid(pid)
+    grupo = pgid == pid and pgid != os.getpgrp() # Nunca mi propio grupo (por ejemplo, si me lanzó ese servidor)
+    os.kill(pid, signal.SIGTERM)
+    if not esperarFin(pid, TIMEOUT_TERMINAR):
+      os.kill(pid, signal.SIGKILL)
+  except ProcessLookupError:
+    return
+  if grupo:
+    matarGrupo(pid)
+
+def matarGrupo(pid):
+  # Cada servidor se lanza en su propia sesión, así que su grupo de procesos es su pid
+  try:
+    os.killpg(pid, signal.SIGKILL)
+  except (ProcessLookupError, PermissionError):
+    pass
+
+def kill_previous(puertos):
+  for puerto in puertos:
+    # Tomo el puerto: si había otro supervisor, a partir de ahora lo ignora
+    escribirPid(puerto, "supervisor", os.getpid())
+    borrarArchivo(puerto, "reiniciar")
+    pid = leerPid(puerto, "pid")
+    if not (pid is None) and procesoVivo(pid) and esServidor(pid):
+      print("kill " + str(pid))
+      terminar(pid)
+    borrarArchivo(puerto, "pid")
+
+class Supervisor(object):
+  def __init__(self, ip, puertos, argumentos):
+    self.ip = ip
+    self.argumentos = argumentos
+    self.esquema = 'https' if ('CERT' in os.environ and 'KEY' in os.environ) else 'http'
+    self.contexto = ssl._create_unverified_context() if self.esquema == 'https' else None
+    self.servidores = {}
+    for puerto in puertos:
+      self.servidores[puerto] = {"proceso":None, "inicio":0, "listo":False, "fallas":0, "fallasSalud":0, "proximoInicio":0, "proximoChequeo":0}
+    self.reinicioPendiente = False
+    self.colaDeReinicio = [] # Los puertos que falta revisar en el reinicio escalonado
+    self.reiniciando = None # El puerto que se está reiniciando (se espera a que responda antes de pasar al siguiente)
+    self.limiteReinicio = 0
+    self.terminado = False
+
+  def lanzar(self, puerto):
+    servidor = self.servidores[puerto]
+    proceso = Popen([sys.executable, 'server.py', '-p' + str(puerto)] + self.argumentos, cwd=os.path.join(RAIZ, 'servidor'),
+      start_new_session=True)
+    escribirPid(puerto, "pid", proceso.pid)
+    print("[supervisor] puerto " + str(puerto) + ": pid " + str(proceso.pid))
+    sys.stdout.flush()
+    servidor["proceso"] = proceso
+    servidor["inicio"] = time.monotonic()
+    servidor["listo"] = False
+    servidor["fallasSalud"] = 0
+    servidor["proximoChequeo"] = servidor["inicio"] + INTERVALO
+
+  def detener(self, puerto):
+    servidor = self.servidores[puerto]
+    proceso = servidor["proceso"]
+    if not (proceso is None):
+      # Es hijo mío: espero con wait (si no, queda zombie y parece vivo)
+      proceso.terminate()
+      try:
+        proceso.wait(TIMEOUT_TERMINAR)
+      except TimeoutExpired:
+        proceso.kill()
+        proceso.wait()
+      matarGrupo(proceso.pid) # Los workers que hayan quedado
+      servidor["proceso"] = None
+    if leerPid(puerto, "supervisor") == os.getpid():
+      borrarArchivo(puerto, "pid")
+
+  def soyDueño(self, puerto):
+    return leerPid(puerto, "supervisor") == os.getpid()
+
+  def soltar(self, puerto):
+    # Otro supervisor tomó el puerto (kill_previous ya mató a mi servidor)
+    print("[supervisor] puerto " + str(puerto) + ": lo tomó otro supervisor")
+    servidor = self.servidores.pop(puerto)
+    if not (servidor["proceso"] is None):
+      servidor["proceso"].wait()
+
+  def saludable(self, puerto):
+    url = self.esquema + '://' + self.ip + ':' + str(puerto) + '/ping'
+    try:
+      respuesta = urllib.request.urlopen(url, timeout=TIMEOUT_SALUD, context=self.contexto)
+      ok = respuesta.status == 200
+      respuesta.close()
+      return ok
+    except Exception:
+      return False
+
+  def revisar(self, puerto):
+    servidor = self.servidores[puerto]
+    proceso = servidor["proceso"]
+    ahora = time.monotonic()
+    if proceso is None:
+      if ahora >= servidor["proximoInicio"]:
+        self.lanzar(puerto)
+      return
+    codigo = proceso.poll()
+    if not (codigo is None):
+      # Se cayó: lo vuelvo a levantar con backoff exponencial
+      if ahora - servidor["inicio"] >= TIEMPO_ESTABLE:
+        servidor["fallas"] = 0
+      espera = min(BACKOFF_MAXIMO, BACKOFF_INICIAL * (2 ** servidor["fallas"]))
+      servidor["fallas"] += 1
+      print("[supervisor] puerto " + str(puerto) + ": terminó con código " + str(codigo) + ", reinicio en " + str(espera) + "s")
+      sys.stdout.flush()
+      matarGrupo(proceso.pid)
+      servidor["proceso"] = None
+      servidor["proximoInicio"] = ahora + espera
+      return
+    if ahora < servidor["proximoChequeo"]:
+      return
+    if self.saludable(puerto):
+      servidor["listo"] = True
+      servidor["fallasSalud"] = 0
+      servidor["proximoChequeo"] = ahora + INTERVALO_SALUD
+      return
+    if servidor["listo"]:
+      servidor["fallasSalud"] += 1
+      servidor["proximoChequeo"] = ahora + INTERVALO_SALUD
+      colgado = servidor["fallasSalud"] >= FALLAS_SALUD
+    else: # Todavía está arrancando
+      servidor["proximoChequeo"] = ahora + INTERVALO
+      colgado = ahora - servidor["inicio"] >= TIMEOUT_ARRANQUE
+    if colgado:
+      print("[supervisor] puerto " + str(puerto) + ": no responde, lo reinicio")
+      sys.stdout.flush()
+      self.detener(puerto)
+      self.lanzar(puerto)
+
+  def reiniciarEscalonado(self):
+    # Reinicio de a un servidor por vez: se llama en cada vuelta del loop y, si el que se está reiniciando ya
+    # responde (revisar lo marca listo), se cayó o se le pasó el tiempo, reinicia el siguiente. Mientras tanto
+    # revisar sigue supervisando a todos
+    if not (self.reiniciando is None):
+      servidor = self.servidores.get(self.reiniciando)
+      esperando = not (servidor is None) and not (servidor["proceso"] is None) and not servidor["listo"]
+      if esperando and time.monotonic() < self.limiteReinicio:
+        return
+      self.reiniciando = None
+    while len(self.colaDeReinicio) > 0:
+      puerto = self.colaDeReinicio.pop(0)
+      if not (puerto in self.servidores) or not self.soyDueño(puerto) or not reinicioPedido(puerto):
+        continue
+      print("[supervisor] puerto " + str(puerto) + ": reinicio pedido")
+      sys.stdout.flush()
+      self.detener(puerto)
+      self.servidores[puerto]["fallas"] = 0
+      self.lanzar(puerto)
+      self.reiniciando = puerto
+      self.limiteReinicio = time.monotonic() + TIMEOUT_ARRANQUE
+      return
+
+  def alRecibirHUP(self, signum, frame):
+    self.reinicioPendiente = True
+
+  def alTerminar(self, signum, frame):
+    self.terminado = True
+
+  def correr(self):
+    signal.signal(signal.SIGHUP, self.alRecibirHUP)
+    signal.signal(signal.SIGTERM, self.alTerminar)
+    signal.signal(signal.SIGINT, self.alTerminar)
+    for puerto in self.servidores:
+      self.lanzar(puerto)
+    while not self.terminado and len(self.servidores) > 0:
+      for puerto in list(self.servidores):
+        if self.soyDueño(puerto):
+          self.revisar(puerto)
+        else:
+          self.soltar(puerto)
+      if self.reinicioPendiente:
+        self.reinicioPendiente = False
+        self.colaDeReinicio = sorted(self.servidores)
+      self.reiniciarEscalonado()
+      time.sleep(INTERVALO)
+    for puerto in list(self.servidores):
+      if self.soyDueño(puerto):
+        self.detener(puerto)
+        borrarArchivo(puerto, "supervisor")
+
 pids = []
+argumentos = [] # Los argumentos que empiezan con '-' se le pasan a server.py (por ejemplo -a1 o -w4)
 if len(sys.argv) > 1:
-  for x in sys.argv:
+  for x in sys.argv[1:]:
+    if x.startswith('-'):
+      argumentos.append(x)
+      continue
     try:
       p = int(x)
       pids.append(p)
@@ -72,17 +267,18 @@ if len(sys.argv) > 1:
       continue
 if len(pids) == 0:
   pids = todos_los_pids
+puertos = [PUERTO_INICIAL + i for i in pids]
 
-kill_previous(pids)
+kill_previous(puertos)
 
 if len(sys.argv) > 1 and 'x' in sys.argv:
+  for puerto in puertos:
+    borrarArchivo(puerto, "supervisor")
   exit(0)
 
-f = io.open('info.json', mode='w', encoding='utf-8')
-f.write(json.dumps({"ip":mi_ip(),"puerto_inicial":PUERTO_INICIAL}))
+ip = mi_ip()
+f = io.open(os.path.join(RAIZ, 'info.json'), mode='w', encoding='utf-8')
+f.write(json.dumps({"ip":ip,"puerto_inicial":PUERTO_INICIAL}))
 f.close()
 
-os.chdir('servidor')
-for i in pids:
-  # asyncio.run(main(i))
-  os.system(py + " server.py -p" + str(PUERTO_INICIAL + i)) # OJO: ahora sólo puedo levantar uno a la vez porque se cuelga acá hasta que termine (asumo que en pids viene sólo uno)
+Supervisor(ip, puertos, argumentos).correr()
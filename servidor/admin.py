@@ -1,17 +1,33 @@
 import os, sys
+from server_httpServer import estadisticasRutas
+from pidfiles import pedirReinicio
+from planificador import PLANIFICADOR
 
 PSW = "secuenciadepasos"
 
 def admin_reset(jsonObj, v):
   if not ("psw" in jsonObj) or jsonObj["psw"] != PSW:
     return {"resultado":"Error", "error":"Contraseña incorrecta"}
-  args = ""
+  args = []
+  puertos = None
   if "i" in jsonObj:
-    args = " " + str(jsonObj["i"])
-  py = sys.executable.split('/')[-1]
-  os.chdir('..')
-  # os.system(py + " main.py")
+    args = [str(jsonObj["i"])]
+    puertos = [int(os.environ.get('PUERTO_INICIAL', 8050)) + int(jsonObj["i"])]
+  # Si hay un supervisor corriendo, le pido un reinicio escalonado (sin cortar los demás puertos)
+  if pedirReinicio(puertos):
+    return {"resultado":"OK"}
+  # Si no, lanzo un supervisor nuevo. Va en su propia sesión: si heredara el grupo de procesos de este servidor,
+  # al matar el grupo del servidor viejo (kill_previous) se mataría también a sí mismo
   from subprocess import Popen
-  Popen(py + " main.py" + args, universal_newlines=True, shell=True)
-  os.chdir('servidor')
-  return {"resultado":"OK"}
\ No newline at end of file
+  Popen([sys.executable, "main.py"] + args, cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))), start_new_session=True)
+  return {"resultado":"OK"}
+
+def admin_stats(jsonObj, v):
+  if not ("psw" in jsonObj) or jsonObj["psw"] != PSW:
+    return {"resultado":"Error", "error":"Contraseña incorrecta"}
+  # En modo prefork cada worker tiene su propia tabla de rutas: las cuentas son sólo las del worker que atendió
+  # este pedido, no las de todo el servidor
+  return {"resultado":"OK", "pid":os.getpid(), "rutas":estadisticasRutas(), "planificador":PLANIFICADOR.estado()}
+
+def admin_ping(v):
+  return {"resultado":"OK", "pid":os.getpid()}
@@ -8,6 +8,7 @@ analizadorPython = AnalizadorPython()
 analizadorGobstones = AnalizadorGobstones()
 # analizadorHaskell = AnalizadorHaskell()
 
+import itertools
 import json
 
 def analizar(analizador, código, reglas, extras={}):
@@ -21,10 +22,11 @@ def analizar(analizador, código, reglas, extras={}):
     AST["resultado"] = "Except"
     return AST
   if analizarCódigoMalicioso:
-    resultadoCódigoMalicioso = analizador.AnalizarCódigoMalicioso(AST["ast"], código, desde, hasta)
+    # Sólo se usa el primer hallazgo (ver textoAPartirDeLista): se deja de buscar ahí
+    resultadoCódigoMalicioso = primerosDe_(analizador.HallazgosCódigoMalicioso(AST["ast"], código, desde, hasta))
     if len(resultadoCódigoMalicioso) > 0:
       return {"resultado":"EVIL", "error":textoAPartirDeLista(resultadoCódigoMalicioso)}
-  resultadoAnálisisCalidad = analizador.AnalizarAst(AST["ast"], código, reglas, desde, hasta)
+  resultadoAnálisisCalidad = primerosDe_(analizador.HallazgosAst(AST["ast"], código, reglas, desde, hasta))
   # MostrarAST(analizador.astMostrable(AST["ast"]))
   # print(list(map(lambda r: analizador.actualizarNroLíneas(r, desde), resultadoAnálisisCalidad)))
   if len(resultadoAnálisisCalidad) > 0:
@@ -40,6 +42,10 @@ def analizarPython(código, reglas, extras={}):
 def analizarHaskell(código, reglas, extras={}):
   return None # analizar(analizadorHaskell, código, reglas, extras)
 
+def primerosDe_(hallazgos):
+  # Los hallazgos que hacen falta para textoAPartirDeLista (el primero, si hay)
+  return list(itertools.islice(hallazgos, 1))
+
 def textoAPartirDeLista(lista):
   return lista[0]["msg"] # Por ahora sólo devuelvo el primero porque las funciones de buscar_falla asumen que es uno sólo.
 
@@ -1,30 +1,116 @@
 # -*- coding: utf-8 -*-
 
-from reglas import REGLAS, buscarNodosCon_YGenerar_
+import heapq
+from bisect import bisect_left, bisect_right
+from reglas import VISITANTES, Visitante, LíneasDeCódigo
 from utils import aplanar, mapear
 
 class Analizador(object):
+  def __init__(self):
+    self.clavesDeTipos = {} # (clave de tipo, tipos) -> si los nodos con esa clave son de alguno de esos tipos
   def AnalizarCódigoMalicioso(self, AST, código, desde, hasta):
-    resultado = []
-    for regla in self.clavesReglasCódigoMalicioso:
-      resultadoRegla = self.reglasCódigoMalicioso[regla](self, AST, código)
-      AgregarDe_A_Si_(resultadoRegla, resultado, lambda x : está_Entre_Y_(x, desde, hasta))
-    return resultado
+    return list(self.HallazgosCódigoMalicioso(AST, código, desde, hasta))
+  def HallazgosCódigoMalicioso(self, AST, código, desde, hasta):
+    visitantes = [self.reglasCódigoMalicioso[regla](self, código) for regla in self.clavesReglasCódigoMalicioso]
+    return self.hallazgosEnOrden(AST, visitantes, lambda x : está_Entre_Y_(x, desde, hasta))
   def AnalizarAst(self, AST, código, reglas, desde, hasta):
-    resultado = []
+    return list(self.HallazgosAst(AST, código, reglas, desde, hasta))
+  def HallazgosAst(self, AST, código, reglas, desde, hasta):
+    # Las reglas con visitante se evalúan todas en un mismo recorrido; los hallazgos salen en el orden de las reglas
+    líneas = LíneasDeCódigo(código)
+    fuentes = []
     for regla in reglas:
-      resultadoRegla = self.analizarRegla(AST, código, regla)
-      AgregarDe_A_Si_(resultadoRegla, resultado, lambda x : está_Entre_Y_(x, desde, hasta))
-    return resultado
-  def analizarRegla(self, AST, código, regla):
+      visitante = self.visitanteDeRegla(código, regla, líneas)
+      if visitante is None:
+        fuentes.append(lambda regla=regla : regla(AST, código))
+      elif isinstance(visitante, Visitante):
+        fuentes.append(visitante)
+      else:
+        fuentes.append(lambda visitante=visitante : visitante)
+    return self.hallazgosEnOrden(AST, fuentes, lambda x : está_Entre_Y_(x, desde, hasta))
+  def hallazgosEnOrden(self, AST, fuentes, fVal):
+    # Generador de los hallazgos que cumplen fVal, regla por regla. Cada fuente es un Visitante o una función que
+    # devuelve la lista de hallazgos de la regla (y que se llama recién cuando le toca). El AST se recorre una sola
+    # vez y sólo hasta donde haga falta para dar el próximo hallazgo, así quien quiere el primero no recorre el resto.
+    recorrido = self.recorrido(AST, [fuente for fuente in fuentes if isinstance(fuente, Visitante)])
+    for fuente in fuentes:
+      if isinstance(fuente, Visitante):
+        hallazgos = fuente.hallazgos
+        i = 0
+        while i < len(hallazgos) or next(recorrido, False):
+          if i < len(hallazgos):
+            if fVal(hallazgos[i]):
+              yield hallazgos[i]
+            i += 1
+      else:
+        for hallazgo in fuente():
+          if fVal(hallazgo):
+            yield hallazgo
+  def visitanteDeRegla(self, código, regla, líneas):
+    # None si la regla es una función (que recibe el AST y el código)
     if (type(regla) == type(lambda x : 0)):
-      return regla(AST, código)
-    if regla["key"] in REGLAS:
-      return REGLAS[regla["key"]](self, AST, código, regla)
+      return None
+    if regla["key"] in VISITANTES:
+      return VISITANTES[regla["key"]](self, código, regla, líneas)
     return [] # ¿Error?
+  def recorrer(self, AST, visitantes):
+    # Recorre el AST una sola vez y devuelve el resultado de cada visitante
+    for _ in self.recorrido(AST, visitantes):
+      pass
+    return [visitante.resultado() for visitante in visitantes]
+  def recorrido(self, AST, visitantes):
+    # Generador que recorre el AST (en preorden, sin recursión) mostrándole cada nodo a los visitantes a los que les
+    # interesa, y da True después de cada paso, para poder mirar los hallazgos que van juntando y cortar antes.
+    # Qué visitantes le interesan a un nodo se calcula una vez por tipo (claveDeTipo_) con es_NodoDeTipo_.
+    generales = [v for v in visitantes if v.tipos is None]
+    tipados = [v for v in visitantes if not (v.tipos is None)]
+    interesados = {}
+    pila = [(False, AST, None, [None] * len(generales))]
+    while len(pila) > 0:
+      saliendo, nodo, madre, estados = pila.pop()
+      if saliendo:
+        for visitante in estados:
+          visitante.salir(nodo)
+        yield True
+        continue
+      clave = self.claveDeTipo_(nodo)
+      if not (clave in interesados):
+        deEsteTipo = [v for v in tipados if self.es_NodoDeTipo_(nodo, v.tipos)]
+        interesados[clave] = (deEsteTipo, [v for v in generales + deEsteTipo if type(v).salir != Visitante.salir])
+      deEsteTipo, salientes = interesados[clave]
+      for visitante in deEsteTipo:
+        visitante.entrar(nodo, madre, None)
+      nuevos = [visitante.entrar(nodo, madre, estado) for visitante, estado in zip(generales, estados)]
+      if len(salientes) > 0:
+        pila.append((True, nodo, None, salientes))
+      for hijo in reversed(self.hijosDeNodo_(nodo)):
+        pila.append((False, hijo, nodo, nuevos))
+      yield True
 
   def nodosDeTipo_(self, AST, tipo):
-    return self.foldAST(lambda recs, x : aplanar(recs) + ([x] if self.es_NodoDeTipo_(x, tipo) else []), AST)
+    # Los nodos de tipo que hay en AST (incluido), cada uno después de los que tiene adentro. Salen del índice que
+    # arma AgregarAtributoMadre (ver indexarAST): los de AST son los que tienen posición entre la del primero de sus
+    # descendientes y la suya
+    índice = self.índiceDe_(AST)
+    posición = self.atributoDeNodo_(AST, "_posición")
+    if índice is None or posición is None:
+      return self.foldAST(lambda recs, x : aplanar(recs) + ([x] if self.es_NodoDeTipo_(x, tipo) else []), AST)
+    tipos = tuplaDeTipos(tipo)
+    claves = [clave for clave in índice.claves() if self.claveEsDeTipos_(clave, tipos)]
+    return índice.nodosEntre(claves, posición[0], posición[1])
+  def índiceDe_(self, nodo):
+    while not (self.nodoMadreDe_(nodo) is None):
+      nodo = self.nodoMadreDe_(nodo)
+    return self.atributoDeNodo_(nodo, "_índice")
+  def es_NodoDeTipo_(self, nodo, tipo):
+    if nodo is None:
+      return False
+    return self.claveEsDeTipos_(self.claveDeTipo_(nodo), tuplaDeTipos(tipo))
+  def claveEsDeTipos_(self, clave, tipos):
+    # Se calcula una vez por cada clave y tipos (con claveDeTipo_ de cada lenguaje)
+    if not ((clave, tipos) in self.clavesDeTipos):
+      self.clavesDeTipos[(clave, tipos)] = self.claveDeTipo_EsDe_(clave, tipos)
+    return self.clavesDeTipos[(clave, tipos)]
   def es_UnComandoCompuesto(self, nodo):
     return self.es_NodoDeTipo_(nodo, self.tiposComandosCompuestos())
   def es_RepeticiónSimple(self, nodo):
@@ -39,6 +125,10 @@ class Analizador(object):
   def foldAST(self, f, nodo):
     return f(mapear(lambda x : self.foldAST(f,x), self.hijosDeNodo_(nodo)), nodo)
   def nivelAnidaciónComandos_(self, nodo):
+    # Cuántos comandos compuestos tiene nodo por encima (lo calcula AgregarAtributoMadre, ver indexarAST)
+    anidación = self.atributoDeNodo_(nodo, "_anidación")
+    if not (anidación is None):
+      return anidación
     anidacionActual = 0
     nodoActual = nodo
     while nodoActual != None:
@@ -46,6 +136,70 @@ class Analizador(object):
       if self.es_UnComandoCompuesto(nodoActual):
         anidacionActual = anidacionActual + 1
     return anidacionActual
+  def comandoCompuestoQueContiene_(self, nodo):
+    # El comando compuesto más cercano por encima de nodo (None si no hay)
+    if not (self.atributoDeNodo_(nodo, "_anidación") is None):
+      return self.atributoDeNodo_(nodo, "_compuesto")
+    nodoActual = self.nodoMadreDe_(nodo)
+    while not (nodoActual is None) and not self.es_UnComandoCompuesto(nodoActual):
+      nodoActual = self.nodoMadreDe_(nodoActual)
+    return nodoActual
+
+def tuplaDeTipos(tipo):
+  # Los tipos se pasan como uno solo o como lista
+  return tuple(tipo) if type(tipo) == type([]) else (tipo,)
+
+def indexarAST(raíz, hijosDe, claveDe, anotar, esCompuesto=lambda nodo : False):
+  # Recorre el AST una vez, sin recursión: anota en cada nodo su madre ("_madre"), su posición ("_posición": la
+  # del primero de sus descendientes y la suya, numerando cada nodo después de los que tiene adentro), cuántos
+  # comandos compuestos tiene por encima ("_anidación") y cuál es el más cercano ("_compuesto"), y devuelve el
+  # índice de nodos por clave de tipo. anotar(nodo, nombre, valor) guarda el atributo en el nodo.
+  índice = ÍndiceDeTipos()
+  siguiente = 0
+  pila = [(raíz, None, None, 0, None)]
+  while len(pila) > 0:
+    nodo, madre, inicio, anidación, compuesto = pila.pop()
+    if inicio is None:
+      if not (madre is None):
+        anotar(nodo, "_madre", madre)
+      anotar(nodo, "_anidación", anidación)
+      anotar(nodo, "_compuesto", compuesto)
+      pila.append((nodo, madre, siguiente, None, None))
+      if esCompuesto(nodo):
+        anidación, compuesto = anidación + 1, nodo
+      for hijo in reversed(hijosDe(nodo)):
+        pila.append((hijo, nodo, None, anidación, compuesto))
+    else:
+      anotar(nodo, "_posición", (inicio, siguiente))
+      índice.agregar(claveDe(nodo), nodo, siguiente)
+      siguiente += 1
+  return índice
+
+class ÍndiceDeTipos(object):
+  # Para cada clave de tipo, sus nodos y sus posiciones, en orden
+  def __init__(self):
+    self.nodos = {}
+    self.posiciones = {}
+  def agregar(self, clave, nodo, posición):
+    if not (clave in self.nodos):
+      self.nodos[clave] = []
+      self.posiciones[clave] = []
+    self.nodos[clave].append(nodo)
+    self.posiciones[clave].append(posición)
+  def claves(self):
+    return self.nodos.keys()
+  def nodosEntre(self, claves, inicio, fin):
+    # Los nodos de esas claves con posición entre inicio y fin (inclusive), en orden
+    partes = []
+    for clave in claves:
+      posiciones = self.posiciones[clave]
+      desde = bisect_left(posiciones, inicio)
+      hasta = bisect_right(posiciones, fin)
+      if hasta > desde:
+        partes.append((posiciones[desde:hasta], self.nodos[clave][desde:hasta]))
+    if len(partes) == 1:
+      return partes[0][1]
+    return [nodo for _, nodo in heapq.merge(*map(lambda parte : zip(*parte), partes), key=lambda par : par[0])]
 
 def AgregarDe_A_Si_(listaFuente, listaDestino, fVal):
   for x in listaFuente:
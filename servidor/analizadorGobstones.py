@@ -2,17 +2,31 @@
 
 # Definición de la clase ASTNode de Gobstones: https://github.com/gobstones/gobstones-parser/blob/main/src/parser/ast.ts
 
-import os, json
-from analizadorBase import Analizador
-from procesos import ejecutar
-from utils import algunoCumple
+import os
+from operator import setitem
+from analizadorBase import Analizador, indexarAST
+from codec import cargar
+from procesos import ejecutar, LIMITE_SALIDA_AST
+from sesionesGobstones import ejecutarEnNode
+from msg import mensajeTimeout
+
+TIMEOUT_PARSE = 30 # segundos
 
 reglasCódigoMalicioso = {
   # No existe código malicioso en Gobstones
 }
 
+COMANDOS_COMPUESTOS = [
+  "N_StmtIf",
+  "N_StmtRepeat",
+  "N_StmtForeach",
+  "N_StmtWhile",
+  "N_StmtSwitch"
+]
+
 class AnalizadorGobstones(Analizador):
   def __init__(self, malicioso=reglasCódigoMalicioso.keys()):
+    Analizador.__init__(self)
     self.clavesReglasCódigoMalicioso = malicioso
     self.reglasCódigoMalicioso = reglasCódigoMalicioso
   def obtenerAst(self, codigo, ruta="."):
@@ -21,14 +35,15 @@ class AnalizadorGobstones(Analizador):
     return hijosDeNodo_(nodo)
   def nodoMadreDe_(self, nodo):
     return nodo["_madre"]
+  def atributoDeNodo_(self, nodo, nombre):
+    return nodo.get(nombre)
+  def claveDeTipo_(self, nodo):
+    return claveDeTipo(nodo)
+  def claveDeTipo_EsDe_(self, clave, tipos):
+    return not (clave is None) and clave in tipos
   def es_NodoSubordinadoDe_(self, nodoHijo, nodoMadre):
     # Para saber si tengo que indentar (falso si el nodo madre es la raíz)
     return not ("_tag" in nodoMadre) or nodoMadre["_tag"] != "N_Main"
-  def es_NodoDeTipo_(self, nodo, tipo):
-    if not (nodo is None) and ("_tag" in nodo):
-      tipos = tipo if type(tipo) == type([]) else [tipo]
-      return algunoCumple(lambda t : nodo["_tag"] == t, tipos)
-    return False
   def tiposNombre(self):
     return "Nombre"
   def nombreNodo_(self, nodo):
@@ -48,13 +63,7 @@ class AnalizadorGobstones(Analizador):
       "N_StmtReturn"
     ]
   def tiposComandosCompuestos(self):
-    return [
-      "N_StmtIf",
-      "N_StmtRepeat",
-      "N_StmtForeach",
-      "N_StmtWhile",
-      "N_StmtSwitch"
-    ]
+    return COMANDOS_COMPUESTOS
   def tiposRepeticiónSimple(self):
     return "N_StmtRepeat"
   def tiposImport(self):
@@ -91,12 +100,18 @@ def astGobstones(codigo, ruta="."):
   f = open(os.path.join(ruta, "src.txt"), 'w')
   f.write(codigo)
   f.close()
-  errcode, salida, falla = ejecutar("node /rtTest/gbs/dist/gobstones-lang parse -l es -i src.txt", ruta)
+  resultado = ejecutarEnNode("parse", ruta, TIMEOUT_PARSE, LIMITE_SALIDA_AST)
+  if resultado is None: # No se pudo usar el pool de Node
+    errcode, salida, falla = ejecutar("node /rtTest/gbs/dist/gobstones-lang parse -l es -i src.txt", ruta, topeBytes=LIMITE_SALIDA_AST)
+  elif resultado["resultado"] == "TIMEOUT":
+    return {"error":"TIMEOUT", "errorMsg":mensajeTimeout}
+  else:
+    errcode, salida, falla = resultado["errcode"], resultado["salida"], resultado["falla"]
   if (errcode == 134):
     return {"error":errcode, "errorMsg":"El código es más largo de lo permitido."}
   if len(falla) > 0:
     return {"error":falla}
-  AST = json.loads(json.loads(salida))
+  AST = cargar(cargar(salida))
   CorregirElseIfs(AST)
   AgregarTagNombre(AST)
   AgregarAtributoMadre(AST)
@@ -119,10 +134,12 @@ def CorregirElseIfs(nodo):
   for hijo in hijosDeNodo_(nodo):
     CorregirElseIfs(hijo)
 
-def AgregarAtributoMadre(nodo):
-  for hijo in hijosDeNodo_(nodo):
-    hijo["_madre"] = nodo
-    AgregarAtributoMadre(hijo)
+def AgregarAtributoMadre(AST):
+  # Además arma el índice de nodos por tipo y la anidación de comandos (ver indexarAST)
+  AST["_índice"] = indexarAST(AST, hijosDeNodo_, claveDeTipo, setitem, lambda nodo : claveDeTipo(nodo) in COMANDOS_COMPUESTOS)
+
+def claveDeTipo(nodo):
+  return nodo["_tag"] if ("_tag" in nodo) else None
 
 def AgregarTagNombre(nodo):
   if not ("_tag" in nodo) and ("_value" in nodo):
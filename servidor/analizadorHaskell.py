@@ -3,9 +3,9 @@
 # Documentación del parser de Haskell https://hackage.haskell.org/package/haskell-src-exts-1.23.1/docs/Language-Haskell-Exts-Syntax.html
 
 import os
-from analizadorBase import Analizador
-from procesos import ejecutar
-from utils import algunoCumple
+from operator import setitem
+from analizadorBase import Analizador, indexarAST
+from procesos import ejecutar, LIMITE_SALIDA_AST
 
 reglasCódigoMalicioso = {
   # TODO
@@ -13,6 +13,7 @@ reglasCódigoMalicioso = {
 
 class AnalizadorHaskell(Analizador):
   def __init__(self, malicioso=reglasCódigoMalicioso.keys()):
+    Analizador.__init__(self)
     self.clavesReglasCódigoMalicioso = malicioso
     self.reglasCódigoMalicioso = reglasCódigoMalicioso
   def obtenerAst(self, codigo, ruta="."):
@@ -21,14 +22,15 @@ class AnalizadorHaskell(Analizador):
     return hijosDeNodo_(nodo)
   def nodoMadreDe_(self, nodo):
     return nodo.["_madre"]
+  def atributoDeNodo_(self, nodo, nombre):
+    return nodo.get(nombre)
+  def claveDeTipo_(self, nodo):
+    return claveDeTipo(nodo)
+  def claveDeTipo_EsDe_(self, clave, tipos):
+    return clave in tipos
   def es_NodoSubordinadoDe_(self, nodoHijo, nodoMadre):
     # Para saber si tengo que indentar
     return True
-  def es_NodoDeTipo_(self, nodo, tipo):
-    if not (nodo is None):
-      tipos = tipo if type(tipo) == type([]) else [tipo]
-      return algunoCumple(lambda t : nodo["t"] == t, tipos)
-    return False
   def tiposNombre(self):
     return "Nombre"
   def nombreNodo_(self, nodo):
@@ -59,7 +61,7 @@ def astHaskell(codigo, ruta="."):
   f = open(os.path.join(ruta, 'src.hs'), 'w')
   f.write("{-# LANGUAGE TemplateHaskell #-}\n{-# LANGUAGE DataKinds #-}\n\n" + codigo)
   f.close()
-  errcode, salida, falla = ejecutar("echo 'main' | ghci -v0 /rtTest/parser.hs", ruta)
+  errcode, salida, falla = ejecutar("echo 'main' | ghci -v0 /rtTest/parser.hs", ruta, topeBytes=LIMITE_SALIDA_AST)
   if len(falla) > 0:
     # No debería pasar. Si el parser falla devuelve ParseFailed por stdout.
     pass
@@ -77,16 +79,18 @@ def astHaskell(codigo, ruta="."):
 def hijosDeNodo_(nodo):
   hijosPorAhora = []
   for k in nodo:
-    if not (k in ["t", "en", "valor", "original", "_madre"]):
+    if not (k in ["t", "en", "valor", "original", "_madre", "_posición", "_índice", "_anidación", "_compuesto"]):
       másHijos = nodo[k]
       for hijo in (másHijos if (type(másHijos) == type([])) else [másHijos]):
         hijosPorAhora.append(hijo)
   return hijosPorAhora
 
-def AgregarAtributoMadre(nodo):
-  for hijo in hijosDeNodo_(nodo):
-    hijo["_madre"] = nodo
-    AgregarAtributoMadre(hijo)
+def AgregarAtributoMadre(AST):
+  # Además arma el índice de nodos por tipo y la anidación (ver indexarAST; no hay comandos compuestos en Haskell)
+  AST["_índice"] = indexarAST(AST, hijosDeNodo_, claveDeTipo, setitem)
+
+def claveDeTipo(nodo):
+  return nodo.get("t")
 
 def líneaDeUbicación(ubicación):
   return (ubicación["línea"] - 3) if ("línea" in ubicación) else "?"
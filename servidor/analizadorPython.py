@@ -9,29 +9,40 @@ if versionDePython.major != 3 or versionDePython.minor != 12:
   exit()
 
 import ast
-from analizadorBase import Analizador
-from reglas import nodosDeNombresProhibidosEnAST, buscarNodoImportEnAST, buscarNodoRaiseEnAST, buscarNodoDeTipo_Con_
-from utils import algunoCumple, aplanar, mapear, singularSiEsta
+from analizadorBase import Analizador, indexarAST
+from reglas import visitanteNombresProhibidos, visitanteImport, visitanteRaise, visitanteDeTipo_Con_
+from utils import aplanar, mapear, singularSiEsta
 
-reglasCódigoMalicioso = {
-  "EXIT":lambda analizador, AST, código : nodosDeNombresProhibidosEnAST(analizador, AST, "exit"),
-  "PRINT":lambda analizador, AST, código : nodosDeNombresProhibidosEnAST(analizador, AST, "print"),
-  "OPEN":lambda analizador, AST, código : nodosDeNombresProhibidosEnAST(analizador, AST, "open"),
-  "EXEC":lambda analizador, AST, código : nodosDeNombresProhibidosEnAST(analizador, AST, "exec"),
-  "EVAL":lambda analizador, AST, código : nodosDeNombresProhibidosEnAST(analizador, AST, "eval"),
-  "GETATTR":lambda analizador, AST, código : nodosDeNombresProhibidosEnAST(analizador, AST, "getattr"),
-  "IMPORT":lambda analizador, AST, código : buscarNodoImportEnAST(analizador, AST),
-  "RAISE":lambda analizador, AST, código : buscarNodoRaiseEnAST(analizador, AST),
-  "NombrePrivado":lambda analizador, AST, código : buscarNodoDeTipo_Con_(analizador, AST, ast.Name,
+reglasCódigoMalicioso = { # Cada una devuelve el visitante que la evalúa (ver reglas.py)
+  "EXIT":lambda analizador, código : visitanteNombresProhibidos(analizador, "exit"),
+  "PRINT":lambda analizador, código : visitanteNombresProhibidos(analizador, "print"),
+  "OPEN":lambda analizador, código : visitanteNombresProhibidos(analizador, "open"),
+  "EXEC":lambda analizador, código : visitanteNombresProhibidos(analizador, "exec"),
+  "EVAL":lambda analizador, código : visitanteNombresProhibidos(analizador, "eval"),
+  "GETATTR":lambda analizador, código : visitanteNombresProhibidos(analizador, "getattr"),
+  "IMPORT":lambda analizador, código : visitanteImport(analizador),
+  "RAISE":lambda analizador, código : visitanteRaise(analizador),
+  "NombrePrivado":lambda analizador, código : visitanteDeTipo_Con_(analizador, ast.Name,
     lambda n : n.id.startswith("__"), lambda n : n.id
   ),
-  "AtributoPrivado":lambda analizador, AST, código : buscarNodoDeTipo_Con_(analizador, AST, ast.Attribute,
+  "AtributoPrivado":lambda analizador, código : visitanteDeTipo_Con_(analizador, ast.Attribute,
     lambda n : n.attr.startswith("__"), lambda n : n.attr
   )
 }
 
+COMANDOS_COMPUESTOS = [
+  ast.For,
+  ast.AsyncFor,
+  ast.While,
+  ast.If,
+  ast.With,
+  ast.AsyncWith,
+  ast.Try
+]
+
 class AnalizadorPython(Analizador):
   def __init__(self, malicioso=reglasCódigoMalicioso.keys()):
+    Analizador.__init__(self)
     self.clavesReglasCódigoMalicioso = malicioso
     self.reglasCódigoMalicioso = reglasCódigoMalicioso
   def obtenerAst(self, codigo, ruta="."):
@@ -42,14 +53,15 @@ class AnalizadorPython(Analizador):
     return hijosDeNodo_(nodo)
   def nodoMadreDe_(self, nodo):
     return nodo._madre
+  def atributoDeNodo_(self, nodo, nombre):
+    return getattr(nodo, nombre, None)
+  def claveDeTipo_(self, nodo):
+    return type(nodo)
+  def claveDeTipo_EsDe_(self, clave, tipos):
+    return any(map(lambda t : issubclass(clave, t), tipos))
   def es_NodoSubordinadoDe_(self, nodoHijo, nodoMadre):
     # Para saber si tengo que indentar
     return True
-  def es_NodoDeTipo_(self, nodo, tipo):
-    if not (nodo is None):
-      tipos = tipo if type(tipo) == type([]) else [tipo]
-      return algunoCumple(lambda t : isinstance(nodo, t), tipos)
-    return False
   def tiposNombre(self):
     return ast.Name
   def nombreNodo_(self, nodo):
@@ -78,15 +90,7 @@ class AnalizadorPython(Analizador):
       ast.Continue
     ]
   def tiposComandosCompuestos(self):
-    return [
-      ast.For,
-      ast.AsyncFor,
-      ast.While,
-      ast.If,
-      ast.With,
-      ast.AsyncWith,
-      ast.Try
-    ]
+    return COMANDOS_COMPUESTOS
   def tiposRepeticiónSimple(self):
     return [] # No hay repetición simple en Python
   def tiposImport(self):
@@ -382,10 +386,9 @@ def hijosComprehension(comprehension): # es una lista
 def hijosMatchCase(cases): # es una lista
   return aplanar(mapear(lambda x : ([x.pattern] + x.body + singularSiEsta(x.guard)), cases))
 
-def AgregarAtributoMadre(nodo):
-  for hijo in hijosDeNodo_(nodo):
-    hijo._madre = nodo
-    AgregarAtributoMadre(hijo)
+def AgregarAtributoMadre(AST):
+  # Además arma el índice de nodos por tipo y la anidación de comandos (ver indexarAST)
+  AST._índice = indexarAST(AST, hijosDeNodo_, type, setattr, lambda nodo : isinstance(nodo, tuple(COMANDOS_COMPUESTOS)))
 
 def hijosDeNodo_(nodo):
   return HIJOS[type(nodo).__name__](nodo)
\ No newline at end of file
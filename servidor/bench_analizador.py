@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+
+# Mide el análisis de código sobre entregas grandes de Gobstones y de Python: armar el índice de nodos por tipo
+# (AgregarAtributoMadre), nodosDeTipo_ con el índice y con foldAST (como era antes) y el análisis con todas las reglas.
+# Uso (desde la carpeta servidor, con python 3.12): python3 bench_analizador.py [repeticiones]
+
+import os, sys, time, tempfile
+
+if not ('GOBSTONES_LANG' in os.environ):
+  os.environ['GOBSTONES_LANG'] = os.path.abspath("gobstones-lang/dist/gobstones-lang")
+
+from analizadorPython import AnalizadorPython, AgregarAtributoMadre as AgregarAtributoMadrePython
+from analizadorGobstones import AnalizadorGobstones, AgregarAtributoMadre as AgregarAtributoMadreGobstones
+from utils import aplanar
+
+REGLAS = [{"key":"CMD_X_LINE"}, {"key":"NEST_CMD","max":3}, {"key":"NAME_VOID","nombres":["x"]}]
+REGLAS_GOBSTONES = REGLAS + [{"key":"INDENT_NEST"}] # En Python, INDENT_NEST no anda (los nodos de contexto no tienen línea)
+
+def entregaPython(funciones):
+  código = ""
+  for i in range(funciones):
+    código += "def f" + str(i) + "(xs):\n  total = 0\n  for x in xs:\n    if x % 2 == 0:\n      total = total + x\n"
+    código += "    else:\n      while x > 0:\n        x = x - 1; total = total - 1\n  return total\n\n"
+  return "Python (" + str(funciones) + " funciones)", AnalizadorPython(), código, REGLAS
+
+def entregaGobstones(procedimientos):
+  código = "program {\n" + "".join(map(lambda i : "  P" + str(i) + "()\n", range(procedimientos))) + "}\n"
+  for i in range(procedimientos):
+    código += "procedure P" + str(i) + "() {\n  repeat (" + str(i) + ") {\n    Poner(Rojo); Mover(Este)\n"
+    código += "    if (puedeMover(Norte)) {\n      while (hayBolitas(Azul)) { Sacar(Azul) }\n    }\n  }\n}\n"
+  return "Gobstones (" + str(procedimientos) + " procedimientos)", AnalizadorGobstones(), código, REGLAS_GOBSTONES
+
+def medir(f, repeticiones):
+  inicio = time.perf_counter()
+  for i in range(repeticiones):
+    f()
+  return (time.perf_counter() - inicio) / repeticiones * 1000
+
+def nodosConFold(analizador, AST, tipo):
+  return analizador.foldAST(lambda recs, x : aplanar(recs) + ([x] if analizador.es_NodoDeTipo_(x, tipo) else []), AST)
+
+def main(repeticiones):
+  ruta = tempfile.mkdtemp()
+  print("{:<36} {:>8} {:>10} {:>14} {:>14} {:>12}".format("entrega", "nodos", "índice", "nodosDeTipo_", "con foldAST", "reglas"))
+  for nombre, analizador, código, reglas in [entregaPython(50), entregaPython(400), entregaGobstones(20), entregaGobstones(60)]:
+    resultado = analizador.obtenerAst(código, ruta)
+    if "error" in resultado:
+      print(nombre + ": " + str(resultado["error"])[:200])
+      continue
+    AST = resultado["ast"]
+    agregar = AgregarAtributoMadrePython if isinstance(analizador, AnalizadorPython) else AgregarAtributoMadreGobstones
+    tipos = analizador.tiposComandos()
+    nodos = len(analizador.foldAST(lambda recs, x : aplanar(recs) + [x], AST))
+    print("{:<36} {:>8} {:>10.2f} {:>14.3f} {:>14.2f} {:>12.2f}".format(nombre, nodos,
+      medir(lambda : agregar(AST), repeticiones),
+      medir(lambda : analizador.nodosDeTipo_(AST, tipos), repeticiones),
+      medir(lambda : nodosConFold(analizador, AST, tipos), repeticiones),
+      medir(lambda : analizador.AnalizarAst(AST, código, reglas, 1, código.count("\n") + 1), repeticiones)))
+  print("(tiempos en ms)")
+
+if __name__ == '__main__':
+  main(int(sys.argv[1]) if len(sys.argv) > 1 else 5)
@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+
+# Compara los backends de codec.py (json, orjson, ujson) sobre payloads reales del servidor.
+# Uso (desde la carpeta servidor, con python 3.12): python3 bench_codec.py [repeticiones]
+
+import os, sys, time, tempfile, importlib
+import codec
+
+BACKENDS = ["json", "orjson", "ujson"]
+
+def payloadCurso():
+  # Las actividades públicas del curso más grande (lo que devuelve /login con dataEjs)
+  import data
+  curso = max(data.CURSOS_publico, key=lambda c : len(data.CURSOS_publico[c]["actividades_por_id"]))
+  return "curso " + curso, data.CURSOS_publico[curso]["actividades"]
+
+def payloadAstGobstones():
+  # El AST que devuelve gobstones-lang para un programa largo (lo que decodifica astGobstones)
+  from procesos import ejecutar
+  programa = "program {\n" + "".join(map(lambda i : "  Mover" + str(i) + "()\n", range(30))) + "}\n"
+  for i in range(30):
+    programa += "procedure Mover" + str(i) + "() {\n  repeat (" + str(i) + ") {\n    Poner(Rojo)\n    if (puedeMover(Norte)) { Mover(Norte) }\n  }\n}\n"
+  ruta = tempfile.mkdtemp()
+  f = open(os.path.join(ruta, "src.txt"), 'w')
+  f.write(programa)
+  f.close()
+  errcode, salida, falla = ejecutar("node " + os.path.abspath("gobstones-lang/dist/gobstones-lang") + " parse -l es -i src.txt", ruta)
+  if errcode != 0:
+    return None
+  return "AST Gobstones", codec.cargar(codec.cargar(salida))
+
+def payloadTablero():
+  # Un tablero final de 30x30 (lo que decodifica CorrectorGobstones)
+  celda = lambda x, y : {"a":x % 3, "n":0, "r":y % 5, "v":1}
+  return "tablero 30x30", {"head":[3,4], "width":30, "height":30,
+    "board":list(map(lambda x : list(map(lambda y : celda(x, y), range(30))), range(30)))}
+
+def payloadIntento():
+  # El cuerpo de un POST /code
+  src = "def f(x):\n" + "".join(map(lambda i : "  x = x + " + str(i) + " # ñandú\n", range(100))) + "  return x\n"
+  return "POST /code", {"usuario":"estudiante", "contrasenia":"123456", "curso":"inpr_unq_2026_s2",
+    "actividad":"guia1_ej1", "lenguaje":"Python", "src":src}
+
+def medir(f, repeticiones):
+  inicio = time.perf_counter()
+  for i in range(repeticiones):
+    f()
+  return (time.perf_counter() - inicio) / repeticiones * 1000000
+
+def main(repeticiones):
+  payloads = []
+  for generador in [payloadCurso, payloadAstGobstones, payloadTablero, payloadIntento]:
+    try:
+      payload = generador()
+    except Exception as e:
+      payload = None
+      print("(sin payload de " + generador.__name__ + ": " + str(e) + ")")
+    if not (payload is None):
+      payloads.append(payload)
+  print("{:<28} {:>8} {:>12} {:>12}".format("payload", "backend", "cargar (µs)", "volcar (µs)"))
+  for nombre, valor in payloads:
+    for backend in BACKENDS:
+      os.environ["JSON_BACKEND"] = backend
+      c = importlib.reload(codec)
+      if c.BACKEND != backend:
+        continue
+      texto = c.volcar(valor)
+      print("{:<28} {:>8} {:>12.1f} {:>12.1f}".format(nombre + " (" + str(len(texto) // 1024) + " KB)", backend,
+        medir(lambda : c.cargar(texto), repeticiones), medir(lambda : c.volcar(valor), repeticiones)))
+
+if __name__ == '__main__':
+  main(int(sys.argv[1]) if len(sys.argv) > 1 else 50)
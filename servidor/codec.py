@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+
+import os, re, json
+
+# Codificación y decodificación de JSON para todo el servidor (pedidos, respuestas, ASTs y tableros de Gobstones).
+# Usa orjson o ujson si están instalados y si no la biblioteca estándar. La variable de entorno JSON_BACKEND
+# (orjson, ujson o json) fuerza uno en particular.
+
+BACKENDS_PREFERIDOS = ["orjson", "ujson", "json"]
+
+def elegirBackend():
+  candidatos = [os.environ["JSON_BACKEND"]] if "JSON_BACKEND" in os.environ else BACKENDS_PREFERIDOS
+  for nombre in candidatos:
+    if nombre == "json":
+      break
+    try:
+      return nombre, __import__(nombre)
+    except ImportError:
+      continue
+  return "json", json
+
+BACKEND, moduloBackend = elegirBackend()
+
+def cargarStd(texto):
+  return json.loads(texto)
+
+def volcarStd(valor, default=None):
+  return bytes(json.dumps(valor, ensure_ascii=False, default=default), 'utf-8')
+
+if BACKEND == "orjson":
+  def cargarBackend(texto):
+    return moduloBackend.loads(texto)
+  def volcarBackend(valor, default=None):
+    return moduloBackend.dumps(valor, default=default, option=moduloBackend.OPT_NON_STR_KEYS)
+elif BACKEND == "ujson":
+  def cargarBackend(texto):
+    return moduloBackend.loads(texto)
+  def volcarBackend(valor, default=None):
+    if default is None:
+      return bytes(moduloBackend.dumps(valor, ensure_ascii=False, escape_forward_slashes=False), 'utf-8')
+    return bytes(moduloBackend.dumps(valor, ensure_ascii=False, escape_forward_slashes=False, default=default), 'utf-8')
+else:
+  cargarBackend = cargarStd
+  volcarBackend = volcarStd
+
+# Una tira de 19 dígitos o más puede ser un entero que no entra en 64 bits: orjson lo pasa a float (perdiendo
+# precisión) y ujson no lo lee. En ese caso se usa la biblioteca estándar (también por un número con muchos
+# decimales o dígitos dentro de un string, que es más lento pero da lo mismo)
+NÚMERO_LARGO = re.compile("[0-9]{19}")
+NÚMERO_LARGO_BYTES = re.compile(b"[0-9]{19}")
+
+def cargar(texto):
+  # texto puede ser str o bytes (UTF-8). Da lo mismo que json.loads
+  if cargarBackend is cargarStd or (NÚMERO_LARGO_BYTES if isinstance(texto, (bytes, bytearray)) else NÚMERO_LARGO).search(texto):
+    return cargarStd(texto)
+  try:
+    return cargarBackend(texto)
+  except (TypeError, ValueError, OverflowError):
+    # Lo que los backends acelerados no aceptan y json.loads sí (NaN, surrogates sueltos): si tampoco es JSON
+    # válido para la biblioteca estándar, sale su error
+    return cargarStd(texto)
+
+def volcar(valor, default=None):
+  # Devuelve los bytes (UTF-8, sin escapar caracteres no ASCII) del JSON de valor
+  try:
+    return volcarBackend(valor, default)
+  except (TypeError, ValueError, OverflowError):
+    # Hay valores que los backends acelerados no soportan (por ejemplo enteros de más de 64 bits)
+    return volcarStd(valor, default)
+
+def volcarTexto(valor, default=None):
+  return volcar(valor, default).decode('utf-8')
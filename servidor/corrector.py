@@ -1,12 +1,15 @@
 # -*- coding: utf-8 -*-
 
-import os, shutil
 from correctorPython import correctorPython
 from correctorGobstones import correctorGobstones
 from correctorHaskell import correctorHaskell
+from correctorBase import casosEnParalelo
+from planificador import turnoDeCorrección
+from sandboxes import sandbox
+from gruposDeControl import grupoDeCorrección
 from utils import ejecutandoLocal
 
-def run_code(jsonObj, v):
+def run_code(jsonObj, v, alProgresar=None):
   if (not ("src" in jsonObj)):
     if (v):
       print("Falta src")
@@ -16,34 +19,30 @@ def run_code(jsonObj, v):
       print("Falta lenguaje")
     return {"resultado":"Error", "error":"Falta lenguaje"}
   if (jsonObj["lenguaje"] == "Python"):
-    resultado = corregir(correctorPython, jsonObj, v)
+    resultado = corregir(correctorPython, jsonObj, v, alProgresar)
   elif (jsonObj["lenguaje"] == "Haskell"):
-    resultado = corregir(correctorHaskell, jsonObj, v)
+    resultado = corregir(correctorHaskell, jsonObj, v, alProgresar)
   elif (jsonObj["lenguaje"] == "Gobstones"):
-    resultado = corregir(correctorGobstones, jsonObj, v)
+    resultado = corregir(correctorGobstones, jsonObj, v, alProgresar)
   else:
     if (v):
       print(jsonObj["lenguaje"])
     return {"resultado":"Error", "error":"Lenguaje desconocido: " + jsonObj["lenguaje"]}
   return resultado
 
-def corregir(corrector, jsonObj, v):
-  usuario = limpiar(jsonObj['usuario'])
-  ruta = os.path.join('/','rtTest', usuario)
-  if os.path.isdir(ruta):
-    shutil.rmtree(ruta)
-  os.mkdir(ruta)
-  os.chmod(ruta, 0o777)
-  resultado = corrector.corregir(jsonObj, ruta, v)
-  if not ejecutandoLocal():
-    shutil.rmtree(ruta)
-  return resultado
+def corregir(corrector, jsonObj, v, alProgresar=None):
+  # Espera su turno en el planificador: ocupa un lugar por cada caso que corre a la vez
+  slots = casosEnParalelo(jsonObj["ejercicio"]) if "ejercicio" in jsonObj else 1
+  with turnoDeCorrección(jsonObj.get("curso"), jsonObj.get("usuario"), jsonObj.get("prioridad", 1), slots):
+    return corregirEnSandbox(corrector, jsonObj, v, slots, alProgresar)
 
-def limpiar(textoOriginal):
-  resultado = ""
-  for x in textoOriginal:
-    if x in "1234567890qwertyuiopasdfghjklñzxcvbnmQWERTYUIOPASDFGHJKLÑZXCVBNM":
-      resultado += x
-    else:
-      resultado += "_"
-  return resultado
\ No newline at end of file
+def corregirEnSandbox(corrector, jsonObj, v, slots=1, alProgresar=None):
+  # Ejecutando local, la carpeta de trabajo no se vacía, para poder mirarla
+  with sandbox(conservar=ejecutandoLocal()) as ruta:
+    if (v):
+      print("Corrigiendo en " + ruta)
+    # Con cgroups, la entrega tiene topes de CPU, memoria y procesos según sus lugares, y el resultado suma lo que consumió
+    with grupoDeCorrección(ruta, slots) as grupo:
+      resultado = corrector.corregir(jsonObj, ruta, v, alProgresar)
+      resultado.update(grupo.consumo())
+      return resultado
@@ -1,10 +1,28 @@
 import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from procesos import ejecutarConTimeout
 from msg import mensajeTimeout
 
 def timeoutDefault():
   return 2
 
+class Lote(object):
+  # Las ejecuciones de todos los run_data de una entrega. Por defecto cada una es un proceso aparte; los
+  # correctores que pueden reusar lo que ya compilaron (o el proceso que ya lo tiene cargado) lo redefinen.
+  def __init__(self, corrector, jsonObj, ruta, timeout):
+    self.corrector = corrector
+    self.jsonObj = jsonObj
+    self.ruta = ruta
+    self.timeout = timeout
+
+  def ejecutar(self, code, code_run):
+    # El archivo de este caso ya está escrito en la ruta
+    return self.corrector.Ejecutar(self.jsonObj, self.ruta, self.timeout)
+
+  def cerrar(self):
+    pass
+
 class Corrector(object):
   def __init__(self):
     self.globalPre = ""
@@ -12,12 +30,19 @@ class Corrector(object):
   def AdaptarResultado(self, resultadoEjecucion, code, code_run, aridad):
     pass
 
+  def Ejecutar(self, jsonObj, ruta, timeout, cancelado=None):
+    return ejecutarConTimeout(self.comando, timeout, ruta, cancelado)
+
+  def NuevoLote(self, jsonObj, ruta, timeout):
+    return Lote(self, jsonObj, ruta, timeout)
+
   def validaciónFinal(self, run, resultadoEjecucion, v):
     if resultadoEjecucion["errcode"] != 0:
       return {"resultado":"NO"}
     return None
 
-  def corregir(self, jsonObj, ruta, v):
+  def corregir(self, jsonObj, ruta, v, alProgresar=None):
+    # alProgresar(hechos, total), si está, se llama después de cada run_data que pasó
     if (v):
       print(jsonObj["src"])
     ## Código
@@ -59,52 +84,123 @@ class Corrector(object):
     ## Timeout
     timeout = jsonObj["ejercicio"]["timeout"] if ("timeout" in jsonObj["ejercicio"]) else timeoutDefault()
     ## Ejecuciones
+    if casosEnParalelo(jsonObj["ejercicio"]) > 1:
+      return self.corregirEnParalelo(jsonObj, code, lineasAdicionales, run_data, ruta, timeout, v, alProgresar)
     duraciones = []
-    for run in run_data:
-      self.InicializarRun(run, ruta)
-      code_run = {
-        "pre":code["pre"],
-        "post":code["post"],
-        "lineasAdicionales":lineasAdicionales
-      }
-      ## Inicialización
-      if "pre" in run:
-        code_run["pre"] = code_run["pre"] + "\n\n" + run["pre"]
-        code_run["lineasAdicionales"] = code_run["lineasAdicionales"] + run["pre"].count("\n") + 2
-      self.AgregarCódigoVariablesDefinidas(run, jsonObj, code_run)
-      ## Aridad de funciones correcta
-      aridad = None
-      if "aridad" in run:
-        aridad = run["aridad"]
-      elif "aridad" in jsonObj["ejercicio"]:
-        aridad = jsonObj["ejercicio"]["aridad"]
-      if not (aridad is None):
-        self.AgregarCódigoAridadFunciones(aridad, code_run)
-      ## Resultado
-      if "post" in run:
-        code_run["post"] += "\n\n" + run["post"]
-      if "assert" in run:
-        self.AgregarCódigoResultado(code_run, run["assert"])
-      ## Ejecución del código entregado
-      code_run["pre"] += "\n\n"
-      code_run["lineasAdicionales"] = code_run["lineasAdicionales"] + 2
-      f = open(os.path.join(ruta, self.ruta), 'w')
-      f.write(code_run["pre"] + code["src"] + code_run["post"])
-      f.close()
-      resultadoEjecucion = ejecutarConTimeout(self.comando, timeout, ruta)
-      if resultadoEjecucion["resultado"] == "TIMEOUT":
-        return {"resultado":"Except", "error":mensajeTimeout}
-      duraciones.append(resultadoEjecucion["duracion"])
-      self.AdaptarResultado(resultadoEjecucion, code, code_run, aridad)
-      ## Buscar errores
-      if len(resultadoEjecucion["falla"]) > 0:
-        if (v):
-          print(resultadoEjecucion["falla"])
-        fallaReal = self.buscarFalla(resultadoEjecucion["falla"], code, code_run)
-        if not (fallaReal is None):
-          return {"resultado":"Except", "error":fallaReal}
-      ## Validación final
-      validaciónFinal = self.validaciónFinal(run, resultadoEjecucion, v)
-      if not (validaciónFinal is None):
-        return validaciónFinal
-    return {"resultado":"OK","duracion":sum(duraciones)/len(duraciones)}
+    lote = self.NuevoLote(jsonObj, ruta, timeout)
+    try:
+      for run in run_data:
+        code_run, aridad = self.prepararRun(run, jsonObj, code, lineasAdicionales, ruta)
+        resultadoEjecucion = lote.ejecutar(code, code_run)
+        falla = self.evaluarRun(run, resultadoEjecucion, code, code_run, aridad, v)
+        if not (falla is None):
+          return falla
+        duraciones.append(resultadoEjecucion["duracion"])
+        if not (alProgresar is None):
+          alProgresar(len(duraciones), len(run_data))
+    finally:
+      lote.cerrar()
+    return {"resultado":"OK","duracion":sum(duraciones)/len(duraciones),"duraciones":duraciones}
+
+  def corregirEnParalelo(self, jsonObj, code, lineasAdicionales, run_data, ruta, timeout, v, alProgresar):
+    # Cada caso en su propia carpeta y en un hilo aparte. Cuando un caso falla se cancelan los que siguen (los
+    # anteriores tienen que terminar igual): el resultado es el del primer caso que falla, como en orden.
+    casos = []
+    for i in range(len(run_data)):
+      rutaCaso = os.path.join(ruta, "caso" + str(i))
+      os.mkdir(rutaCaso)
+      os.chmod(rutaCaso, 0o777)
+      code_run, aridad = self.prepararRun(run_data[i], jsonObj, code, lineasAdicionales, rutaCaso)
+      casos.append({"run":run_data[i], "ruta":rutaCaso, "code_run":code_run, "aridad":aridad, "cancelado":threading.Event()})
+    fallas = {}
+    duraciones = [None] * len(casos)
+    ejecutor = ThreadPoolExecutor(max_workers=min(len(casos), casosEnParalelo(jsonObj["ejercicio"])))
+    try:
+      futuros = [ejecutor.submit(self.Ejecutar, jsonObj, caso["ruta"], timeout, caso["cancelado"]) for caso in casos]
+      pendientes = set(futuros)
+      while any(map(lambda i : duraciones[i] is None and not (i in fallas), range(primeraFalla(fallas, len(casos))))):
+        hechos, pendientes = wait(pendientes, return_when=FIRST_COMPLETED)
+        for futuro in hechos:
+          i = futuros.index(futuro)
+          if futuro.cancelled() or i > primeraFalla(fallas, len(casos)):
+            continue
+          caso = casos[i]
+          resultadoEjecucion = futuro.result()
+          falla = self.evaluarRun(caso["run"], resultadoEjecucion, code, caso["code_run"], caso["aridad"], v)
+          if falla is None:
+            duraciones[i] = resultadoEjecucion["duracion"]
+            if not (alProgresar is None):
+              alProgresar(len([d for d in duraciones if not (d is None)]), len(casos))
+            continue
+          fallas[i] = falla
+          for j in range(i + 1, len(casos)): # Los que siguen ya no hacen falta
+            futuros[j].cancel()
+            casos[j]["cancelado"].set()
+    finally:
+      for caso in casos:
+        caso["cancelado"].set()
+      ejecutor.shutdown(wait=True, cancel_futures=True)
+    if len(fallas) > 0:
+      return fallas[min(fallas)]
+    return {"resultado":"OK","duracion":sum(duraciones)/len(duraciones),"duraciones":duraciones}
+
+  def prepararRun(self, run, jsonObj, code, lineasAdicionales, ruta):
+    # Escribe en la ruta el archivo del caso y devuelve su código y la aridad a verificar
+    self.InicializarRun(run, ruta)
+    code_run = {
+      "pre":code["pre"],
+      "post":code["post"],
+      "lineasAdicionales":lineasAdicionales
+    }
+    ## Inicialización
+    if "pre" in run:
+      code_run["pre"] = code_run["pre"] + "\n\n" + run["pre"]
+      code_run["lineasAdicionales"] = code_run["lineasAdicionales"] + run["pre"].count("\n") + 2
+    self.AgregarCódigoVariablesDefinidas(run, jsonObj, code_run)
+    ## Aridad de funciones correcta
+    aridad = None
+    if "aridad" in run:
+      aridad = run["aridad"]
+    elif "aridad" in jsonObj["ejercicio"]:
+      aridad = jsonObj["ejercicio"]["aridad"]
+    if not (aridad is None):
+      self.AgregarCódigoAridadFunciones(aridad, code_run)
+    ## Resultado
+    if "post" in run:
+      code_run["post"] += "\n\n" + run["post"]
+    if "assert" in run:
+      self.AgregarCódigoResultado(code_run, run["assert"])
+    ## Ejecución del código entregado
+    code_run["pre"] += "\n\n"
+    code_run["lineasAdicionales"] = code_run["lineasAdicionales"] + 2
+    f = open(os.path.join(ruta, self.ruta), 'w')
+    f.write(code_run["pre"] + code["src"] + code_run["post"])
+    f.close()
+    return code_run, aridad
+
+  def evaluarRun(self, run, resultadoEjecucion, code, code_run, aridad, v):
+    # None si el caso pasó, o el resultado de la corrección si no
+    if resultadoEjecucion["resultado"] == "TIMEOUT":
+      return {"resultado":"Except", "error":mensajeTimeout}
+    self.AdaptarResultado(resultadoEjecucion, code, code_run, aridad)
+    ## Buscar errores
+    if len(resultadoEjecucion["falla"]) > 0:
+      if (v):
+        print(resultadoEjecucion["falla"])
+      fallaReal = self.buscarFalla(resultadoEjecucion["falla"], code, code_run)
+      if not (fallaReal is None):
+        return {"resultado":"Except", "error":fallaReal}
+    ## Validación final
+    return self.validaciónFinal(run, resultadoEjecucion, v)
+
+def casosEnParalelo(ejercicio):
+  # Cuántos casos de un ejercicio se corren a la vez: 1 salvo que el ejercicio tenga "paralelo" (true, o un
+  # máximo), y nunca más que los procesadores del servidor
+  paralelo = ejercicio.get("paralelo", False)
+  if paralelo is False:
+    return 1
+  máximo = os.cpu_count() or 1
+  return máximo if paralelo is True else max(1, min(int(paralelo), máximo))
+
+def primeraFalla(fallas, total):
+  return min(fallas) if len(fallas) > 0 else total
@@ -1,6 +1,8 @@
-import os, json
-from correctorBase import Corrector
+import os
+from correctorBase import Corrector, Lote
+from codec import cargar, volcarTexto
 from analizador import analizarGobstones
+from sesionesGobstones import ejecutarEnNode, LoteNode
 from utils import mostrar_excepcion
 
 class CorrectorGobstones(Corrector):
@@ -19,11 +21,21 @@ class CorrectorGobstones(Corrector):
         return {"resultado":"Except", "error":errorMsg}
     return resultadoAnalisisCodigo
 
+  def Ejecutar(self, jsonObj, ruta, timeout, cancelado=None):
+    # En un trabajador de Node que ya tiene cargado gobstones-lang (y si no se puede, con el comando de siempre)
+    resultado = ejecutarEnNode("run", ruta, timeout, cancelado=cancelado)
+    if resultado is None:
+      return super().Ejecutar(jsonObj, ruta, timeout, cancelado)
+    return resultado
+
+  def NuevoLote(self, jsonObj, ruta, timeout):
+    return LoteGobstones(self, jsonObj, ruta, timeout)
+
   def InicializarRun(self, run, ruta):
     ## Tablero inicial
     tablero = run["t0"] if "t0" in run else tablero_default()
     f = open(os.path.join(ruta, 'board.jboard'), 'w')
-    f.write(json.dumps(tablero))
+    f.write(volcarTexto(tablero))
     f.close()
 
   def AgregarCódigoVariablesDefinidas(self, run, jsonObj, code_run):
@@ -40,7 +52,7 @@ class CorrectorGobstones(Corrector):
 
   def validaciónFinal(self, run, resultadoEjecucion, v):
     try:
-      salida = json.loads(resultadoEjecucion["salida"])
+      salida = cargar(resultadoEjecucion["salida"])
     except Exception as e:
       if (v):
         mostrar_excepcion(e)
@@ -76,6 +88,24 @@ class CorrectorGobstones(Corrector):
             return {"resultado":"NO"}
     return None
 
+class LoteGobstones(Lote):
+  # Todos los tableros en el mismo trabajador de Node, que compila el programa una sola vez
+  def __init__(self, corrector, jsonObj, ruta, timeout):
+    super().__init__(corrector, jsonObj, ruta, timeout)
+    self.lote = LoteNode()
+
+  def ejecutar(self, code, code_run):
+    resultado = None if self.lote is None else self.lote.ejecutar("run", self.ruta, self.timeout)
+    if resultado is None: # No se pudo usar el pool: los casos que quedan van con el comando de siempre
+      self.cerrar()
+      return super().ejecutar(code, code_run)
+    return resultado
+
+  def cerrar(self):
+    if not (self.lote is None):
+      self.lote.cerrar()
+      self.lote = None
+
 correctorGobstones = CorrectorGobstones()
 
 def tablero_valido(t):
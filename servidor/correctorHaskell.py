@@ -1,5 +1,9 @@
-from correctorBase import Corrector
+import re
+from correctorBase import Corrector, Lote
 from analizador import analizarHaskell
+from sesionesHaskell import ejecutarEnGhci, LoteGhci
+
+MAIN_LOTE = "mainDelLote" # El main de cada caso cuando se corre en el módulo que ya está cargado
 
 class CorrectorHaskell(Corrector):
   def __init__(self):
@@ -11,6 +15,16 @@ class CorrectorHaskell(Corrector):
   def Analizar(self, código, reglas, extras):
     return analizarHaskell(código, reglas, extras)
 
+  def Ejecutar(self, jsonObj, ruta, timeout, cancelado=None):
+    # En una sesión de GHCi que ya está abierta (y si no se puede, con el comando de siempre)
+    resultado = ejecutarEnGhci(ruta, timeout, cancelado=cancelado)
+    if resultado is None:
+      return super().Ejecutar(jsonObj, ruta, timeout, cancelado)
+    return resultado
+
+  def NuevoLote(self, jsonObj, ruta, timeout):
+    return LoteHaskell(self, jsonObj, ruta, timeout)
+
   def InicializarRun(self, run, ruta):
     self.tmpAridad = ""
 
@@ -26,7 +40,8 @@ class CorrectorHaskell(Corrector):
     self.tmpAridad = verificacion_aridad # la necesito después
 
   def AgregarCódigoResultado(self, code_run, assertCode):
-    code_run["post"] += "\n\nmain :: IO ()\nmain = do" + self.tmpAridad + "\n  if (" + assertCode + ")\n    then do\n      exitSuccess\n    else do\n      exitWith (ExitFailure 1)"
+    code_run["main"] = self.tmpAridad + "\n  if (" + assertCode + ")\n    then do\n      exitSuccess\n    else do\n      exitWith (ExitFailure 1)"
+    code_run["post"] += textoMain("main", code_run["main"])
 
   def AdaptarResultado(self, resultadoEjecucion, code, code_run, aridad):
     # Haskell siempre devuelve errcode 0 y manda el verdadero exitcode a través del campo 'falla'
@@ -35,8 +50,45 @@ class CorrectorHaskell(Corrector):
   def buscarFalla(self, falla, code, code_run):
     return falla # Ya la procesé en AdaptarResultado
 
+class LoteHaskell(Lote):
+  # Todos los casos en la misma sesión de GHCi. Si el archivo de un caso sólo difiere en main del que ya está
+  # cargado, el caso define y corre su main en la sesión sin volver a cargar el archivo. Si eso no compila
+  # (por ejemplo, por la aridad) se carga el archivo completo, para que el error sea el de siempre.
+  def __init__(self, corrector, jsonObj, ruta, timeout):
+    super().__init__(corrector, jsonObj, ruta, timeout)
+    self.lote = LoteGhci()
+    self.cargado = None # El archivo cargado en la sesión, sin su main
+
+  def ejecutar(self, code, code_run):
+    base = None
+    if "main" in code_run:
+      base = (code_run["pre"] + code["src"] + code_run["post"])[:-len(textoMain("main", code_run["main"]))]
+      if not (self.lote is None) and base == self.cargado:
+        resultado = self.lote.definirYCorrer(textoMain(MAIN_LOTE, code_run["main"]).strip("\n"), MAIN_LOTE, self.timeout)
+        if not (resultado is None) and (resultado["resultado"] == "TIMEOUT" or not ("<interactive>" in resultado["falla"])):
+          return resultado
+    self.cargado = None
+    resultado = None if self.lote is None else self.lote.ejecutar(self.ruta, self.timeout)
+    if resultado is None: # No se pudo usar el pool: los casos que quedan van con el comando de siempre
+      self.cerrar()
+      return super().ejecutar(code, code_run)
+    if resultado["resultado"] == "OK" and not hayErrorDeCompilación(resultado["falla"]):
+      self.cargado = base
+    return resultado
+
+  def cerrar(self):
+    if not (self.lote is None):
+      self.lote.cerrar()
+      self.lote = None
+
 correctorHaskell = CorrectorHaskell()
 
+def textoMain(nombre, cuerpo):
+  return "\n\n" + nombre + " :: IO ()\n" + nombre + " = do" + cuerpo
+
+def hayErrorDeCompilación(falla):
+  return any(map(lambda l : re.match(r"src\.hs:\S*: error", l), falla.split("\n")))
+
 def AdaptarResultadoHaskell(resultadoOriginal, n, m, aridad):
   falla = None
   i = 0
@@ -1,5 +1,7 @@
-from correctorBase import Corrector
+import os
+from correctorBase import Corrector, Lote
 from analizador import analizarPython
+from zigoto import ejecutarEnZigoto, abrirLoteEnZigoto, ejecutarEnLote
 
 class CorrectorPython(Corrector):
   def __init__(self):
@@ -10,6 +12,16 @@ class CorrectorPython(Corrector):
   def Analizar(self, código, reglas, extras):
     return analizarPython(código, reglas, extras)
 
+  def Ejecutar(self, jsonObj, ruta, timeout, cancelado=None):
+    # En un hijo del zigoto que ya tiene importados los módulos del curso (y si no se puede, con python3 src.py)
+    resultado = ejecutarEnZigoto(jsonObj.get("precargar", []), os.path.join(ruta, self.ruta), timeout, ruta, cancelado=cancelado)
+    if resultado is None:
+      return super().Ejecutar(jsonObj, ruta, timeout, cancelado)
+    return resultado
+
+  def NuevoLote(self, jsonObj, ruta, timeout):
+    return LotePython(self, jsonObj, ruta, timeout)
+
   def InicializarRun(self, run, ruta):
     pass
 
@@ -37,6 +49,32 @@ class CorrectorPython(Corrector):
   def buscarFalla(self, falla, code, code_run):
     return buscar_falla_python(falla, code_run["lineasAdicionales"], len(code["src"].split("\n")))
 
+class LotePython(Lote):
+  # Los casos que tienen el mismo pre comparten un hijo del zigoto que ya corrió el código entregado
+  def __init__(self, corrector, jsonObj, ruta, timeout):
+    super().__init__(corrector, jsonObj, ruta, timeout)
+    self.lote = None
+    self.prefijoSinLote = None # Si el lote de un prefijo dejó de funcionar (por ejemplo, imprime demasiado), no lo vuelvo a abrir
+
+  def ejecutar(self, code, code_run):
+    prefijo = code_run["pre"] + code["src"]
+    if prefijo == self.prefijoSinLote:
+      return super().ejecutar(code, code_run)
+    if self.lote is None or self.lote.prefijo != prefijo:
+      self.cerrar()
+      self.lote = abrirLoteEnZigoto(self.jsonObj.get("precargar", []), os.path.join(self.ruta, self.corrector.ruta), self.ruta, prefijo)
+    resultado = None if self.lote is None else ejecutarEnLote(self.lote, self.timeout)
+    if resultado is None:
+      self.cerrar()
+      self.prefijoSinLote = prefijo
+      return super().ejecutar(code, code_run)
+    return resultado
+
+  def cerrar(self):
+    if not (self.lote is None):
+      self.lote.cerrar()
+      self.lote = None
+
 correctorPython = CorrectorPython()
 
 def buscar_falla_python(s, n, m):
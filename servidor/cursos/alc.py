@@ -780,6 +780,7 @@ CURSOS = {
     "institucion":"Facultad de Ciencias Exactas y Naturales (FCEyN) - UBA",
     "lenguaje":"Python",
     "lenguaje_display":"none",
+    "precargar":["numpy"], # Todos los ejercicios empiezan con "import numpy as np"
     # "analisisCodigo":[
     #   {"key":"CMD_X_LINE"},
     #   {"key":"INDENT_NEST"},
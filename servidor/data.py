@@ -5,10 +5,12 @@ import datetime
 import requests
 from users import loginValido, cargarUsuariosEnCurso, usuarioEnCurso, cursosUsuario, rolesEnCurso
 from corrector import run_code
-from correctorBase import timeoutDefault
+from correctorBase import timeoutDefault, casosEnParalelo
 from cursos.cursos import cargarCuestionarioMoodle, organizarPreguntasYRespuestas
 from fechas import fueraDeFecha
 from utils import texto_excepcion, mostrar_excepcion, failCallback, ejecutandoLocal
+from serializacion import CacheDeVistas, JsonSerializado
+from trabajos import encolarTrabajo
 
 # CURSOS:
 from cursos.unq_inpr import CURSOS as cursos_unq_inpr
@@ -54,16 +56,30 @@ LOCAL_DIR = 'locales'
 if not os.path.isdir(LOCAL_DIR):
   os.mkdir(LOCAL_DIR)
 
+# Las vistas de los cursos (qué actividades ve cada usuario y en qué estado) se guardan ya serializadas:
+# dos usuarios que ven lo mismo comparten los mismos bytes.
+VISTAS = CacheDeVistas()
+
 def dame_cursos(jsonObj, verb):
   respuesta = {'resultado':"Falla"}
   if 'usuario' in jsonObj and 'contrasenia' in jsonObj:
     usuario = jsonObj['usuario']
     contrasenia = jsonObj['contrasenia']
     if loginValido(usuario, contrasenia):
-      respuesta["resultado"] = "OK"
-      respuesta["cursos"] = cursosDeUsuario(usuario, jsonObj)
+      clave = ('dataEjs' in jsonObj, claveDeCursosDeUsuario(usuario, 'dataEjs' in jsonObj))
+      return VISTAS.obtener(clave, lambda : {
+        "resultado":"OK",
+        "cursos":cursosDeUsuario(usuario, jsonObj)
+      })
   return respuesta
 
+def claveDeCursosDeUsuario(usuario, conActividades):
+  clave = []
+  for curso in CURSOS_publico:
+    if usuarioEnCurso(usuario, curso):
+      clave.append((curso, tuple(rolesEnCurso(usuario, curso)), claveDeVista(usuario, curso) if conActividades else None))
+  return tuple(clave)
+
 def cursosDeUsuario(usuario, jsonObj):
   resultado = {}
   for curso in CURSOS_publico:
@@ -125,7 +141,7 @@ def tienePermisoRol(rol, curso, que):
 
 CURSOS_publico = {}
 
-informacionPrivadaEjercicio = ["pre","run_data","aridad","timeout"]
+informacionPrivadaEjercicio = ["pre","run_data","aridad","timeout","paralelo"]
 informacionPublicaEjercicio = ["id","nombre","visible","disponible","lenguaje",
   "enunciado","base","pidePrograma"] # pidePrograma es público porque lo usa el cliente para armar el mensaje de error
 def esconderInformacionSensibleEjercicio(ejercicio):
@@ -134,7 +150,9 @@ def esconderInformacionSensibleEjercicio(ejercicio):
     if k in informacionPublicaEjercicio:
       ejercicioPublico[k] = ejercicio[k]
   # Agrego un timeout para que el cliente sepa cuánto esperar al servidor
-  ejercicioPublico["timeoutTotal"] = 2 + (ejercicio["timeout"] if "timeout" in ejercicio else timeoutDefault()) * (len(ejercicio["run_data"]) if "run_data" in ejercicio else 1)
+  # (con "paralelo" los casos se corren de a varios a la vez)
+  tandas = -(-cantidadDeEjecuciones(ejercicio) // casosEnParalelo(ejercicio))
+  ejercicioPublico["timeoutTotal"] = 2 + (ejercicio["timeout"] if "timeout" in ejercicio else timeoutDefault()) * tandas
   return ejercicioPublico
 
 informacionPrivadaCuestionario = ["preguntas","file_moodle","data_moodle"]
@@ -245,8 +263,9 @@ def agregarDataEjs(usuario, cursos, jsonObj={}):
   else:
     for curso in cursos:
       if not ("actividades" in cursos[curso]):
-        cursos[curso]["actividades"] = []
-      cursos[curso]["actividades"] += versionesParaMostrar(usuario, curso)
+        cursos[curso]["actividades"] = vistaSerializada(usuario, curso)
+      else:
+        cursos[curso]["actividades"] += versionesParaMostrar(usuario, curso)
 
 def actividadHabilitada(usuario, curso, actividad):
   return habilitacionId(usuario, curso, actividad) == "HABILITADA"
@@ -359,7 +378,15 @@ def respuestaCuestionario(jsonObj, verb):
   return resultado
 
 def intentoCodigo(jsonObj, verb):
-  resultado = {'resultado':"Falla"}
+  if not validarIntento(jsonObj):
+    return {'resultado':"Falla"}
+  if jsonObj.get("asincronico", False):
+    # Se corrige en la cola de trabajos y el cliente consulta el resultado con el id que le devuelvo
+    return encolarTrabajo(lambda alProgresar : corregirIntento(jsonObj, verb, alProgresar), cantidadDeEjecuciones(jsonObj["ejercicio"]))
+  return corregirIntento(jsonObj, verb)
+
+def validarIntento(jsonObj):
+  # Si el usuario puede entregar la actividad, agrega a jsonObj el ejercicio y las reglas de análisis de código
   if all(map(lambda x : x in jsonObj, ['usuario', 'contrasenia', 'curso', 'actividad'])):
     usuario = jsonObj['usuario']
     contrasenia = jsonObj['contrasenia']
@@ -369,7 +396,9 @@ def intentoCodigo(jsonObj, verb):
       if actividadHabilitada(usuario, curso, ejercicio):
         jsonObj["ejercicio"] = CURSOS[curso]["actividades_por_id"][ejercicio]
         jsonObj["analisisCodigo"] = reglasDeAnalisisDeCodigo(jsonObj, CURSOS[curso])
-        resultado = run_code(jsonObj, verb)
+        jsonObj["precargar"] = CURSOS[curso].get("precargar", []) # Módulos que el zigoto de Python ya tiene importados
+        jsonObj["prioridad"] = CURSOS[curso].get("prioridad", 1) # Peso del curso en el planificador de correcciones
+        return True
       else:
         LOG("login inválido.\nActividad no habilitada.\nUsuario: "+usuario+"\nCurso: "+curso+"\nActividad: "+ejercicio)
     else:
@@ -377,6 +406,13 @@ def intentoCodigo(jsonObj, verb):
   else: # Ejercicio libre o usuario anónimo:
     # resultado = run_code(jsonObj)
     LOG("Login inválido.\nFaltan campos: "+jsonObj.keys())
+  return False
+
+def cantidadDeEjecuciones(ejercicio):
+  return len(ejercicio["run_data"]) if type(ejercicio.get("run_data")) == type([]) else 1
+
+def corregirIntento(jsonObj, verb, alProgresar=None):
+  resultado = run_code(jsonObj, verb, alProgresar)
   if resultado["resultado"] != "Falla" and "usuario" in jsonObj:
     if ("duracion" in resultado):
       jsonObj["duracion"] = "{:.2f}".format(resultado["duracion"])
@@ -495,6 +531,24 @@ def planillaDeCurso(curso):
 def versionesParaMostrar(usuario, curso):
   return versiónParaMostrar_lista(usuario, curso, CURSOS_publico[curso]["actividades"])
 
+def vistaSerializada(usuario, curso):
+  # Lo mismo que versionesParaMostrar, pero ya serializado y compartido entre todos los que ven lo mismo
+  return VISTAS.obtener((curso, claveDeVista(usuario, curso)), lambda : versionesParaMostrar(usuario, curso))
+
+def claveDeVista(usuario, curso):
+  # Las actividades de un curso no cambian, así que la vista queda determinada por el estado de cada
+  # actividad que recorre versiónParaMostrar_lista (en el mismo orden)
+  clave = []
+  AgregarEstadosDeVista(usuario, curso, CURSOS_publico[curso]["actividades"], clave)
+  return tuple(clave)
+
+def AgregarEstadosDeVista(usuario, curso, listaOriginal, clave):
+  for actividad in listaOriginal:
+    estado = habilitacion(usuario, curso, actividad)
+    clave.append(estado)
+    if estado == "HABILITADA" and actividad['tipo'] == "SECCION" and "actividades" in actividad:
+      AgregarEstadosDeVista(usuario, curso, actividad["actividades"], clave)
+
 def versiónParaMostrar_lista(usuario, curso, listaOriginal):
   lista = []
   for actividad in listaOriginal:
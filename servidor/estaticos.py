@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+
+import os, io, stat, time
+import gzip
+from email.utils import formatdate, parsedate_to_datetime
+
+# Caché en memoria de los archivos estáticos del campus (index.html, campus.js, img/, include/, etc.).
+# Cada entrada se identifica por la ruta y se invalida cuando cambia el mtime o el tamaño del archivo.
+# Guarda el contenido, una versión comprimida con gzip (si conviene) y los datos para ETag/Last-Modified.
+
+CACHE = {}
+TAMAÑO_MAXIMO = 2 * 1024 * 1024 # Los archivos más grandes no se guardan en memoria
+INTERVALO_REVALIDACION = 1 # segundos entre dos stat del mismo archivo
+TIPOS_COMPRIMIBLES = ['text/html', 'text/css', 'application/javascript', 'text/csv']
+
+def archivoEstatico(ruta, tipo, usarCache=True):
+  # Devuelve la entrada del archivo en la ruta o None si no existe
+  ahora = time.monotonic()
+  entrada = CACHE.get(ruta) if usarCache else None
+  if not (entrada is None) and ahora - entrada["verificado"] < INTERVALO_REVALIDACION:
+    return entrada
+  try:
+    st = os.stat(ruta)
+  except OSError:
+    CACHE.pop(ruta, None)
+    return None
+  if not stat.S_ISREG(st.st_mode):
+    return None
+  if not (entrada is None) and entrada["mtime"] == st.st_mtime_ns and entrada["tamaño"] == st.st_size:
+    entrada["verificado"] = ahora
+    return entrada
+  entrada = {
+    "ruta":ruta,
+    "tipo":tipo,
+    "mtime":st.st_mtime_ns,
+    "tamaño":st.st_size,
+    "etag":'"{:x}-{:x}"'.format(st.st_mtime_ns, st.st_size),
+    "modificado":formatdate(st.st_mtime, usegmt=True),
+    "segundos":int(st.st_mtime),
+    "datos":None,
+    "gzip":None,
+    "verificado":ahora
+  }
+  if usarCache and st.st_size <= TAMAÑO_MAXIMO:
+    f = io.open(ruta, mode='rb')
+    entrada["datos"] = f.read()
+    f.close()
+    if tipo in TIPOS_COMPRIMIBLES:
+      comprimido = gzip.compress(entrada["datos"], 9, mtime=0)
+      if len(comprimido) < len(entrada["datos"]):
+        entrada["gzip"] = comprimido
+    CACHE[ruta] = entrada
+  return entrada
+
+def sinModificar(entrada, headers):
+  # Indica si el cliente ya tiene esta versión del archivo (para responder 304)
+  etags = headers.get('If-None-Match')
+  if not (etags is None):
+    return etags.strip() == "*" or entrada["etag"] in map(lambda x : x.strip(), etags.split(","))
+  desde = headers.get('If-Modified-Since')
+  if not (desde is None):
+    try:
+      return entrada["segundos"] <= parsedate_to_datetime(desde).timestamp()
+    except (TypeError, ValueError):
+      return False
+  return False
+
+RANGO_INVALIDO = "INVALIDO"
+
+def rangoPedido(entrada, headers):
+  # Devuelve (inicio, fin) del header Range, None si hay que mandar el archivo entero
+  # o RANGO_INVALIDO si el rango pedido no se puede satisfacer. Sólo se aceptan rangos simples.
+  rango = headers.get('Range')
+  if rango is None or not rango.startswith("bytes=") or "," in rango:
+    return None
+  condicion = headers.get('If-Range')
+  if not (condicion is None) and condicion.strip() != entrada["etag"]:
+    return None
+  tamaño = entrada["tamaño"]
+  desde, guion, hasta = rango[6:].strip().partition("-")
+  try:
+    if desde == "": # Los últimos N bytes
+      n = int(hasta)
+      if n <= 0:
+        return RANGO_INVALIDO
+      return (max(0, tamaño - n), tamaño - 1) if tamaño > 0 else RANGO_INVALIDO
+    inicio = int(desde)
+    fin = int(hasta) if hasta != "" else tamaño - 1
+  except ValueError:
+    return None
+  if inicio >= tamaño or fin < inicio:
+    return RANGO_INVALIDO
+  return (inicio, min(fin, tamaño - 1))
+
+def aceptaGzip(headers):
+  codificaciones = headers.get('Accept-Encoding')
+  if codificaciones is None:
+    return False
+  for codificacion in codificaciones.split(","):
+    partes = codificacion.strip().split(";")
+    if partes[0].strip() == "gzip":
+      return not (len(partes) > 1 and partes[1].strip() in ["q=0", "q=0.0"])
+  return False
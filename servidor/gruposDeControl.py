@@ -0,0 +1,222 @@
+# -*- coding: utf-8 -*-
+
+import os
+import signal
+import threading
+import time
+
+# Grupos de control (cgroup v2) para las correcciones: cada entrega corre en un cgroup propio con tope de CPU
+# (cpu.max: tantos procesadores como lugares le dio el planificador), de memoria (memory.max, sin swap) y de
+# procesos (pids.max), y al terminar se lee de ahí el tiempo de CPU, el pico de memoria y si se la frenó por CPU.
+# Los grupos se registran con la carpeta de trabajo de la entrega: procesos.ejecutar y el zigoto buscan el grupo
+# de la carpeta donde corren (o de una que la contenga, como las de los casos en paralelo) y el proceso entra al
+# grupo antes de correr el código. Las sesiones persistentes (GHCi, Node) viven en el grupo "sesiones" y se mudan
+# al grupo de la entrega mientras la atienden.
+# Los grupos se crean dentro de CGROUP_RAIZ (por defecto, robotutor en la raíz de cgroup v2). Si no se puede
+# (no hay cgroup v2 o no hay permiso), no se hace nada y sólo quedan los rlimits de sacarPrivilegios; si faltan
+# controladores, se aplican los límites y se leen los datos que haya.
+
+from planificador import MEMORIA_POR_SLOT_MB
+
+PERIODO_CPU = 100000 # microsegundos
+PIDS_POR_SLOT = int(os.environ['PIDS_CORRECCION']) if 'PIDS_CORRECCION' in os.environ else 64
+CONTROLADORES = ["cpu", "memory", "pids"]
+ESPERA_BORRADO = 1 # segundos que espero a que terminen de morir los procesos de un grupo para borrarlo
+
+def montajeCgroup2():
+  try:
+    with open('/proc/mounts') as montajes:
+      for línea in montajes:
+        campos = línea.split()
+        if len(campos) > 2 and campos[2] == "cgroup2":
+          return campos[1]
+  except OSError:
+    pass
+  return None
+
+def escribir(camino, archivo, valor):
+  # Devuelve si se pudo (el archivo no existe si falta el controlador)
+  try:
+    with open(os.path.join(camino, archivo), 'w') as f:
+      f.write(valor)
+    return True
+  except OSError:
+    return False
+
+def leer(camino, archivo):
+  try:
+    with open(os.path.join(camino, archivo)) as f:
+      return f.read()
+  except OSError:
+    return None
+
+def leerClaves(camino, archivo):
+  # Para los archivos de a "clave valor" por línea, como cpu.stat
+  texto = leer(camino, archivo)
+  if texto is None:
+    return {}
+  return dict((partes[0], int(partes[1])) for partes in (línea.split() for línea in texto.splitlines()) if len(partes) == 2)
+
+class RaízDeGrupos(object):
+  def __init__(self):
+    self.camino = None
+    self.preparada = False
+    self.grupos = {} # carpeta de trabajo -> camino del grupo
+    self.creados = 0
+    self.lock = threading.Lock()
+
+  def preparar(self):
+    # La primera vez: crea la raíz y le habilita los controladores (en la de arriba y en ella)
+    if self.preparada:
+      return self.camino
+    with self.lock:
+      if not self.preparada:
+        self.camino = self.crearRaíz()
+        self.preparada = True
+    return self.camino
+
+  def crearRaíz(self):
+    if 'CGROUP_RAIZ' in os.environ:
+      camino = os.environ['CGROUP_RAIZ']
+    else:
+      montaje = montajeCgroup2()
+      if montaje is None:
+        return None
+      camino = os.path.join(montaje, 'robotutor')
+    try:
+      os.makedirs(camino, exist_ok=True)
+    except OSError:
+      return None
+    if not os.access(os.path.join(camino, 'cgroup.procs'), os.W_OK):
+      return None
+    for controlador in CONTROLADORES:
+      escribir(os.path.dirname(camino), 'cgroup.subtree_control', '+' + controlador)
+      escribir(camino, 'cgroup.subtree_control', '+' + controlador)
+    for entrada in os.scandir(camino): # Los que dejaron servidores que ya no están
+      if entrada.is_dir() and entrada.name.startswith("correccion-") and not procesoVivo(entrada.name.split("-")[1]):
+        borrarGrupo(entrada.path)
+    return camino
+
+  def crear(self, nombre):
+    raíz = self.preparar()
+    if raíz is None:
+      return None
+    camino = os.path.join(raíz, nombre)
+    try:
+      os.makedirs(camino, exist_ok=True)
+    except OSError:
+      return None
+    return camino
+
+  def registrar(self, carpeta, camino):
+    with self.lock:
+      self.grupos[carpeta] = camino
+
+  def olvidar(self, carpeta):
+    with self.lock:
+      self.grupos.pop(carpeta, None)
+
+  def grupoDe(self, carpeta):
+    with self.lock:
+      if len(self.grupos) == 0:
+        return None
+      carpeta = os.path.abspath(carpeta)
+      while not (carpeta in self.grupos):
+        arriba = os.path.dirname(carpeta)
+        if arriba == carpeta:
+          return None
+        carpeta = arriba
+      return self.grupos[carpeta]
+
+  def nuevoNombre(self):
+    with self.lock:
+      self.creados += 1
+      return "correccion-" + str(os.getpid()) + "-" + str(self.creados)
+
+RAIZ = RaízDeGrupos()
+
+def procesoVivo(pid):
+  try:
+    os.kill(int(pid), 0)
+  except ValueError:
+    return True
+  except ProcessLookupError:
+    return False
+  except PermissionError:
+    pass
+  return True
+
+def grupoDe(carpeta):
+  # El camino del grupo en el que tiene que correr lo que se ejecute en la carpeta (None si no hay)
+  return RAIZ.grupoDe(carpeta)
+
+def grupoDeSesiones():
+  return RAIZ.crear("sesiones")
+
+def entrar(grupo):
+  # Mete al proceso que llama en el grupo (se llama desde el hijo, antes de correr el código entregado)
+  if not (grupo is None):
+    escribir(grupo, 'cgroup.procs', '0')
+
+def mudar(pid, grupo):
+  if not (grupo is None):
+    escribir(grupo, 'cgroup.procs', str(pid))
+
+def borrarGrupo(camino):
+  # Mata lo que haya quedado adentro y borra el grupo
+  if not escribir(camino, 'cgroup.kill', '1'):
+    for pid in (leer(camino, 'cgroup.procs') or "").split():
+      try:
+        os.kill(int(pid), signal.SIGKILL)
+      except (ProcessLookupError, PermissionError):
+        pass
+  limite = time.monotonic() + ESPERA_BORRADO
+  while True:
+    try:
+      os.rmdir(camino)
+      return
+    except FileNotFoundError:
+      return
+    except OSError:
+      if time.monotonic() > limite:
+        print("No se pudo borrar el cgroup " + camino)
+        return
+      time.sleep(0.01)
+
+class grupoDeCorrección(object):
+  # with grupoDeCorrección(carpeta, slots) as grupo: ... (grupo.consumo() al final)
+  def __init__(self, carpeta, slots=1):
+    self.carpeta = os.path.abspath(carpeta)
+    self.slots = slots
+    self.camino = None
+
+  def __enter__(self):
+    self.camino = RAIZ.crear(RAIZ.nuevoNombre())
+    if not (self.camino is None):
+      escribir(self.camino, 'cpu.max', str(self.slots * PERIODO_CPU) + " " + str(PERIODO_CPU))
+      escribir(self.camino, 'memory.max', str(self.slots * MEMORIA_POR_SLOT_MB * 1024 * 1024))
+      escribir(self.camino, 'memory.swap.max', '0')
+      escribir(self.camino, 'pids.max', str(self.slots * PIDS_POR_SLOT))
+      RAIZ.registrar(self.carpeta, self.camino)
+    return self
+
+  def consumo(self):
+    # Lo que se pudo medir: tiempo de CPU (segundos), pico de memoria (bytes) y si se lo frenó por el tope de CPU
+    if self.camino is None:
+      return {}
+    resultado = {}
+    cpu = leerClaves(self.camino, 'cpu.stat')
+    if "usage_usec" in cpu:
+      resultado["cpu"] = cpu["usage_usec"] / 1000000
+    if "nr_throttled" in cpu:
+      resultado["frenado"] = cpu["nr_throttled"] > 0
+    pico = leer(self.camino, 'memory.peak')
+    if not (pico is None) and pico.strip().isdigit():
+      resultado["memoriaPico"] = int(pico)
+    return resultado
+
+  def __exit__(self, tipo, valor, traza):
+    if not (self.camino is None):
+      RAIZ.olvidar(self.carpeta)
+      borrarGrupo(self.camino)
+    return False
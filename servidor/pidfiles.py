@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+
+import os, signal
+
+# Archivos de estado del supervisor (main.py), uno por puerto, en la carpeta pids/ de la raíz del repositorio:
+# - <puerto>.pid: pid del server.py que atiende ese puerto
+# - <puerto>.supervisor: pid del main.py que lo supervisa (el último que lo levantó)
+# - <puerto>.reiniciar: pedido de reinicio (lo crea admin_reset y lo consume el supervisor al recibir SIGHUP)
+
+RUTA_PIDS = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'pids')
+
+def archivoPuerto(puerto, extension):
+  return os.path.join(RUTA_PIDS, str(puerto) + "." + extension)
+
+def leerPid(puerto, extension):
+  try:
+    f = open(archivoPuerto(puerto, extension), 'r')
+    pid = int(f.read().strip())
+    f.close()
+    return pid
+  except (OSError, ValueError):
+    return None
+
+def escribirPid(puerto, extension, pid):
+  if not os.path.isdir(RUTA_PIDS):
+    os.mkdir(RUTA_PIDS)
+  f = open(archivoPuerto(puerto, extension), 'w')
+  f.write(str(pid))
+  f.close()
+
+def borrarArchivo(puerto, extension):
+  try:
+    os.remove(archivoPuerto(puerto, extension))
+  except OSError:
+    pass
+
+def procesoVivo(pid):
+  try:
+    os.kill(pid, 0)
+  except ProcessLookupError:
+    return False
+  except PermissionError:
+    pass
+  return True
+
+def puertosSupervisados():
+  # Devuelve {puerto: pid del supervisor} para los supervisores que siguen vivos
+  resultado = {}
+  if os.path.isdir(RUTA_PIDS):
+    for archivo in os.listdir(RUTA_PIDS):
+      nombre, extension = os.path.splitext(archivo)
+      if extension == ".supervisor" and nombre.isdigit():
+        pid = leerPid(int(nombre), "supervisor")
+        if not (pid is None) and procesoVivo(pid):
+          resultado[int(nombre)] = pid
+  return resultado
+
+def pedirReinicio(puertos=None):
+  # Pide a los supervisores un reinicio escalonado de los puertos (todos si es None).
+  # Devuelve False si no hay ningún supervisor que lo pueda hacer.
+  supervisados = puertosSupervisados()
+  supervisores = set()
+  for puerto in supervisados:
+    if puertos is None or puerto in puertos:
+      escribirPid(puerto, "reiniciar", supervisados[puerto])
+      supervisores.add(supervisados[puerto])
+  for pid in supervisores:
+    os.kill(pid, signal.SIGHUP)
+  return len(supervisores) > 0
+
+def reinicioPedido(puerto):
+  if os.path.isfile(archivoPuerto(puerto, "reiniciar")):
+    borrarArchivo(puerto, "reiniciar")
+    return True
+  return False
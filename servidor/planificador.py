@@ -0,0 +1,217 @@
+# -*- coding: utf-8 -*-
+
+import os
+import fcntl
+import threading
+import time
+from collections import deque, OrderedDict
+from utils import mostrar_excepcion
+
+# Planificador de correcciones: hay una cantidad fija de lugares de CPU (SLOTS_CORRECCION, por defecto uno por
+# procesador) y de memoria (MEMORIA_CORRECCION_MB, repartida de a MEMORIA_POR_SLOT_MB), y cada corrección espera
+# hasta que haya lugar para ella. Los turnos se reparten entre cursos con deficit round robin: en cada vuelta un
+# curso suma su "prioridad" (de la definición del curso en CURSOS, 1 si no tiene) y puede usar tantos lugares
+# como haya acumulado. Dentro de un curso, los usuarios se turnan de a una corrección.
+# Así, un examen en un curso no deja sin turnos a los demás cursos, ni un usuario a los demás del mismo curso.
+# Los lugares son de toda la máquina, no de cada proceso: main.py levanta varios server.py (y cada uno puede tener
+# workers prefork), así que cada lugar es un archivo de CARPETA_LUGARES y lo ocupa el proceso que tiene su flock.
+# El reparto justo entre cursos es dentro de cada proceso; entre procesos, el primero que encuentra un lugar libre.
+
+def memoriaTotalMB():
+  try:
+    return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES') // (1024 * 1024)
+  except (ValueError, OSError):
+    return 4096
+
+SLOTS = int(os.environ['SLOTS_CORRECCION']) if 'SLOTS_CORRECCION' in os.environ else (os.cpu_count() or 1)
+MEMORIA_POR_SLOT_MB = int(os.environ['MEMORIA_POR_SLOT_MB']) if 'MEMORIA_POR_SLOT_MB' in os.environ else 512
+MEMORIA_MB = int(os.environ['MEMORIA_CORRECCION_MB']) if 'MEMORIA_CORRECCION_MB' in os.environ else memoriaTotalMB() * 3 // 4
+PRIORIDAD_MINIMA = 0.1
+CARPETA_LUGARES = os.environ.get('LUGARES_DIR',
+  os.path.join('/dev/shm' if os.path.isdir('/dev/shm') else '/tmp', 'robotutor-lugares'))
+INTERVALO_LUGARES = 0.05 # segundos entre intentos cuando todos los lugares los ocupan otros procesos
+
+class Pedido(object):
+  def __init__(self, curso, usuario, slots):
+    self.curso = curso
+    self.usuario = usuario
+    self.slots = slots
+    self.lugares = [] # Los lugares compartidos que ocupa
+    self.otorgado = threading.Event()
+
+class ColaDeCurso(object):
+  def __init__(self, prioridad):
+    self.prioridad = prioridad
+    self.déficit = 0
+    self.visitada = False # Si ya sumó su prioridad en esta vuelta
+    self.usuarios = OrderedDict() # usuario -> deque de pedidos, en el orden en que les toca
+
+  def vacía(self):
+    return len(self.usuarios) == 0
+
+  def próximo(self):
+    return self.usuarios[next(iter(self.usuarios))][0]
+
+  def sacar(self):
+    # Saca el próximo pedido y manda a su usuario al final de la fila
+    usuario = next(iter(self.usuarios))
+    pedidos = self.usuarios.pop(usuario)
+    pedido = pedidos.popleft()
+    if len(pedidos) > 0:
+      self.usuarios[usuario] = pedidos
+    return pedido
+
+class LugaresCompartidos(object):
+  # Un archivo por lugar: un proceso ocupa el lugar mientras tiene el flock de su archivo (y si el proceso muere,
+  # el kernel lo suelta solo)
+  def __init__(self, cantidad, carpeta):
+    self.cantidad = cantidad
+    self.carpeta = carpeta
+    self.pid = None
+    self.archivos = []
+    self.tomados = set()
+
+  def abrir(self):
+    # Un descriptor abierto antes de un fork se comparte con el hijo (y con él el flock): cada proceso abre los suyos
+    if self.pid == os.getpid():
+      return
+    for fd in self.archivos:
+      os.close(fd)
+    self.archivos = []
+    self.tomados = set()
+    os.makedirs(self.carpeta, exist_ok=True)
+    self.archivos = [os.open(os.path.join(self.carpeta, "lugar-" + str(i)), os.O_RDWR | os.O_CREAT, 0o666) for i in range(self.cantidad)]
+    self.pid = os.getpid()
+
+  def tomar(self, cantidad):
+    # Devuelve los índices de cantidad lugares libres en la máquina, o None si no hay tantos (sin bloquearse)
+    try:
+      self.abrir()
+    except OSError as e: # Sin la carpeta compartida, el límite queda sólo por proceso
+      mostrar_excepcion(e)
+      return []
+    tomados = []
+    for i in range(self.cantidad):
+      if len(tomados) == cantidad:
+        break
+      if i in self.tomados:
+        continue
+      try:
+        fcntl.flock(self.archivos[i], fcntl.LOCK_EX | fcntl.LOCK_NB)
+        tomados.append(i)
+      except BlockingIOError:
+        pass
+    if len(tomados) < cantidad:
+      self.soltar(tomados)
+      return None
+    self.tomados.update(tomados)
+    return tomados
+
+  def soltar(self, tomados):
+    for i in tomados:
+      fcntl.flock(self.archivos[i], fcntl.LOCK_UN)
+      self.tomados.discard(i)
+
+class Planificador(object):
+  def __init__(self, slots, memoria, memoriaPorSlot, carpeta=CARPETA_LUGARES):
+    self.slots = max(1, slots)
+    self.memoriaPorSlot = memoriaPorSlot
+    self.slotsPorMemoria = max(1, memoria // memoriaPorSlot)
+    self.ocupados = 0
+    self.cursos = {}
+    self.activos = deque() # Los cursos con pedidos esperando, en el orden de la vuelta
+    self.lock = threading.Lock()
+    self.lugares = LugaresCompartidos(self.capacidad(), carpeta)
+    self.sondeando = False # Si hay un hilo reintentando mientras otros procesos ocupan todos los lugares
+
+  def capacidad(self):
+    return min(self.slots, self.slotsPorMemoria)
+
+  def pedir(self, curso, usuario, prioridad=1, slots=1):
+    # Espera hasta que le toque y devuelve el pedido (que hay que pasarle a liberar)
+    pedido = Pedido(curso, usuario, max(1, min(slots, self.capacidad())))
+    with self.lock:
+      if not (curso in self.cursos):
+        self.cursos[curso] = ColaDeCurso(prioridad)
+      cola = self.cursos[curso]
+      cola.prioridad = max(PRIORIDAD_MINIMA, prioridad)
+      if cola.vacía():
+        self.activos.append(cola)
+      if not (usuario in cola.usuarios):
+        cola.usuarios[usuario] = deque()
+      cola.usuarios[usuario].append(pedido)
+      self.repartir()
+    pedido.otorgado.wait()
+    return pedido
+
+  def liberar(self, pedido):
+    with self.lock:
+      self.ocupados -= pedido.slots
+      self.lugares.soltar(pedido.lugares)
+      self.repartir()
+
+  def sondear(self):
+    # Los lugares que liberan otros procesos no avisan: reintento mientras repartir quede trabado por ellos
+    while True:
+      time.sleep(INTERVALO_LUGARES)
+      with self.lock:
+        if not self.repartir():
+          self.sondeando = False
+          return
+
+  def repartir(self):
+    # Deficit round robin entre los cursos activos. Se llama con self.lock tomado; devuelve si quedó esperando
+    # lugares que ocupan otros procesos
+    while len(self.activos) > 0:
+      cola = self.activos[0]
+      if not cola.visitada:
+        cola.déficit += cola.prioridad
+        cola.visitada = True
+      pedido = cola.próximo()
+      if pedido.slots > cola.déficit: # No le alcanza: pasa al siguiente curso y en la próxima vuelta suma más
+        cola.visitada = False
+        self.activos.rotate(-1)
+        continue
+      if self.ocupados + pedido.slots > self.capacidad(): # Espera a que se libere lugar (sin que nadie se le adelante)
+        return False
+      lugares = self.lugares.tomar(pedido.slots)
+      if lugares is None: # Los ocupan otros procesos
+        if not self.sondeando:
+          self.sondeando = True
+          threading.Thread(target=self.sondear, daemon=True).start()
+        return True
+      pedido.lugares = lugares
+      cola.sacar()
+      cola.déficit -= pedido.slots
+      self.ocupados += pedido.slots
+      pedido.otorgado.set()
+      if cola.vacía():
+        cola.déficit = 0
+        cola.visitada = False
+        self.activos.popleft()
+        del self.cursos[pedido.curso]
+    return False
+
+  def estado(self):
+    with self.lock:
+      return {
+        "capacidad":self.capacidad(),
+        "ocupados":self.ocupados,
+        "esperando":dict((curso, sum(len(p) for p in self.cursos[curso].usuarios.values())) for curso in self.cursos)
+      }
+
+PLANIFICADOR = Planificador(SLOTS, MEMORIA_MB, MEMORIA_POR_SLOT_MB)
+
+class turnoDeCorrección(object):
+  # with turnoDeCorrección(curso, usuario, prioridad, slots): ...
+  def __init__(self, curso, usuario, prioridad=1, slots=1):
+    self.argumentos = (curso, usuario, prioridad, slots)
+    self.pedido = None
+
+  def __enter__(self):
+    self.pedido = PLANIFICADOR.pedir(*self.argumentos)
+    return self.pedido
+
+  def __exit__(self, tipo, valor, traza):
+    PLANIFICADOR.liberar(self.pedido)
+    return False
@@ -1,33 +1,26 @@
 # -*- coding: utf-8 -*-
 
 import os, pwd
-from subprocess import Popen
+from subprocess import Popen, TimeoutExpired
 import signal
 import resource
+import time
+import selectors
+import fcntl
+from subprocess import PIPE
+from gruposDeControl import grupoDe, entrar
 
-proceso_en_ejecucion = None
+# Cada ejecución tiene su propio plazo (Popen.wait con timeout) y todo su estado es local,
+# así que se pueden correr varias a la vez desde distintos hilos del servidor.
+# cancelado (opcional) es un threading.Event: si alguien lo marca, la ejecución se corta como si se hubiera
+# pasado del timeout (por ejemplo, los casos que siguen a uno que falló cuando se corren en paralelo).
 
-def handler_timeout(s, f):
-  global proceso_en_ejecucion
-  if not (proceso_en_ejecucion is None):
-    try:
-      os.killpg(os.getpgid(proceso_en_ejecucion.pid), signal.SIGTERM)
-      proceso_en_ejecucion.kill()
-      proceso_en_ejecucion.terminate()
-    except Exception as e:
-      pass
-    proceso_en_ejecucion = None
-
-signal.signal(signal.SIGALRM, handler_timeout)
-
-def ejecutarConTimeout(comando, timeout, ruta):
-  global proceso_en_ejecucion
-  signal.alarm(timeout)
-  errcode, salida, falla = ejecutar(comando, ruta)
-  duracion = timeout - signal.alarm(0)
-  if proceso_en_ejecucion is None:
+def ejecutarConTimeout(comando, timeout, ruta, cancelado=None):
+  inicio = time.monotonic()
+  errcode, salida, falla = ejecutar(comando, ruta, timeout, cancelado=cancelado)
+  duracion = time.monotonic() - inicio
+  if errcode is None:
     return {"resultado":"TIMEOUT"}
-  proceso_en_ejecucion = None
   return {
     "resultado":"OK",
     "errcode":errcode,
@@ -36,13 +29,23 @@ def ejecutarConTimeout(comando, timeout, ruta):
     "duracion":duracion
   }
 
+# Tope de bytes que se guardan de cada salida (stdout y stderr) de una ejecución. Si se pasa, se guarda el
+# principio y el final (donde suelen estar los errores) con una marca en el medio, y el resto se descarta.
+LIMITE_SALIDA = int(os.environ['LIMITE_SALIDA']) if 'LIMITE_SALIDA' in os.environ else 1024 * 1024
+LIMITE_SALIDA_AST = 64 * 1024 * 1024 # Para los parsers: un AST truncado no sirve
+BLOQUE = 64 * 1024
+INTERVALO_SONDEO = 0.1 # Cada cuánto me fijo si el proceso terminó aunque alguien siga teniendo abiertas sus salidas
+TAMAÑO_PIPE_NODE = 1024 * 1024 # node escribe sus errores en un stderr no bloqueante: lo que no entra en el pipe se pierde
+
 # USER_RT = 'rtTest'
 MEM_MAX_MB = 10 * 1024
 MEM_MAX_KB = MEM_MAX_MB * 1024
 MEM_MAX_B =  MEM_MAX_KB * 1024
 
-def sacarPrivilegios(ruta):
+def sacarPrivilegios(ruta, grupo=None):
+  # grupo: el cgroup en el que tiene que correr (ver gruposDeControl)
   os.setsid()
+  entrar(grupo)
   # os.system("ulimit -v " + str(MEM_MAX_KB))
   os.chdir(ruta)
   resource.setrlimit(resource.RLIMIT_AS, (MEM_MAX_B, MEM_MAX_B))
@@ -53,30 +56,109 @@ def sacarPrivilegios(ruta):
   # os.setgid(user_info.pw_gid)
   # os.setuid(user_info.pw_uid)
 
-def ejecutar(cmd, ruta):
-  global proceso_en_ejecucion
-  RUTA_STDOUT = os.path.join(ruta, 'stdout.out')
-  RUTA_STDERR = os.path.join(ruta, 'stderr.out')
+def matarGrupo(p):
+  # sacarPrivilegios hace setsid, así que el grupo del proceso es su pid (y incluye a todos sus hijos)
+  try:
+    os.killpg(p.pid, signal.SIGKILL)
+  except (ProcessLookupError, PermissionError):
+    pass
+  p.kill()
+
+class SalidaAcotada(object):
+  def __init__(self, topeBytes):
+    self.topeBytes = topeBytes
+    self.cola = 0 if topeBytes is None else topeBytes // 4
+    self.principio = bytearray()
+    self.final = bytearray()
+    self.descartados = 0
+
+  def agregar(self, datos):
+    if self.topeBytes is None:
+      self.principio += datos
+      return
+    lugar = self.topeBytes - self.cola - len(self.principio)
+    if lugar > 0:
+      self.principio += datos[:lugar]
+      datos = datos[lugar:]
+    self.final += datos
+    if len(self.final) > self.cola:
+      self.descartados += len(self.final) - self.cola
+      del self.final[:len(self.final) - self.cola]
 
-  fOut = open(RUTA_STDOUT,'w')
-  fErr = open(RUTA_STDERR,'w')
+  def texto(self):
+    datos = bytes(self.principio)
+    if self.descartados > 0:
+      datos += ("\n[... salida truncada: se descartaron " + str(self.descartados) + " bytes ...]\n").encode()
+    datos += bytes(self.final)
+    return datos.decode('utf-8', errors='replace').replace('\r\n', '\n').replace('\r', '\n')
+
+def esComandoNode(cmd):
+  return cmd.split(None, 1)[:1] == ["node"]
+
+def agrandarPipe(fd, tamaño):
+  try:
+    fcntl.fcntl(fd, fcntl.F_SETPIPE_SZ, tamaño)
+  except (OSError, AttributeError): # Más grande que /proc/sys/fs/pipe-max-size, o no es Linux
+    pass
+
+def ejecutar(cmd, ruta, timeout=None, topeBytes=LIMITE_SALIDA, cancelado=None):
+  # Devuelve errcode None si se pasó del timeout (en segundos). Las salidas se leen de pipes a medida que
+  # llegan (sin archivos temporales) y de cada una se guardan a lo sumo topeBytes bytes (None: sin tope).
   comandoAEjecutar = cmd
   # comandoAEjecutar = "sudo -u " + USER_RT + " " + comandoAEjecutar
-  p = Popen(comandoAEjecutar, stdout=fOut, stderr=fErr, universal_newlines=True, shell=True, preexec_fn=lambda: sacarPrivilegios(ruta)
+  grupo = grupoDe(ruta)
+  p = Popen(comandoAEjecutar, stdout=PIPE, stderr=PIPE, shell=True, preexec_fn=lambda: sacarPrivilegios(ruta, grupo)
     # , user=USER_RT
   )
-  proceso_en_ejecucion = p
-  errcode = p.wait()
-  fOut.close()
-  fErr.close()
-  stdout = ""
-  stderr = ""
-  fOut = open(RUTA_STDOUT,'r')
-  for line in fOut.read():
-      stdout += line
-  fOut.close()
-  fErr = open(RUTA_STDERR,'r')
-  for line in fErr.read():
-      stderr += line
-  fErr.close()
+  plazo = None if timeout is None else time.monotonic() + timeout
+  vencido = True
+  try:
+    tamañoPipe = TAMAÑO_PIPE_NODE if esComandoNode(cmd) else None
+    stdout, stderr, vencido = leerSalidas(p.stdout.fileno(), p.stderr.fileno(), topeBytes, plazo, lambda: not (p.poll() is None), cancelado, tamañoPipe)
+    if not vencido:
+      try:
+        p.wait(None if plazo is None else max(0, plazo - time.monotonic()))
+      except TimeoutExpired:
+        vencido = True
+  finally:
+    if vencido or p.poll() is None:
+      matarGrupo(p)
+    p.wait()
+    p.stdout.close()
+    p.stderr.close()
+  errcode = None if vencido else p.returncode
   return errcode, stdout, stderr
+
+def estáCancelado(cancelado):
+  return not (cancelado is None) and cancelado.is_set()
+
+def leerSalidas(fdOut, fdErr, topeBytes, plazo, terminó, cancelado=None, tamañoPipe=None):
+  # Lee los dos descriptores hasta que se cierren (o hasta que terminó() y no llegue nada más), sin pasarse
+  # del instante plazo (time.monotonic, None: sin plazo). Devuelve stdout, stderr y si se venció el plazo.
+  # Con tamañoPipe, antes agranda los pipes (ver TAMAÑO_PIPE_NODE).
+  salidas = {fdOut:SalidaAcotada(topeBytes), fdErr:SalidaAcotada(topeBytes)}
+  selector = selectors.DefaultSelector()
+  for fd in salidas:
+    os.set_blocking(fd, False)
+    if not (tamañoPipe is None):
+      agrandarPipe(fd, tamañoPipe)
+    selector.register(fd, selectors.EVENT_READ)
+  vencido = False
+  try:
+    while len(selector.get_map()) > 0:
+      espera = INTERVALO_SONDEO if plazo is None else min(INTERVALO_SONDEO, plazo - time.monotonic())
+      if espera <= 0 or estáCancelado(cancelado):
+        vencido = True
+        break
+      eventos = selector.select(espera)
+      for clave, _ in eventos:
+        datos = os.read(clave.fd, BLOQUE)
+        if len(datos) == 0:
+          selector.unregister(clave.fd)
+        else:
+          salidas[clave.fd].agregar(datos)
+      if len(eventos) == 0 and terminó():
+        break # Terminó, pero quedó un proceso (por ejemplo, en background) con las salidas abiertas
+  finally:
+    selector.close()
+  return salidas[fdOut].texto(), salidas[fdErr].texto(), vencido
@@ -1,68 +1,129 @@
 # Cada regla es una función que toma como argumentos:
 # - el analizador sintáctico del lenguaje (AnalizadorPython, AnalizadorGobstones, etc.)
-# - el AST
 # - el código (como un string)
 # - la regla (un objeto cuyos campos son los atributos de la regla)
-# y devuelve una lista de hallazgos (vacía si no hay ninguno) donde cada hallazgo es un objeto con los campos 'msg' (el mensaje a mostrar), 'línea' (la línea donde se encontró el hallazgo) y 'columna' (la columna donde se encontró el hallazgo)
+# - las líneas del código (un LíneasDeCódigo, que se arma una sola vez por análisis)
+# y devuelve un Visitante que, al recorrer el AST (ver Analizador.recorrer), junta una lista de hallazgos (vacía si no hay ninguno) donde cada hallazgo es un objeto con los campos 'msg' (el mensaje a mostrar), 'línea' (la línea donde se encontró el hallazgo) y 'columna' (la columna donde se encontró el hallazgo)
+# Así todas las reglas se evalúan en un único recorrido del AST.
 
 from msg import *
 
-def reglaComandosAnidados(analizador, AST, código, regla):
+class LíneasDeCódigo(object):
+  # Dónde empieza y termina cada línea del código, para sacar una línea como un pedazo del código original en lugar
+  # de volver a separarlo en líneas
+  def __init__(self, código):
+    self.código = código
+    self.rangos = []
+    inicio = 0
+    fin = código.find("\n")
+    while fin >= 0:
+      self.rangos.append((inicio, fin))
+      inicio = fin + 1
+      fin = código.find("\n", inicio)
+    self.rangos.append((inicio, len(código)))
+  def línea(self, nLínea):
+    # Como código.split("\n")[nLínea-1]
+    inicio, fin = self.rangos[nLínea-1]
+    return self.código[inicio:fin]
+
+class Visitante(object):
+  # Si tipos no es None, sólo ve los nodos de esos tipos. Al entrar a un nodo recibe su madre y el estado que devolvió
+  # al entrar a la madre (None para la raíz y para los que tienen tipos), y devuelve el estado para los hijos.
+  # salir se llama después de recorrer los hijos. Los hallazgos se agregan a self.hallazgos a medida que se encuentran
+  # (ver Analizador.hallazgosEnOrden) y quedan en ese orden.
+  tipos = None
+  def __init__(self, analizador):
+    self.analizador = analizador
+    self.hallazgos = []
+  def entrar(self, nodo, madre, estado):
+    return None
+  def salir(self, nodo):
+    pass
+  def resultado(self):
+    return self.hallazgos
+
+class Búsqueda(Visitante):
+  # Un hallazgo por cada nodo (en preorden) que cumple fVal, con el mensaje fMsg(nodo)
+  def __init__(self, analizador, fVal, fMsg, tipos=None):
+    Visitante.__init__(self, analizador)
+    self.fVal = fVal
+    self.fMsg = fMsg
+    self.tipos = tipos
+  def entrar(self, nodo, madre, estado):
+    if self.fVal(nodo):
+      self.hallazgos.append({
+        "msg":self.fMsg(nodo),
+        "línea":self.analizador.líneaDeNodo_(nodo),
+        "columna":self.analizador.columnaDeNodo_(nodo)
+      })
+
+def reglaComandosAnidados(analizador, código, regla, líneas):
   # Verifica que la profundidad de anidación de comandos no supere el umbral 'max'.
   máximaAnidacion = regla["max"] if "max" in regla else 1
-  return buscarNodosCon_YGenerar_(analizador, AST,
-    lambda nodo : analizador.es_UnComandoCompuesto(nodo) and analizador.nivelAnidaciónComandos_(nodo) >= máximaAnidacion,
-    lambda nodo : mensajeComandosCompuestosAnidados
+  return Búsqueda(analizador,
+    lambda nodo : analizador.nivelAnidaciónComandos_(nodo) >= máximaAnidacion,
+    lambda nodo : mensajeComandosCompuestosAnidados,
+    analizador.tiposComandosCompuestos()
   )
 
-def reglaUnComandoPorLinea(analizador, AST, código, regla):
+def reglaUnComandoPorLinea(analizador, código, regla, líneas):
   # Verifica que no haya dos o más comandos en la misma línea.
-  líneasConflictivas = {}
-  nodoAnterior = None
-  líneaAnterior = 0
-  for nodo in analizador.nodosDeTipo_(AST, analizador.tiposComandos()):
-    nuevaLínea = analizador.líneaDeNodo_(nodo)
-    if líneaAnterior > 0 and not (nodoAnterior is None):
-      if (líneaAnterior == nuevaLínea and not (líneaAnterior in líneasConflictivas)):
-        líneasConflictivas[líneaAnterior] = {
+  return UnComandoPorLínea(analizador)
+
+class UnComandoPorLínea(Visitante):
+  # Recorre los comandos al salir de cada uno (cada comando después de los que tiene adentro)
+  def __init__(self, analizador):
+    Visitante.__init__(self, analizador)
+    self.tipos = analizador.tiposComandos()
+    self.líneasConflictivas = set()
+    self.nodoAnterior = None
+    self.líneaAnterior = 0
+  def salir(self, nodo):
+    nuevaLínea = self.analizador.líneaDeNodo_(nodo)
+    if self.líneaAnterior > 0 and not (self.nodoAnterior is None):
+      if (self.líneaAnterior == nuevaLínea and not (self.líneaAnterior in self.líneasConflictivas)):
+        self.líneasConflictivas.add(self.líneaAnterior)
+        self.hallazgos.append({
           "msg":mensajeMásDeUnComandoPorLínea,
-          "línea":líneaAnterior,
-          "columna":analizador.columnaDeNodo_(nodo)
-        }
-    nodoAnterior = nodo
-    líneaAnterior = nuevaLínea
-  resultado = []
-  for l in líneasConflictivas:
-    resultado.append(líneasConflictivas[l])
-  return resultado
-
-
-def reglaIndentacionPorAnidación(analizador, AST, código, regla):
-  # Verifica que la indentación de cada línea anidada sea mayor a la línea del nodo que la contiene.
-  return reglaIndentacionPorAnidaciónDesde(analizador, AST, código, regla, 0, -1)
-
-def reglaIndentacionPorAnidaciónDesde(analizador, nodo, código, regla, n, i):
-  resultado = []
-  líneaActual = analizador.líneaDeNodo_(nodo)
-  indentaciónActual = i
-  if líneaActual != n:
-    columnaActual = analizador.columnaDeNodo_(nodo)
-    indentaciónActual = indentaciónHasta(código, líneaActual, columnaActual)
-    if indentaciónActual <= i:
-      resultado.append({
-          "msg":mensajeIndentaciónSubordinada,
-          "línea":líneaActual,
-          "columna":columnaActual
+          "línea":self.líneaAnterior,
+          "columna":self.analizador.columnaDeNodo_(nodo)
         })
-  for nodoHijo in analizador.hijosDeNodo_(nodo):
-    resultado += reglaIndentacionPorAnidaciónDesde(analizador, nodoHijo, código, regla, líneaActual,
-      indentaciónActual if analizador.es_NodoSubordinadoDe_(nodoHijo, nodo) else i
-    )
-  return resultado
+    self.nodoAnterior = nodo
+    self.líneaAnterior = nuevaLínea
 
 
-def indentaciónHasta(código, nLínea, nColumna):
-  línea = código.split("\n")[nLínea-1]
+def reglaIndentacionPorAnidación(analizador, código, regla, líneas):
+  # Verifica que la indentación de cada línea anidada sea mayor a la línea del nodo que la contiene.
+  return IndentaciónPorAnidación(analizador, líneas)
+
+class IndentaciónPorAnidación(Visitante):
+  # El estado de cada nodo es su línea, su indentación y la indentación que le tienen que superar sus hijos no subordinados
+  def __init__(self, analizador, líneas):
+    Visitante.__init__(self, analizador)
+    self.líneas = líneas
+  def entrar(self, nodo, madre, estado):
+    if madre is None:
+      n, i = 0, -1
+    else:
+      líneaMadre, indentaciónMadre, iMadre = estado
+      n = líneaMadre
+      i = indentaciónMadre if self.analizador.es_NodoSubordinadoDe_(nodo, madre) else iMadre
+    líneaActual = self.analizador.líneaDeNodo_(nodo)
+    indentaciónActual = i
+    if líneaActual != n:
+      columnaActual = self.analizador.columnaDeNodo_(nodo)
+      indentaciónActual = indentaciónHasta(self.líneas, líneaActual, columnaActual)
+      if indentaciónActual <= i:
+        self.hallazgos.append({
+            "msg":mensajeIndentaciónSubordinada,
+            "línea":líneaActual,
+            "columna":columnaActual
+          })
+    return (líneaActual, indentaciónActual, i)
+
+
+def indentaciónHasta(líneas, nLínea, nColumna):
+  línea = líneas.línea(nLínea)
   i = 0
   while i < (nColumna-1) and esIndentación(línea[i]):
     i += 1
@@ -71,11 +132,11 @@ def indentaciónHasta(código, nLínea, nColumna):
 def esIndentación(caracter):
   return caracter == " " or caracter == "\t"
 
-def reglaNombresProhibidos(analizador, AST, código, regla):
+def reglaNombresProhibidos(analizador, código, regla, líneas):
   # Verifica que no se usen identificadores con nombre en 'nombres'.
-  return nodosDeNombresProhibidosEnAST(analizador, AST, regla["nombres"] if "nombres" in regla else [])
+  return visitanteNombresProhibidos(analizador, regla["nombres"] if "nombres" in regla else [])
 
-REGLAS = {
+VISITANTES = {
   "NEST_CMD":reglaComandosAnidados,
   "CMD_X_LINE":reglaUnComandoPorLinea,
   "INDENT_NEST":reglaIndentacionPorAnidación,
@@ -84,52 +145,52 @@ REGLAS = {
 
 conceptos = [ # Cada uno verifica que no se use el concepto en cuestión.
   [ "REP_SIMPLE",
-    (lambda analizador, AST, código, regla, nodo : (analizador.es_RepeticiónSimple(nodo))),
-    mensajeRepeticiónSimpleNoPermitida
+    (lambda analizador, código, regla, nodo : (analizador.es_RepeticiónSimple(nodo))),
+    mensajeRepeticiónSimpleNoPermitida,
+    (lambda analizador : analizador.tiposRepeticiónSimple()) # Los tipos de nodo que tiene que mirar
   ]
 ]
 
-def reglaConcepto(concepto, analizador, AST, código, regla):
-  return concepto[2] if concepto[1](analizador, AST, código, regla) else None
+def reglaConcepto(concepto, analizador, código, regla, líneas):
+  return Búsqueda(analizador,
+    lambda nodo : concepto[1](analizador, código, regla, nodo),
+    lambda nodo : concepto[2],
+    concepto[3](analizador)
+  )
+
+for concepto in conceptos:
+  VISITANTES["CONCEPT_" + concepto[0]] = lambda analizador, código, regla, líneas, concepto=concepto : reglaConcepto(concepto, analizador, código, regla, líneas)
+
+def reglaDeVisitante(crear):
+  # La regla como función del AST (la que devuelve la lista de hallazgos), recorriéndolo sólo para ella
+  return lambda analizador, AST, código, regla : analizador.recorrer(AST, [crear(analizador, código, regla, LíneasDeCódigo(código))])[0]
+
+REGLAS = dict((clave, reglaDeVisitante(VISITANTES[clave])) for clave in VISITANTES)
 
 def buscarNodosCon_YGenerar_(analizador, AST, fVal, fMsg):
-  resultado = []
-  if fVal(AST):
-    resultado.append({
-      "msg":fMsg(AST),
-      "línea":analizador.líneaDeNodo_(AST),
-      "columna":analizador.columnaDeNodo_(AST)
-    })
-  for nodo in analizador.hijosDeNodo_(AST):
-    resultado += buscarNodosCon_YGenerar_(analizador, nodo, fVal, fMsg)
-  return resultado
-
-def nodosDeNombresProhibidosEnAST(analizador, AST, nombres):
+  # Generador de los hallazgos (en preorden): recorre el AST sólo hasta donde se lo pida
+  return analizador.hallazgosEnOrden(AST, [Búsqueda(analizador, fVal, fMsg)], lambda hallazgo : True)
+
+def visitanteNombresProhibidos(analizador, nombres):
   todosLosNombres = nombres if (type(nombres) == type([])) else [nombres]
-  return buscarNodoDeTipo_Con_(analizador, AST, analizador.tiposNombre(),
+  return visitanteDeTipo_Con_(analizador, analizador.tiposNombre(),
     lambda nodo : analizador.nombreNodo_(nodo) in todosLosNombres,
     lambda nodo : analizador.nombreNodo_(nodo)
   )
 
-def buscarNodoDeTipo_Con_(analizador, AST, tipo, fVal, fMsg):
-  return buscarNodosCon_YGenerar_(analizador, AST,
-    lambda nodo : analizador.es_NodoDeTipo_(nodo, tipo) and fVal(nodo),
-    lambda nodo : primitivaNoPermitida(fMsg(nodo))
-  )
+def visitanteDeTipo_Con_(analizador, tipo, fVal, fMsg):
+  return Búsqueda(analizador, fVal, lambda nodo : primitivaNoPermitida(fMsg(nodo)), tipo)
 
-def buscarNodoImportEnAST(analizador, AST):
-  return buscarNodosCon_YGenerar_(analizador, AST,
-    lambda nodo : analizador.es_NodoImport(nodo),
-    lambda nodo : mensajeImportarNoPermitido
+def visitanteImport(analizador):
+  return Búsqueda(analizador,
+    lambda nodo : True,
+    lambda nodo : mensajeImportarNoPermitido,
+    analizador.tiposImport()
   )
 
-def buscarNodoRaiseEnAST(analizador, AST):
-  return buscarNodosCon_YGenerar_(analizador, AST,
-    lambda nodo : analizador.es_NodoExcepción(nodo),
-    lambda nodo : mensajeExcepcionesNoPermitidas
+def visitanteRaise(analizador):
+  return Búsqueda(analizador,
+    lambda nodo : True,
+    lambda nodo : mensajeExcepcionesNoPermitidas,
+    analizador.tiposExcepción()
   )
-
-for concepto in conceptos:
-  REGLAS["CONCEPT_" + concepto[0]] = lambda analizador, AST, código, regla : buscarNodosCon_YGenerar_(analizador, AST,
-    lambda nodo : concepto[1](analizador, AST, código, regla, nodo), lambda nodo : concepto[2]
-  )
\ No newline at end of file
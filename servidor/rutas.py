@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+
+import threading
+
+# Tabla de rutas del servidor, armada una única vez a partir de mensajesServidor.
+# Las rutas exactas (GET, FILE, POST, PUT) van a un diccionario y las que se identifican
+# por un prefijo (GET_STARTS, STREAM_STARTS, FILE_STARTS) van a un trie de caracteres, así que buscar
+# una ruta no arma strings nuevos. Cada destino trae su propio Contador, así que contar tampoco arma strings ni
+# toma un lock compartido por todas las rutas.
+
+# Familias de rutas por método, en el orden en que se priorizan cuando dos coinciden
+FAMILIAS = {
+  "GET":{"exactas":["GET","FILE"], "prefijos":["GET_STARTS","STREAM_STARTS","FILE_STARTS"]},
+  "POST":{"exactas":["POST"], "prefijos":[]},
+  "PUT":{"exactas":["PUT"], "prefijos":[]}
+}
+PRIORIDAD = ["GET","GET_STARTS","STREAM_STARTS","FILE","FILE_STARTS","POST","PUT"]
+# Para cada método, la familia exacta que le gana a cualquier prefijo
+PRIORIDAD_EXACTA = {"GET":"GET", "POST":"POST", "PUT":"PUT"}
+
+FIN = None # Clave de un nodo del trie en el que termina un prefijo
+
+class TablaDeRutas(object):
+  def __init__(self, msgs):
+    self.exactas = {}
+    self.prefijos = {}
+    self.contadores = []
+    for metodo in FAMILIAS:
+      self.exactas[metodo] = {}
+      self.prefijos[metodo] = {}
+      for familia in FAMILIAS[metodo]["exactas"]:
+        for msg in msgs[familia]:
+          ruta = "/" + msg
+          self.agregar(self.exactas[metodo], ruta, (familia, msg, msgs[familia][msg], len(ruta), self.nuevoContador(metodo, msg)))
+      for familia in FAMILIAS[metodo]["prefijos"]:
+        for msg in msgs[familia]:
+          self.agregarPrefijo(self.prefijos[metodo], "/" + msg + "/", familia, msg, msgs[familia][msg], self.nuevoContador(metodo, msg))
+
+  def agregar(self, tabla, clave, destino):
+    if not (clave in tabla) or tienePrioridad(destino[0], tabla[clave][0]):
+      tabla[clave] = destino
+
+  def nuevoContador(self, metodo, msg):
+    contador = Contador(metodo + " /" + msg)
+    self.contadores.append(contador)
+    return contador
+
+  def agregarPrefijo(self, trie, prefijo, familia, msg, handler, contador):
+    nodo = trie
+    for c in prefijo:
+      if not (c in nodo):
+        nodo[c] = {}
+      nodo = nodo[c]
+    self.agregar(nodo, FIN, (familia, msg, handler, len(prefijo), contador))
+
+  def buscar(self, metodo, ruta):
+    # Devuelve (familia, msg, handler, largo del prefijo, contador) o None si la ruta no existe
+    exacta = self.exactas[metodo].get(ruta)
+    if not (exacta is None) and exacta[0] == PRIORIDAD_EXACTA[metodo]:
+      return contar(exacta)
+    prefijo = self.buscarPrefijo(self.prefijos[metodo], ruta)
+    if not (prefijo is None) and (exacta is None or tienePrioridad(prefijo[0], exacta[0])):
+      return contar(prefijo)
+    if not (exacta is None):
+      return contar(exacta)
+    return None
+
+  def buscarPrefijo(self, trie, ruta):
+    # Devuelve el prefijo más corto de la ruta que esté en el trie
+    nodo = trie
+    for c in ruta:
+      nodo = nodo.get(c)
+      if nodo is None:
+        return None
+      if FIN in nodo:
+        return nodo[FIN]
+    return None
+
+  def estadisticas(self):
+    # Las rutas que se usaron, con cuántas veces (dos destinos pueden tener la misma ruta, como GET y GET_STARTS)
+    resultado = {}
+    for contador in self.contadores:
+      cuenta = contador.leer()
+      if cuenta > 0:
+        resultado[contador.clave] = resultado.get(contador.clave, 0) + cuenta
+    return resultado
+
+class Contador(object):
+  # Cada uno con su lock: dos pedidos sólo se esperan si van a la misma ruta
+  def __init__(self, clave):
+    self.clave = clave
+    self.cuenta = 0
+    self.lock = threading.Lock()
+
+  def sumar(self):
+    with self.lock:
+      self.cuenta += 1
+
+  def leer(self):
+    with self.lock:
+      return self.cuenta
+
+def contar(destino):
+  destino[4].sumar()
+  return destino
+
+def tienePrioridad(familia, otraFamilia):
+  return PRIORIDAD.index(familia) < PRIORIDAD.index(otraFamilia)
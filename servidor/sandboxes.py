@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import tempfile
+import threading
+
+# Pool de carpetas de trabajo para las correcciones. En lugar de borrar y volver a crear /rtTest/<usuario> en
+# cada entrega (en disco, y pisándose si el mismo usuario manda dos entregas a la vez), cada corrección toma una
+# carpeta con nombre único de un pool que está en un filesystem en RAM (SANDBOX_DIR, por defecto en /dev/shm).
+# Al devolverla se vacía (en tmpfs es barato) y queda lista para la próxima. Los nombres llevan el pid del
+# servidor, así al arrancar se pueden borrar las carpetas que dejaron servidores que ya no están.
+
+def baseDeSandboxes():
+  if 'SANDBOX_DIR' in os.environ:
+    return os.environ['SANDBOX_DIR']
+  return '/dev/shm/rtTest' if os.path.isdir('/dev/shm') else '/rtTest'
+
+BASE = baseDeSandboxes()
+TAMAÑO = int(os.environ['SANDBOXES']) if 'SANDBOXES' in os.environ else max(4, 2 * (os.cpu_count() or 1))
+PREFIJO = "sandbox-"
+
+class PoolDeSandboxes(object):
+  def __init__(self, base, tamaño):
+    self.base = base
+    self.tamaño = tamaño
+    self.libres = []
+    self.preparado = False
+    self.lock = threading.Lock()
+
+  def preparar(self):
+    # La primera vez: crea la base, borra lo que dejaron servidores muertos y crea las carpetas del pool
+    os.makedirs(self.base, exist_ok=True)
+    os.chmod(self.base, 0o777)
+    for entrada in os.scandir(self.base):
+      if entrada.name.startswith(PREFIJO) and not procesoVivo(entrada.name[len(PREFIJO):].split("-")[0]):
+        shutil.rmtree(entrada.path, ignore_errors=True)
+    for _ in range(self.tamaño):
+      self.libres.append(self.crear())
+    self.preparado = True
+
+  def crear(self):
+    ruta = tempfile.mkdtemp(prefix=PREFIJO + str(os.getpid()) + "-", dir=self.base)
+    os.chmod(ruta, 0o777)
+    return ruta
+
+  def tomar(self):
+    with self.lock:
+      if not self.preparado:
+        self.preparar()
+      if len(self.libres) > 0:
+        return self.libres.pop()
+    return self.crear()
+
+  def devolver(self, ruta, conservar=False):
+    # Con conservar (ejecutando local) la carpeta queda como está, para poder mirarla, y sale del pool
+    if conservar:
+      return
+    if not vaciar(ruta):
+      shutil.rmtree(ruta, ignore_errors=True)
+      return
+    with self.lock:
+      if len(self.libres) < self.tamaño:
+        self.libres.append(ruta)
+        return
+    os.rmdir(ruta)
+
+def vaciar(ruta):
+  # Borra el contenido de la carpeta (no la carpeta). Devuelve si quedó vacía y con los permisos de siempre
+  try:
+    for entrada in os.scandir(ruta):
+      if entrada.is_dir(follow_symlinks=False):
+        shutil.rmtree(entrada.path)
+      else:
+        os.unlink(entrada.path)
+    os.chmod(ruta, 0o777)
+    return True
+  except OSError:
+    return False
+
+def procesoVivo(pid):
+  try:
+    os.kill(int(pid), 0)
+  except ValueError:
+    return True # No es una carpeta del pool: no la toco
+  except ProcessLookupError:
+    return False
+  except PermissionError:
+    pass
+  return True
+
+POOL = PoolDeSandboxes(BASE, TAMAÑO)
+
+class sandbox(object):
+  # with sandbox() as ruta: ...
+  def __init__(self, conservar=False):
+    self.conservar = conservar
+    self.ruta = None
+
+  def __enter__(self):
+    self.ruta = POOL.tomar()
+    return self.ruta
+
+  def __exit__(self, tipo, valor, traza):
+    POOL.devolver(self.ruta, self.conservar)
+    return False
@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+
+import gzip, uuid, threading
+from collections import OrderedDict
+from codec import volcar, volcarTexto
+
+# Respuestas JSON pre-serializadas.
+# Un JsonSerializado es un valor que ya está codificado (y opcionalmente comprimido): se puede poner
+# dentro de cualquier respuesta y al serializarla se inserta tal cual, sin volver a recorrerlo.
+
+TAMAÑO_MINIMO_GZIP = 1024 # Por debajo de esto no vale la pena comprimir
+
+class JsonSerializado(object):
+  def __init__(self, valor):
+    self.bytes = serializar(valor)
+    self.texto = self.bytes.decode('utf-8')
+    self._gzip = None
+
+  def comprimido(self):
+    if self._gzip is None:
+      self._gzip = gzip.compress(self.bytes, 6, mtime=0)
+    return self._gzip
+
+  def convieneComprimir(self):
+    return len(self.bytes) >= TAMAÑO_MINIMO_GZIP
+
+# Los JsonSerializado anidados se reemplazan primero por una marca (un string que no puede venir de un
+# cliente porque incluye un identificador aleatorio del proceso) y después la marca por el texto ya codificado.
+PREFIJO_MARCA = "\0" + uuid.uuid4().hex + ":"
+
+def serializar(valor):
+  # Devuelve los bytes (UTF-8) del JSON de valor
+  if isinstance(valor, JsonSerializado):
+    return valor.bytes
+  anidados = []
+  def marcar(x):
+    if isinstance(x, JsonSerializado):
+      anidados.append(x)
+      return PREFIJO_MARCA + str(len(anidados) - 1)
+    raise TypeError("Object of type " + type(x).__name__ + " is not JSON serializable")
+  datos = volcar(valor, marcar)
+  if len(anidados) == 0:
+    return datos
+  texto = datos.decode('utf-8')
+  for i in range(len(anidados)):
+    texto = texto.replace(volcarTexto(PREFIJO_MARCA + str(i)), anidados[i].texto, 1)
+  return bytes(texto, 'utf-8')
+
+class CacheDeVistas(object):
+  # Caché LRU de JsonSerializado identificados por una clave (la vista que ve cada usuario)
+  def __init__(self, máximo=512):
+    self.máximo = máximo
+    self.vistas = OrderedDict()
+    self.lock = threading.Lock()
+
+  def obtener(self, clave, construir):
+    with self.lock:
+      vista = self.vistas.get(clave)
+      if not (vista is None):
+        self.vistas.move_to_end(clave)
+        return vista
+    vista = JsonSerializado(construir())
+    with self.lock:
+      self.vistas[clave] = vista
+      if len(self.vistas) > self.máximo:
+        self.vistas.popitem(last=False)
+    return vista
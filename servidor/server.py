@@ -19,7 +19,7 @@ from server_httpServer import Servidor # HTTPServer
 MODO_WEB = False
 verb = False
 
-def launch_server(ip='localhost', port=8000, v=False):
+def launch_server(ip='localhost', port=8000, v=False, asincronico=False, procesos=1):
     global verb
     verb = v
     MODO_WEB = ip != 'localhost'
@@ -30,7 +30,7 @@ def launch_server(ip='localhost', port=8000, v=False):
         print('Launch LOCAL Server ' + ip + ":" + str(port))
     sys.stdout.flush()
     EstablecerIP(ip, port)
-    Servidor().run(ip, port, mensajesServidor, failCallback, verb)
+    Servidor().run(ip, port, mensajesServidor, failCallback, verb, asincronico, procesos)
     print('Exit...\n')
 
 def mi_ip():
@@ -44,6 +44,8 @@ if __name__ == '__main__':
     parser.add_argument('-v', dest="v", default=False, type=bool, help='Modo verborrágico.')
     parser.add_argument('-p', dest="PORT", default=8000, type=int, help='Puerto')
     parser.add_argument('-l', dest="LOCAL", default=False, type=bool, help='Ejecución local')
+    parser.add_argument('-a', dest="ASYNC", default=False, type=bool, help='Modo asincrónico (asyncio + pool de hilos de tamaño fijo)')
+    parser.add_argument('-w', dest="WORKERS", default=1, type=int, help='Cantidad de procesos (modo prefork, comparten el puerto)')
     args = parser.parse_args()
     PORT = (int(os.environ['PORT']) if 'PORT' in os.environ else args.PORT)
     if args.LOCAL:
@@ -55,4 +57,4 @@ if __name__ == '__main__':
       print("\n\n || REAL ||\n\n")
       print("ATENCIÓN: estás ejecutando el servidor en [[MODO REAL]] (el que debería estar corriendo en el servidor real).")
       print("Si querés hacer pruebas, volvé a ejecutarlo con el flag '-l'.\n")
-    launch_server(mi_ip(), PORT, args.v)
+    launch_server(mi_ip(), PORT, args.v, args.ASYNC, args.WORKERS)
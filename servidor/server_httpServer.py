@@ -1,7 +1,12 @@
 import os, io
-import json
 import ssl
+import socket
+import signal
 import threading
+import asyncio
+import gc, time
+import ctypes, ctypes.util
+from concurrent.futures import ThreadPoolExecutor
 
 try: # python 3
     from http.server import BaseHTTPRequestHandler, HTTPServer
@@ -15,13 +20,28 @@ except: # python 2
     from SocketServer import ThreadingMixIn
 
 from utils import mostrar_excepcion, texto_excepcion
+from rutas import TablaDeRutas
+from estaticos import archivoEstatico, sinModificar, aceptaGzip, rangoPedido, RANGO_INVALIDO
+from serializacion import JsonSerializado, serializar
+from codec import cargar
 
 CONFIG = {"DATA":{}}
 
+def valorEntorno(clave, default):
+  return int(os.environ[clave]) if clave in os.environ else default
+
+TIMEOUT_INACTIVIDAD = valorEntorno("TIMEOUT_INACTIVIDAD", 15) # segundos que una conexión persistente puede quedar sin pedidos
+
 class HandlerAC(moduloHTTPRequest):
+  # HTTP/1.1: el campus reusa la misma conexión (y la misma sesión TLS) entre pedidos,
+  # así que todas las respuestas tienen que llevar Content-Length.
+  protocol_version = "HTTP/1.1"
+  timeout = TIMEOUT_INACTIVIDAD
+
   def _set_response(self, n=200, headers={'Content-type':'text/html'}):
     self.send_response(n)
-    self.send_header('Cache-Control', 'no-cache')
+    if not ('Cache-Control' in headers):
+      self.send_header('Cache-Control', 'no-cache')
     for h in headers:
       self.send_header(h, headers.get(h))
     self.cors_headers()
@@ -36,49 +56,50 @@ class HandlerAC(moduloHTTPRequest):
   def do_OPTIONS(self):
     CONFIG["DATA"] = {"metodo":"OPTIONS","path":self.path}
     self.send_response(200, "ok")
+    self.send_header('Content-Length', '0')
     self.cors_headers()
     self.end_headers()
 
   def do_GET(self):
     CONFIG["DATA"] = {"metodo":"GET","path":self.path}
     try:
-      ruta = self.path.split("?")[0]
-      for msg in CONFIG["msgs"]["GET"]:
-        if (ruta == "/" + msg):
-          self.responder(CONFIG["msgs"]["GET"][msg](CONFIG["verb"]))
-          return
-      for msg in CONFIG["msgs"]["GET_STARTS"]:
-        if (ruta.startswith("/" + msg + "/")):
-          self.responder(CONFIG["msgs"]["GET_STARTS"][msg](ruta[2+len(msg):]))
-          return
-      for msg in CONFIG["msgs"]["FILE"]:
-        if (ruta == "/" + msg):
-          self.archivoStatico(CONFIG["msgs"]["FILE"][msg])
-          return
-      for msg in CONFIG["msgs"]["FILE_STARTS"]:
-        if (ruta.startswith("/" + msg + "/")):
-          self.archivoStatico(CONFIG["msgs"]["FILE_STARTS"][msg](ruta[2+len(msg):]))
-          return
-      self.error("[GET] Ruta {} inválida".format(self.path))
+      ruta = self.path.partition("?")[0]
+      destino = CONFIG["rutas"].buscar("GET", ruta)
+      if destino is None:
+        self.error("[GET] Ruta {} inválida".format(self.path))
+        return
+      familia, msg, handler, largo, _ = destino
+      if familia == "GET":
+        self.responder(handler(CONFIG["verb"]))
+      elif familia == "GET_STARTS":
+        self.responder(handler(ruta[largo:]))
+      elif familia == "STREAM_STARTS":
+        self.transmitir(handler(ruta[largo:]))
+      elif familia == "FILE":
+        self.archivoStatico(handler, CONFIG["msgs"]["CACHE"].get(msg))
+      else: # FILE_STARTS
+        self.archivoStatico(handler(ruta[largo:]), CONFIG["msgs"]["CACHE"].get(msg))
     except Exception as e:
       CONFIG["DATA"]["e"] = texto_excepcion(e)
       CONFIG["fail"](CONFIG["DATA"])
       print(CONFIG["DATA"]["e"])
+      self.close_connection = True # Puede haber quedado una respuesta a medio mandar
       self.responder({'resultado':"SERVER_BUG"})
 
   def do_PUT(self):
     CONFIG["DATA"] = {"metodo":"PUT","path":self.path}
     try:
       content_length = int(self.headers['Content-Length']) # <--- Gets the size of data
-      put_data = self.rfile.read(content_length).decode('utf-8') # <--- Gets the data itself
+      put_data = self.rfile.read(content_length) # <--- Gets the data itself
     except Exception as e:
       CONFIG["DATA"]["e"] = texto_excepcion(e)
       CONFIG["fail"](CONFIG["DATA"],"_readData")
       print(CONFIG["DATA"]["e"])
+      self.close_connection = True # No se sabe dónde termina el cuerpo: lo que quedó no es el próximo pedido
       self.responder({'resultado':"SERVER_BUG"})
       return
     try:
-      jsonObject = json.loads(put_data)
+      jsonObject = cargar(put_data)
     except Exception as e:
       CONFIG["DATA"]["e"] = texto_excepcion(e)
       CONFIG["fail"](CONFIG["DATA"],"_loadJson")
@@ -98,15 +119,16 @@ class HandlerAC(moduloHTTPRequest):
     CONFIG["DATA"] = {"metodo":"POST","path":self.path}
     try:
       content_length = int(self.headers['Content-Length']) # <--- Gets the size of data
-      post_data = self.rfile.read(content_length).decode('utf-8') # <--- Gets the data itself
+      post_data = self.rfile.read(content_length) # <--- Gets the data itself
     except Exception as e:
       CONFIG["DATA"]["e"] = texto_excepcion(e)
       CONFIG["fail"](CONFIG["DATA"],"_readData")
       print(CONFIG["DATA"]["e"])
+      self.close_connection = True # No se sabe dónde termina el cuerpo: lo que quedó no es el próximo pedido
       self.responder({'resultado':"SERVER_BUG"})
       return
     try:
-      jsonObject = json.loads(post_data)
+      jsonObject = cargar(post_data)
     except Exception as e:
       CONFIG["DATA"]["e"] = texto_excepcion(e)
       CONFIG["fail"](CONFIG["DATA"],"_loadJson")
@@ -116,11 +138,11 @@ class HandlerAC(moduloHTTPRequest):
     try:
       jsonObject["ip"] = self.ipCliente()
       CONFIG["DATA"]["json"] = jsonObject
-      for msg in CONFIG["msgs"]["POST"]:
-        if (self.path == "/" + msg):
-          self.responder(CONFIG["msgs"]["POST"][msg](jsonObject, CONFIG["verb"]))
-          return
-      self.error("[POST] Ruta {} inválida".format(self.path))
+      destino = CONFIG["rutas"].buscar("POST", self.path)
+      if destino is None:
+        self.error("[POST] Ruta {} inválida".format(self.path))
+        return
+      self.responder(destino[2](jsonObject, CONFIG["verb"]))
     except Exception as e:
       CONFIG["DATA"]["e"] = texto_excepcion(e)
       CONFIG["fail"](CONFIG["DATA"])
@@ -138,23 +160,97 @@ class HandlerAC(moduloHTTPRequest):
 
   def error(self, msg):
     print(msg)
-    self._set_response(404, {})
+    self._set_response(404, {'Content-Length':'0'})
 
   def responder(self, jsonObject):
-    self._set_response(200, {'Content-Type': 'application/json'})
-    datos = json.dumps(jsonObject, ensure_ascii=False)
-    self.wfile.write(bytes(datos, 'utf-8'))
-
-  def archivoStatico(self, ruta):
-    if (os.path.isfile(ruta)):
-      self._set_response(200, {'Content-type':tipo_archivo(ruta)})
-      # f = io.open(ruta, mode='r', encoding='utf-8')
+    headers = {'Content-Type': 'application/json'}
+    datos = serializar(jsonObject)
+    if isinstance(jsonObject, JsonSerializado) and jsonObject.convieneComprimir():
+      headers['Vary'] = 'Accept-Encoding'
+      if aceptaGzip(self.headers):
+        headers['Content-Encoding'] = 'gzip'
+        datos = jsonObject.comprimido()
+    headers['Content-Length'] = str(len(datos))
+    self._set_response(200, headers)
+    self.wfile.write(datos)
+
+  def transmitir(self, eventos):
+    # Server-Sent Events: no se sabe el largo de la respuesta, así que la conexión se cierra al terminar
+    self.close_connection = True
+    self._set_response(200, {'Content-Type':'text/event-stream', 'Connection':'close'})
+    try:
+      for evento in eventos:
+        if evento is None:
+          self.wfile.write(b": \n\n") # Comentario para que no se corte la conexión mientras no hay novedades
+        else:
+          self.wfile.write(b"data: " + serializar(evento) + b"\n\n")
+        self.wfile.flush()
+    except ConnectionError:
+      pass # El cliente se fue
+    finally:
+      eventos.close()
+
+  def archivoStatico(self, ruta, politica=None):
+    # politica: None (revalidar siempre), una de CACHE_POLITICAS o "NO" (no guardarlo en memoria)
+    entrada = archivoEstatico(ruta, tipo_archivo(ruta), politica != "NO")
+    if entrada is None:
+      self._set_response(404, {'Content-type':'text/html', 'Content-Length':'0'})
+      print("Archivo {} no econtrado".format(self.path))
+      return
+    headers = {
+      'ETag':entrada["etag"],
+      'Last-Modified':entrada["modificado"],
+      'Cache-Control':CACHE_POLITICAS.get(politica, 'no-cache')
+    }
+    if sinModificar(entrada, self.headers):
+      self._set_response(304, headers)
+      return
+    headers['Accept-Ranges'] = 'bytes'
+    rango = rangoPedido(entrada, self.headers)
+    if rango == RANGO_INVALIDO:
+      headers['Content-Range'] = 'bytes */' + str(entrada["tamaño"])
+      headers['Content-Length'] = '0'
+      self._set_response(416, headers)
+      return
+    headers['Content-type'] = entrada["tipo"]
+    estado = 200
+    inicio = 0
+    cantidad = entrada["tamaño"]
+    datos = entrada["datos"]
+    if not (rango is None):
+      estado = 206
+      inicio = rango[0]
+      cantidad = rango[1] - rango[0] + 1
+      headers['Content-Range'] = 'bytes {}-{}/{}'.format(rango[0], rango[1], entrada["tamaño"])
+    elif not (entrada["gzip"] is None):
+      headers['Vary'] = 'Accept-Encoding'
+      if aceptaGzip(self.headers):
+        headers['Content-Encoding'] = 'gzip'
+        datos = entrada["gzip"]
+        cantidad = len(datos)
+    headers['Content-Length'] = str(cantidad)
+    self._set_response(estado, headers)
+    if datos is None:
+      # Archivo grande o que no se guarda en memoria: se manda directo desde el disco
       f = io.open(ruta, mode='rb')
-      self.wfile.write(f.read())
-      f.close()
+      try:
+        self.enviarArchivo(f, inicio, cantidad)
+      finally:
+        f.close()
     else:
-      self._set_response(404)
-      print("Archivo {} no econtrado".format(self.path))
+      self.wfile.write(datos[inicio:inicio+cantidad] if estado == 206 else datos)
+
+  def enviarArchivo(self, f, inicio, cantidad):
+    # socket.sendfile usa os.sendfile si puede (sin copiar a memoria) y si no (TLS) manda de a bloques
+    self.connection.sendfile(f, inicio, cantidad)
+
+CACHE_POLITICAS = {
+  "CORTO":'public, max-age=600', # Cambia poco: se puede usar sin preguntar unos minutos y después se revalida
+  "INMUTABLE":'public, max-age=31536000, immutable' # Sólo para rutas que cambian con el contenido (con un hash)
+}
+
+def estadisticasRutas():
+  return CONFIG["rutas"].estadisticas() if ("rutas" in CONFIG) else {}
 
 def tipo_archivo(filename):
     if filename[-4:] == '.css':
@@ -176,21 +272,183 @@ def tipo_archivo(filename):
 class ServerAC(ThreadingMixIn, moduloHTTPServer):
     """ This class allows to handle requests in separated threads.
         No further content needed, don't touch this. """
+    daemon_threads = True # Las conexiones persistentes inactivas no frenan el cierre del servidor
+    reusePort = False # En modo prefork cada worker abre su propio socket en el mismo puerto
+
+    def server_bind(self):
+      if self.reusePort:
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+      super().server_bind()
+
+# Modo asincrónico: asyncio atiende las conexiones (lectura con timeout, tope de conexiones)
+# y los handlers de mensajesServidor corren en un pool de hilos de tamaño fijo.
+
+HILOS_DEFAULT = 8
+MAX_CONEXIONES_DEFAULT = 256
+TIMEOUT_LECTURA_DEFAULT = 10 # segundos
+
+class SalidaAsync(object):
+  # Hace las veces de wfile para un HandlerACAsync: escribe en el stream de asyncio desde el hilo del pool
+  def __init__(self, loop, writer):
+    self.loop = loop
+    self.writer = writer
+
+  def write(self, datos):
+    asyncio.run_coroutine_threadsafe(self._escribir(bytes(datos)), self.loop).result()
+    return len(datos)
+
+  async def _escribir(self, datos):
+    self.writer.write(datos)
+    await self.writer.drain()
+
+  def flush(self):
+    pass
+
+  def enviarArchivo(self, f, inicio, cantidad):
+    asyncio.run_coroutine_threadsafe(self._enviarArchivo(f, inicio, cantidad), self.loop).result()
+
+  async def _enviarArchivo(self, f, inicio, cantidad):
+    await self.writer.drain()
+    await self.loop.sendfile(self.writer.transport, f, inicio, cantidad)
+
+class HandlerACAsync(HandlerAC):
+  # Mismo HandlerAC, pero el pedido ya fue leído por el event loop
+  def __init__(self, pedido, salida, client_address, server):
+    self.pedido = pedido
+    self.salida = salida
+    super().__init__(None, client_address, server)
+
+  def setup(self):
+    self.rfile = io.BytesIO(self.pedido)
+    self.wfile = self.salida
+
+  def handle(self):
+    # Un solo pedido: el event loop decide si la conexión sigue abierta (según close_connection)
+    self.close_connection = True
+    self.handle_one_request()
+
+  def finish(self):
+    pass
+
+  def enviarArchivo(self, f, inicio, cantidad):
+    self.salida.enviarArchivo(f, inicio, cantidad)
+
+class ServerACAsync(object):
+  def __init__(self, hilos, maxConexiones, timeoutLectura, timeoutInactividad):
+    self.ejecutor = ThreadPoolExecutor(max_workers=hilos)
+    # Los pedidos que se quedan esperando (long-poll, streams) van a otro pool para no frenar al resto
+    self.ejecutorEsperas = ThreadPoolExecutor(max_workers=maxConexiones)
+    self.maxConexiones = maxConexiones
+    self.timeoutLectura = timeoutLectura
+    self.timeoutInactividad = timeoutInactividad
+    self.conexiones = 0
+
+  async def servir(self, host, port, context, reusePort=False):
+    servidor = await asyncio.start_server(self.atender, host, port, ssl=context,
+      ssl_handshake_timeout=(self.timeoutLectura if context else None), reuse_port=reusePort)
+    async with servidor:
+      await servidor.serve_forever()
+
+  async def atender(self, reader, writer):
+    if self.conexiones >= self.maxConexiones:
+      writer.write(b"HTTP/1.0 503 Service Unavailable\r\nContent-Length: 0\r\n\r\n")
+      await self.cerrarConexion(writer)
+      return
+    self.conexiones += 1
+    try:
+      salida = SalidaAsync(asyncio.get_running_loop(), writer)
+      timeout = self.timeoutLectura
+      seguir = True
+      while seguir:
+        pedido = await self.leerPedido(reader, timeout)
+        if pedido is None:
+          break
+        ejecutor = self.ejecutorEsperas if esPedidoDeEspera(pedido) else self.ejecutor
+        handler = await asyncio.get_running_loop().run_in_executor(ejecutor,
+          HandlerACAsync, pedido, salida, writer.get_extra_info('peername'), self)
+        seguir = not handler.close_connection
+        timeout = self.timeoutInactividad
+    except Exception as e:
+      mostrar_excepcion(e)
+    finally:
+      self.conexiones -= 1
+      await self.cerrarConexion(writer)
+
+  async def leerPedido(self, reader, timeout):
+    # Devuelve el pedido completo (cabecera y cuerpo) o None si el cliente no lo mandó a tiempo
+    try:
+      cabecera = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), timeout)
+      largo = largoDelCuerpo(cabecera)
+      cuerpo = b""
+      if largo > 0:
+        cuerpo = await asyncio.wait_for(reader.readexactly(largo), self.timeoutLectura)
+      return cabecera + cuerpo
+    except (asyncio.TimeoutError, asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError, ValueError):
+      return None
+
+  async def cerrarConexion(self, writer):
+    try:
+      writer.close()
+      await writer.wait_closed()
+    except Exception:
+      pass
+
+  def cerrar(self):
+    self.ejecutor.shutdown(wait=False)
+    self.ejecutorEsperas.shutdown(wait=False)
+
+PR_SET_PDEATHSIG = 1
+
+def atarAlPadre(padre):
+  # Que el kernel mate al worker si el proceso padre muere (aunque sea con SIGKILL): si no, el worker seguiría
+  # atendiendo en el puerto (SO_REUSEPORT) junto al servidor que lance el supervisor en su lugar
+  try:
+    libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+    libc.prctl(PR_SET_PDEATHSIG, signal.SIGKILL)
+  except (OSError, AttributeError): # No es Linux: queda el killpg del supervisor
+    pass
+  if os.getppid() != padre: # El padre murió antes del prctl
+    os._exit(0)
+
+def interrumpir(s, f):
+  raise KeyboardInterrupt()
+
+def esPedidoDeEspera(pedido):
+  # El primer tramo de la ruta ("GET /trabajo/... HTTP/1.1" -> "trabajo") está en msgs["ESPERA"]
+  partes = pedido.split(b" ", 2)
+  if len(partes) < 2:
+    return False
+  tramos = partes[1].split(b"/")
+  return len(tramos) > 1 and tramos[1].decode('latin-1') in CONFIG["msgs"]["ESPERA"]
+
+def largoDelCuerpo(cabecera):
+  for línea in cabecera.split(b"\r\n"):
+    if línea[:15].lower() == b"content-length:":
+      return int(línea[15:].strip())
+  return 0
 
 class Servidor(object):
-  def run(self, host, port, msgs, failCallback, verb):
-    for k in ["GET","GET_STARTS","FILE","FILE_STARTS","POST","PUT"]:
+  def run(self, host, port, msgs, failCallback, verb, asincronico=False, procesos=1):
+    for k in ["GET","GET_STARTS","STREAM_STARTS","FILE","FILE_STARTS","POST","PUT","CACHE","ESPERA"]:
       if not (k in msgs):
         msgs[k] = {}
     CONFIG["msgs"] = msgs
+    CONFIG["rutas"] = TablaDeRutas(msgs)
     CONFIG["fail"] = failCallback
     CONFIG["verb"] = verb
+    self.context = self.contextoSSL() # Antes del fork: los workers comparten las claves de los session tickets
+    if procesos > 1:
+      self.runPrefork(host, port, asincronico, procesos)
+    elif asincronico:
+      self.runAsincronico(host, port)
+    else:
+      self.runHilos(host, port)
+
+  def runHilos(self, host, port, reusePort=False):
+    ServerAC.reusePort = reusePort
     self.servidor = ServerAC((host, port), HandlerAC)
-    if ("CERT" in os.environ) and ("KEY" in os.environ):
-      context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
-      context.load_cert_chain(certfile=os.environ["CERT"], keyfile=os.environ["KEY"])
-      context.set_ciphers("@SECLEVEL=1:ALL")
-      self.servidor.socket = context.wrap_socket(self.servidor.socket, server_side=True)
+    if not (self.context is None):
+      self.servidor.socket = self.context.wrap_socket(self.servidor.socket, server_side=True)
     seguirSirviendo = True
     while(seguirSirviendo):
       try:
@@ -201,7 +459,79 @@ class Servidor(object):
         mostrar_excepcion(e)
     self.cerrar()
     print('Exit...\n')
-  
+
+  def runAsincronico(self, host, port, reusePort=False):
+    self.servidor = ServerACAsync(
+      valorEntorno("HILOS", HILOS_DEFAULT),
+      valorEntorno("MAX_CONEXIONES", MAX_CONEXIONES_DEFAULT),
+      valorEntorno("TIMEOUT_LECTURA", TIMEOUT_LECTURA_DEFAULT),
+      TIMEOUT_INACTIVIDAD
+    )
+    try:
+      asyncio.run(self.servidor.servir(host, port, self.context, reusePort))
+    except KeyboardInterrupt:
+      pass
+    print("CLOSE")
+    self.servidor.cerrar()
+    print('Exit...\n')
+
+  # Modo prefork: los cursos y usuarios ya están cargados (se cargan al importar mensajesServidor), así que se
+  # congelan para que el gc no toque sus objetos y los workers los compartan con el proceso padre (copy-on-write).
+  # Cada worker abre su socket con SO_REUSEPORT en el mismo puerto y el kernel reparte las conexiones.
+  def runPrefork(self, host, port, asincronico, procesos):
+    gc.collect()
+    gc.freeze()
+    signal.signal(signal.SIGTERM, interrumpir) # Para que terminar el proceso padre también termine los workers
+    self.workers = {}
+    for i in range(procesos):
+      self.lanzarWorker(host, port, asincronico)
+    try:
+      while True:
+        pid, estado = os.wait()
+        if pid in self.workers:
+          del self.workers[pid]
+          print("Worker " + str(pid) + " terminó (" + str(estado) + "), lanzando otro")
+          time.sleep(1) # Por si falla al arrancar (por ejemplo, el puerto está ocupado)
+          self.lanzarWorker(host, port, asincronico)
+    except KeyboardInterrupt:
+      pass
+    print("CLOSE")
+    for pid in self.workers:
+      try:
+        os.kill(pid, signal.SIGTERM)
+      except OSError:
+        pass
+    print('Exit...\n')
+
+  def lanzarWorker(self, host, port, asincronico):
+    padre = os.getpid()
+    pid = os.fork()
+    if pid == 0:
+      signal.signal(signal.SIGTERM, signal.SIG_DFL)
+      atarAlPadre(padre)
+      try:
+        if asincronico:
+          self.runAsincronico(host, port, True)
+        else:
+          self.runHilos(host, port, True)
+      except BaseException as e:
+        mostrar_excepcion(e)
+      finally:
+        os._exit(0)
+    self.workers[pid] = True
+
+  def contextoSSL(self):
+    if ("CERT" in os.environ) and ("KEY" in os.environ):
+      context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+      context.load_cert_chain(certfile=os.environ["CERT"], keyfile=os.environ["KEY"])
+      context.set_ciphers("@SECLEVEL=1:ALL")
+      # Reanudación de sesiones: OpenSSL manda session tickets por defecto, cifrados con claves que genera al crear
+      # el contexto. Por eso el contexto se crea una sola vez (en run, antes de lanzar los workers del modo prefork):
+      # así un ticket sirve en cualquier worker, aunque SO_REUSEPORT mande la reconexión a otro. La caché de
+      # sesiones por id (TLS 1.2 sin tickets) sí es de cada proceso.
+      return context
+    return None
+
   def cerrar(self):
     print("CLOSE")
     self.servidor.server_close()
@@ -1,4 +1,5 @@
-from admin import admin_reset
+from admin import admin_reset, admin_stats, admin_ping
+from trabajos import estado_trabajo, eventos_trabajo
 from data import dame_cursos, tryLogin, dame_data_cuestionario, intentoCodigo, respuestaCuestionario, open_ej
 
 mensajesServidor = {
@@ -8,11 +9,20 @@ mensajesServidor = {
     "answer":respuestaCuestionario,
     "login":tryLogin,
     "cursos":dame_cursos,
-    "reset":admin_reset
+    "reset":admin_reset,
+    "stats":admin_stats
+  },
+  "GET":{
+    "ping":admin_ping # Lo usa el supervisor (main.py) para saber si el servidor sigue respondiendo
   },
   "GET_STARTS":{
-    "cuestionario":dame_data_cuestionario
+    "cuestionario":dame_data_cuestionario,
+    "trabajo":estado_trabajo # Long-poll del resultado de una corrección encolada
+  },
+  "STREAM_STARTS":{ # Server-Sent Events
+    "eventos":eventos_trabajo
   },
+  "ESPERA":["trabajo","eventos"], # Rutas que se quedan esperando (en modo asincrónico no ocupan el pool de hilos)
   "FILE":{
     "":"../../campus/index.html",
     "index.html":"../../campus/index.html",
@@ -26,5 +36,12 @@ mensajesServidor = {
     "csv":lambda x : 'locales/' + x + '.csv',
     "include":lambda x : '../../campus/include/' + x,
     "img":lambda x : '../../campus/img/' + x
+  },
+  "CACHE":{ # Política de caché de los archivos estáticos (por defecto se revalidan en cada carga, con el ETag)
+    # Las URLs no llevan versión, así que nada es INMUTABLE: include (el JS y CSS del campus) se revalida siempre
+    # para que después de actualizar el campus nadie se quede con el viejo
+    "favicon.ico":"CORTO",
+    "img":"CORTO",
+    "csv":"NO"
   }
 }
@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+
+import threading
+
+# Pool de sesiones persistentes (procesos que atienden muchas ejecuciones, como GHCi o el trabajador de Node).
+# Las sesiones se crean a medida que hacen falta, hasta un máximo; si están todas ocupadas, se espera.
+# Una sesión tiene que tener los métodos reutilizable() y cerrar(): al devolverla, si no es reutilizable
+# (se cayó, se pasó del timeout o ya se usó demasiado) se cierra y la próxima vez se crea otra.
+# Con reponer, en lugar de esperar a la próxima vez, la nueva se crea enseguida en otro hilo: sirve para las
+# sesiones que se usan una sola vez (como las de GHCi), así quien la pida no espera a que arranque.
+
+class PoolDeSesiones(object):
+  def __init__(self, tamaño, crear, reponer=False):
+    self.tamaño = tamaño
+    self.crear = crear
+    self.reponer = reponer
+    self.libres = []
+    self.abiertas = 0
+    self.condicion = threading.Condition()
+
+  def tomar(self):
+    with self.condicion:
+      while len(self.libres) == 0 and self.abiertas >= self.tamaño:
+        self.condicion.wait()
+      while len(self.libres) > 0:
+        sesión = self.libres.pop()
+        if sesión.reutilizable():
+          return sesión
+        sesión.cerrar() # Se cayó mientras esperaba
+        self.abiertas -= 1
+      self.abiertas += 1
+    try:
+      return self.crear()
+    except OSError:
+      self.soltar()
+      raise
+
+  def devolver(self, sesión):
+    if sesión.reutilizable():
+      with self.condicion:
+        self.libres.append(sesión)
+        self.condicion.notify()
+    else:
+      sesión.cerrar()
+      if self.reponer:
+        threading.Thread(target=self.reponerSesión, daemon=True).start()
+      else:
+        self.soltar()
+
+  def reponerSesión(self):
+    # Ocupa el lugar de la que se cerró
+    try:
+      sesión = self.crear()
+    except OSError:
+      self.soltar()
+      return
+    with self.condicion:
+      self.libres.append(sesión)
+      self.condicion.notify()
+
+  def soltar(self):
+    with self.condicion:
+      self.abiertas -= 1
+      self.condicion.notify()
+
+  def ejecutar(self, *argumentos):
+    sesión = self.tomar()
+    try:
+      return sesión.ejecutar(*argumentos)
+    finally:
+      self.devolver(sesión)
@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+
+import os
+import json
+import selectors
+import signal
+import tempfile
+import time
+from subprocess import Popen, PIPE
+
+# Pool de trabajadores de Node para Gobstones: en lugar de levantar "node gobstones-lang parse/run" en cada
+# pedido (que carga y compila todo el bundle cada vez), cada trabajador (trabajadorGobstones.js) lo carga una
+# sola vez y atiende pedidos de a uno por stdin/stdout, una línea JSON por pedido y otra por respuesta.
+# La salida y la falla son las mismas que las de la CLI, así que el análisis y el corrector las procesan igual.
+# Un trabajador se descarta si se pasó del timeout, si se cayó (por ejemplo porque se quedó sin memoria:
+# el heap de V8 está limitado con MEMORIA_NODE_MB) o después de USOS_MAXIMOS pedidos.
+# Un LoteNode usa el mismo trabajador para todos los casos de una entrega: como el trabajador se guarda el último
+# programa compilado, cada caso sólo corre el programa sobre su tablero. Mientras tanto, el trabajador está en el
+# cgroup de la entrega.
+
+from procesos import sacarPrivilegios, estáCancelado, LIMITE_SALIDA, BLOQUE, INTERVALO_SONDEO
+from sesiones import PoolDeSesiones
+from gruposDeControl import grupoDe, grupoDeSesiones, mudar
+
+USAR_POOL = os.environ.get('POOL_NODE', '1') != '0'
+SESIONES = int(os.environ['SESIONES_NODE']) if 'SESIONES_NODE' in os.environ else 2
+USOS_MAXIMOS = int(os.environ['USOS_NODE']) if 'USOS_NODE' in os.environ else 200
+MEMORIA_MB = int(os.environ['MEMORIA_NODE_MB']) if 'MEMORIA_NODE_MB' in os.environ else 512
+RUTA_GOBSTONES = os.environ.get('GOBSTONES_LANG', '/rtTest/gbs/dist/gobstones-lang')
+RUTA_TRABAJADOR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'trabajadorGobstones.js')
+TIMEOUT_INICIO = 30 # segundos que puede tardar el trabajador en cargar el bundle
+
+class SesiónNode(object):
+  def __init__(self):
+    grupo = grupoDeSesiones()
+    self.proceso = Popen(["node", "--max-old-space-size=" + str(MEMORIA_MB), RUTA_TRABAJADOR, RUTA_GOBSTONES],
+      stdin=PIPE, stdout=PIPE, preexec_fn=lambda: sacarPrivilegios(tempfile.gettempdir(), grupo))
+    os.set_blocking(self.proceso.stdout.fileno(), False)
+    self.buffer = bytearray()
+    self.pedidos = 0
+    self.sana = True
+    línea = self.leerLínea(time.monotonic() + TIMEOUT_INICIO, LIMITE_SALIDA)
+    if línea != b"LISTO":
+      self.cerrar()
+      raise OSError("No se pudo iniciar el trabajador de Gobstones")
+
+  def leerLínea(self, plazo, topeBytes, cancelado=None):
+    # Devuelve la próxima línea, None si no llegó a tiempo (o se canceló) o b"" si el trabajador se cayó
+    selector = selectors.DefaultSelector()
+    selector.register(self.proceso.stdout.fileno(), selectors.EVENT_READ)
+    try:
+      while not (b"\n" in self.buffer):
+        espera = INTERVALO_SONDEO if plazo is None else min(INTERVALO_SONDEO, plazo - time.monotonic())
+        if espera <= 0 or len(self.buffer) > topeBytes or estáCancelado(cancelado):
+          return None
+        for clave, _ in selector.select(espera):
+          datos = os.read(clave.fd, BLOQUE)
+          if len(datos) == 0:
+            return b""
+          self.buffer += datos
+    finally:
+      selector.close()
+    línea, _, resto = bytes(self.buffer).partition(b"\n")
+    self.buffer[:] = resto
+    return línea
+
+  def ejecutar(self, tipo, ruta, timeout, topeBytes, cancelado=None):
+    # Devuelve errcode (None si se pasó del timeout), stdout y stderr, como procesos.ejecutar
+    self.pedidos += 1
+    try:
+      self.proceso.stdin.write((json.dumps({"id":self.pedidos, "tipo":tipo, "ruta":os.path.abspath(ruta)}) + "\n").encode())
+      self.proceso.stdin.flush()
+    except OSError: # Se cayó antes de empezar
+      self.sana = False
+      raise
+    # La respuesta es JSON: la salida no se puede truncar, así que si se pasa del tope se toma como timeout
+    línea = self.leerLínea(None if timeout is None else time.monotonic() + timeout, 2 * topeBytes, cancelado)
+    if línea is None:
+      self.sana = False
+      return None, "", ""
+    if len(línea) == 0: # Se cayó el trabajador (por ejemplo, por falta de memoria)
+      self.sana = False
+      self.proceso.wait()
+      errcode = self.proceso.returncode
+      return (128 - errcode if errcode < 0 else errcode), "", ""
+    respuesta = json.loads(línea)
+    return respuesta["errcode"], respuesta["salida"], respuesta["falla"]
+
+  def reutilizable(self):
+    return self.sana and self.pedidos < USOS_MAXIMOS and self.proceso.poll() is None
+
+  def cerrar(self):
+    try:
+      os.killpg(self.proceso.pid, signal.SIGKILL)
+    except (ProcessLookupError, PermissionError):
+      pass
+    self.proceso.kill()
+    self.proceso.wait()
+    for pipe in [self.proceso.stdin, self.proceso.stdout]:
+      try:
+        pipe.close()
+      except OSError:
+        pass
+
+POOL = PoolDeSesiones(SESIONES, SesiónNode)
+
+class LoteNode(object):
+  # Varias ejecuciones en el mismo trabajador. Cada una da el mismo resultado que procesos.ejecutarConTimeout,
+  # o None si no se pudo usar el pool
+  def __init__(self):
+    self.sesión = None
+    self.grupo = None
+
+  def ejecutar(self, tipo, ruta, timeout, topeBytes=LIMITE_SALIDA, cancelado=None):
+    # tipo es "parse" o "run"
+    if not USAR_POOL:
+      return None
+    if not (self.sesión is None) and not self.sesión.sana:
+      self.cerrar()
+    inicio = time.monotonic()
+    try:
+      if self.sesión is None:
+        self.sesión = POOL.tomar()
+      self.mudar(grupoDe(ruta))
+      errcode, salida, falla = self.sesión.ejecutar(tipo, ruta, timeout, topeBytes, cancelado)
+    except (OSError, ValueError, KeyError) as e:
+      print("Pool de Node: " + str(e))
+      self.cerrar()
+      return None
+    duracion = time.monotonic() - inicio
+    if errcode is None:
+      return {"resultado":"TIMEOUT"}
+    return {
+      "resultado":"OK",
+      "errcode":errcode,
+      "salida":salida,
+      "falla":falla,
+      "duracion":duracion
+    }
+
+  def mudar(self, grupo):
+    if grupo != self.grupo:
+      mudar(self.sesión.proceso.pid, grupo)
+      self.grupo = grupo
+
+  def cerrar(self):
+    if not (self.sesión is None):
+      if not (self.grupo is None):
+        self.mudar(grupoDeSesiones())
+      self.grupo = None
+      POOL.devolver(self.sesión)
+      self.sesión = None
+
+def ejecutarEnNode(tipo, ruta, timeout, topeBytes=LIMITE_SALIDA, cancelado=None):
+  # Mismo resultado que procesos.ejecutarConTimeout, o None si no se pudo usar el pool
+  lote = LoteNode()
+  try:
+    return lote.ejecutar(tipo, ruta, timeout, topeBytes, cancelado)
+  finally:
+    lote.cerrar()
@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+
+import os
+import selectors
+import signal
+import tempfile
+import time
+import uuid
+from subprocess import Popen, PIPE
+
+# Pool de sesiones de GHCi para el corrector de Haskell: en lugar de levantar "echo 'main' | ghci -v0 src.hs"
+# en cada ejecución, cada sesión queda abierta y para cada ejecución hace :cd a la carpeta del trabajo,
+# :load src.hs y main. Después de main se imprime una marca en stdout y en stderr, así sé dónde termina la salida.
+# La salida es la misma que con el comando original (errores de compilación con "src.hs:", excepciones con
+# "*** Exception: ..."), así que AdaptarResultadoHaskell la procesa igual. Como GHCi termina siempre con
+# errcode 0, eso es lo que se devuelve.
+# Un LoteGhci usa la misma sesión para todos los casos de una entrega, así el corrector puede correr otro main en
+# el módulo que ya está cargado en lugar de volver a cargarlo. Mientras tanto, la sesión está en el cgroup de la entrega.
+# Una sesión atiende a una sola entrega (un LoteGhci) y después se descarta: el código entregado puede dejar hilos
+# corriendo (forkIO, unsafePerformIO) que sobreviven al :load y podrían leer la carpeta de la próxima entrega o
+# imprimir su marca. Lo que se gana es el arranque de GHCi: el pool tiene sesiones ya abiertas, y cuando se
+# descarta una se abre otra en su lugar.
+
+from procesos import sacarPrivilegios, SalidaAcotada, estáCancelado, LIMITE_SALIDA, BLOQUE, INTERVALO_SONDEO
+from sesiones import PoolDeSesiones
+from gruposDeControl import grupoDe, grupoDeSesiones, mudar
+
+USAR_POOL = os.environ.get('POOL_GHCI', '1') != '0'
+SESIONES = int(os.environ['SESIONES_GHCI']) if 'SESIONES_GHCI' in os.environ else 2
+COMANDO_GHCI = ["ghci", "-v0"]
+
+class SesiónGhci(object):
+  def __init__(self):
+    grupo = grupoDeSesiones()
+    self.proceso = Popen(COMANDO_GHCI, stdin=PIPE, stdout=PIPE, stderr=PIPE,
+      preexec_fn=lambda: sacarPrivilegios(tempfile.gettempdir(), grupo))
+    for pipe in [self.proceso.stdout, self.proceso.stderr]:
+      os.set_blocking(pipe.fileno(), False)
+    self.usos = 0
+    self.sana = True
+    # Los mains que se definen en la sesión se compilan con las mismas reglas que el módulo
+    self.enviar(':set prompt ""\n:set prompt-cont ""\n:seti -XNoExtendedDefaultRules\n')
+
+  def enviar(self, texto):
+    self.proceso.stdin.write(texto.encode())
+    self.proceso.stdin.flush()
+
+  def ejecutar(self, ruta, timeout, topeBytes, cancelado=None):
+    return self.correr(":cd " + ruta + "\n:load src.hs\nmain\n", timeout, topeBytes, cancelado)
+
+  def definirYCorrer(self, declaraciones, expresión, timeout, topeBytes):
+    # En el módulo que está cargado
+    return self.correr(":{\n" + declaraciones + "\n:}\n" + expresión + "\n", timeout, topeBytes)
+
+  def correr(self, comandos, timeout, topeBytes, cancelado=None):
+    # Devuelve errcode (None si se pasó del timeout), stdout y stderr, como procesos.ejecutar
+    self.usos += 1
+    marca = "<<FIN-" + uuid.uuid4().hex + ">>"
+    try:
+      self.enviar(comandos +
+        'System.IO.hPutStrLn System.IO.stderr "' + marca + '"\n' +
+        'System.IO.putStrLn "' + marca + '"\n')
+    except OSError: # Se cayó antes de empezar
+      self.sana = False
+      raise
+    salidas = {self.proceso.stdout.fileno():Marcada(topeBytes, marca), self.proceso.stderr.fileno():Marcada(topeBytes, marca)}
+    plazo = None if timeout is None else time.monotonic() + timeout
+    selector = selectors.DefaultSelector()
+    for fd in salidas:
+      selector.register(fd, selectors.EVENT_READ)
+    try:
+      while not all(salida.terminada for salida in salidas.values()):
+        espera = INTERVALO_SONDEO if plazo is None else min(INTERVALO_SONDEO, plazo - time.monotonic())
+        if espera <= 0 or estáCancelado(cancelado):
+          self.sana = False
+          return None, salidas[self.proceso.stdout.fileno()].texto(), salidas[self.proceso.stderr.fileno()].texto()
+        for clave, _ in selector.select(espera):
+          datos = os.read(clave.fd, BLOQUE)
+          if len(datos) == 0: # Se cayó GHCi
+            self.sana = False
+            self.proceso.wait()
+            return self.proceso.returncode, salidas[self.proceso.stdout.fileno()].texto(), salidas[self.proceso.stderr.fileno()].texto()
+          salidas[clave.fd].agregar(datos)
+    finally:
+      selector.close()
+    return 0, salidas[self.proceso.stdout.fileno()].texto(), salidas[self.proceso.stderr.fileno()].texto()
+
+  def reutilizable(self):
+    # Sólo si todavía no la usó ninguna entrega
+    return self.sana and self.usos == 0 and self.proceso.poll() is None
+
+  def cerrar(self):
+    try:
+      os.killpg(self.proceso.pid, signal.SIGKILL)
+    except (ProcessLookupError, PermissionError):
+      pass
+    self.proceso.kill()
+    self.proceso.wait()
+    for pipe in [self.proceso.stdin, self.proceso.stdout, self.proceso.stderr]:
+      try:
+        pipe.close()
+      except OSError:
+        pass
+
+class Marcada(object):
+  # Salida acotada que termina cuando llega la marca (que no forma parte del texto)
+  def __init__(self, topeBytes, marca):
+    self.salida = SalidaAcotada(topeBytes)
+    self.marca = (marca + "\n").encode()
+    self.últimos = b""
+    self.terminada = False
+
+  def agregar(self, datos):
+    self.salida.agregar(datos)
+    self.últimos = (self.últimos + datos)[-len(self.marca):]
+    self.terminada = self.últimos == self.marca
+
+  def texto(self):
+    texto = self.salida.texto()
+    marca = self.marca.decode()
+    return texto[:-len(marca)] if self.terminada and texto.endswith(marca) else texto
+
+POOL = PoolDeSesiones(SESIONES, SesiónGhci, reponer=True)
+
+class LoteGhci(object):
+  # Varias ejecuciones en la misma sesión. Cada una da el mismo resultado que procesos.ejecutarConTimeout,
+  # o None si no se pudo usar el pool
+  def __init__(self):
+    self.sesión = None
+    self.grupo = None
+
+  def ejecutar(self, ruta, timeout, topeBytes=LIMITE_SALIDA, cancelado=None):
+    return self.correr(lambda sesión : sesión.ejecutar(ruta, timeout, topeBytes, cancelado), ruta)
+
+  def definirYCorrer(self, declaraciones, expresión, timeout, topeBytes=LIMITE_SALIDA):
+    return self.correr(lambda sesión : sesión.definirYCorrer(declaraciones, expresión, timeout, topeBytes))
+
+  def correr(self, función, ruta=None):
+    if not USAR_POOL:
+      return None
+    if not (self.sesión is None) and not self.sesión.sana:
+      self.cerrar()
+    inicio = time.monotonic()
+    try:
+      if self.sesión is None:
+        self.sesión = POOL.tomar()
+      if not (ruta is None):
+        self.mudar(grupoDe(ruta))
+      errcode, salida, falla = función(self.sesión)
+    except OSError as e:
+      print("Pool de GHCi: " + str(e))
+      self.cerrar()
+      return None
+    duracion = time.monotonic() - inicio
+    if errcode is None:
+      return {"resultado":"TIMEOUT"}
+    return {
+      "resultado":"OK",
+      "errcode":errcode,
+      "salida":salida,
+      "falla":falla,
+      "duracion":duracion
+    }
+
+  def mudar(self, grupo):
+    if grupo != self.grupo:
+      mudar(self.sesión.proceso.pid, grupo)
+      self.grupo = grupo
+
+  def cerrar(self):
+    if not (self.sesión is None):
+      if not (self.grupo is None):
+        self.mudar(grupoDeSesiones())
+      self.grupo = None
+      POOL.devolver(self.sesión)
+      self.sesión = None
+
+def ejecutarEnGhci(ruta, timeout, topeBytes=LIMITE_SALIDA, cancelado=None):
+  # Mismo resultado que procesos.ejecutarConTimeout, o None si no se pudo usar el pool
+  lote = LoteGhci()
+  try:
+    return lote.ejecutar(ruta, timeout, topeBytes, cancelado)
+  finally:
+    lote.cerrar()
@@ -0,0 +1,84 @@
+'use strict';
+
+// Trabajador persistente de gobstones-lang (lo usa sesionesGobstones.py).
+// Carga una sola vez el bundle de la CLI (sin la parte que lee los argumentos y ejecuta el comando)
+// y después atiende pedidos de a uno, una línea JSON por pedido y una por respuesta:
+//   {"id":1, "tipo":"parse"|"run", "ruta":"/rtTest/usuario"}
+//   {"id":1, "errcode":0, "salida":"...", "falla":""}
+// Lee src.txt (y board.jboard para "run") de la ruta, y la salida es la misma que escribiría
+// "gobstones-lang parse -i src.txt" o "gobstones-lang run -i src.txt -b". Si el programa falla, la
+// falla es la excepción como la muestra node cuando nadie la atrapa (sin el pedazo de código del bundle).
+// El último programa compilado queda guardado: los casos de una entrega sólo cambian el tablero inicial.
+
+const fs = require('fs');
+const path = require('path');
+const util = require('util');
+const readline = require('readline');
+const Module = require('module');
+
+const INICIO_CLI = 'var ui;(ui='; // Acá empieza la definición de los comandos de la CLI
+
+function cargarGobstones(ruta) {
+  let fuente = fs.readFileSync(ruta, 'utf8').replace(/^#!.*\n/, '');
+  const corte = fuente.indexOf(INICIO_CLI);
+  if (corte < 0) {
+    throw new Error('No se encontró el comienzo de la CLI en ' + ruta);
+  }
+  fuente = fuente.slice(0, corte) + ';module.exports={Runner:Ro,RuntimeState:qn,leerTablero:p};';
+  const modulo = new Module(ruta, module);
+  modulo.filename = ruta;
+  modulo.paths = Module._nodeModulePaths(path.dirname(ruta));
+  modulo._compile(fuente, ruta);
+  return modulo.exports;
+}
+
+const gobstones = cargarGobstones(process.argv[2] || '/rtTest/gbs/dist/gobstones-lang');
+
+function parse(codigo) {
+  const runner = new gobstones.Runner();
+  runner.parse(codigo);
+  runner.lint();
+  const ast = runner.abstractSyntaxTree;
+  ast.tagsToString();
+  return JSON.stringify(ast);
+}
+
+let compilado = { codigo: undefined, runner: undefined };
+
+function compilar(codigo) {
+  if (compilado.codigo !== codigo) {
+    const runner = new gobstones.Runner();
+    runner.parse(codigo);
+    runner.lint();
+    runner.compile();
+    compilado = { codigo: codigo, runner: runner };
+  }
+  return compilado.runner;
+}
+
+function run(codigo, rutaTablero) {
+  const estado = new gobstones.RuntimeState();
+  if (fs.existsSync(rutaTablero)) {
+    estado.load(gobstones.leerTablero(rutaTablero));
+  }
+  const runner = compilar(codigo);
+  runner.execute(estado);
+  return runner.globalState.dump();
+}
+
+function atender(pedido) {
+  try {
+    const codigo = fs.readFileSync(path.join(pedido.ruta, 'src.txt'), 'utf8');
+    const resultado = pedido.tipo === 'parse' ? parse(codigo) : run(codigo, path.join(pedido.ruta, 'board.jboard'));
+    return { id: pedido.id, errcode: 0, salida: JSON.stringify(resultado, undefined, 2) + '\n', falla: '' };
+  } catch (error) {
+    return { id: pedido.id, errcode: 1, salida: '', falla: util.inspect(error) + '\n' };
+  }
+}
+
+const entrada = readline.createInterface({ input: process.stdin, crlfDelay: Infinity });
+entrada.on('line', (linea) => {
+  process.stdout.write(JSON.stringify(atender(JSON.parse(linea))) + '\n');
+});
+entrada.on('close', () => process.exit(0));
+process.stdout.write('LISTO\n');
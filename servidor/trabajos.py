@@ -0,0 +1,229 @@
+# -*- coding: utf-8 -*-
+
+import os
+import string
+import tempfile
+import threading
+import time
+import uuid
+from collections import deque
+from codec import cargar
+from serializacion import serializar
+from utils import mostrar_excepcion
+
+# Cola de trabajos de corrección: POST /code (con "asincronico":true) encola la corrección y responde en el
+# momento con el id del trabajo. El cliente se entera del resultado con un long-poll (GET /trabajo/<id>/<version>)
+# o con un stream de Server-Sent Events (GET /eventos/<id>) que además informa el avance de cada run_data.
+# Cada estado tiene una versión que aumenta con cada cambio: el long-poll espera hasta que haya una versión más nueva.
+# Los trabajos corren en el proceso que recibió el POST, pero en modo prefork (y con los varios server.py de main.py)
+# el long-poll o el stream pueden caer en otro proceso: por eso el dueño publica cada estado en un archivo de
+# CARPETA_COMPARTIDA (en /dev/shm, o sea en memoria) y los demás procesos lo leen cada INTERVALO_COMPARTIDO.
+
+ESPERA_MAXIMA = 25 # segundos que puede quedar colgado un long-poll (o un stream sin novedades)
+TIEMPO_DE_VIDA = 600 # segundos que se guarda el resultado de un trabajo terminado
+DURACION_DEFAULT = 2 # segundos que estimo que tarda un trabajo mientras no terminó ninguno
+INTERVALO_COMPARTIDO = 0.2 # segundos entre lecturas del estado de un trabajo de otro proceso
+CARPETA_COMPARTIDA = os.environ.get("TRABAJOS_DIR",
+  os.path.join("/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir(), "robotutor-trabajos"))
+
+def esIdDeTrabajo(id):
+  # Los ids son uuid4 hex: valido antes de armar un path con algo que vino en la URL
+  return len(id) == 32 and all(c in string.hexdigits for c in id)
+
+def archivoDeTrabajo(id):
+  return os.path.join(CARPETA_COMPARTIDA, id + ".json")
+
+def procesoVivo(pid):
+  try:
+    os.kill(pid, 0)
+  except ProcessLookupError:
+    return False
+  except PermissionError:
+    pass
+  return True
+
+class Trabajo(object):
+  def __init__(self, función, total):
+    self.id = uuid.uuid4().hex
+    self.función = función
+    self.estado = "EN_COLA" # EN_COLA, CORRIENDO o TERMINADO
+    self.hechos = 0
+    self.total = total
+    self.resultado = None
+    self.version = 0
+    self.inicio = None
+    self.fin = None
+
+class ColaDeTrabajos(object):
+  def __init__(self, hilos):
+    self.cantidadDeHilos = hilos
+    self.hilos = []
+    self.cola = deque()
+    self.trabajos = {}
+    self.duraciones = deque(maxlen=50) # Las últimas duraciones, para estimar cuánto falta
+    self.condicion = threading.Condition()
+
+  def encolar(self, función, total):
+    # función recibe un callback alProgresar(hechos, total) y devuelve el resultado del trabajo
+    trabajo = Trabajo(función, total)
+    with self.condicion:
+      self.limpiar()
+      self.iniciarHilos()
+      self.trabajos[trabajo.id] = trabajo
+      self.cola.append(trabajo)
+      self.publicar(trabajo)
+      self.condicion.notify_all()
+      return self.estadoDe(trabajo)
+
+  def iniciarHilos(self):
+    # Los hilos se crean con el primer trabajo (y no al importar) para que sobrevivan al fork del modo prefork
+    while len(self.hilos) < self.cantidadDeHilos:
+      hilo = threading.Thread(target=self.trabajar, daemon=True)
+      hilo.start()
+      self.hilos.append(hilo)
+
+  def trabajar(self):
+    while True:
+      with self.condicion:
+        while len(self.cola) == 0:
+          self.condicion.wait()
+        trabajo = self.cola.popleft()
+        trabajo.estado = "CORRIENDO"
+        trabajo.inicio = time.monotonic()
+        self.avisar(trabajo)
+        for otro in self.cola: # Cambió la posición de todos los que siguen en la cola
+          otro.version += 1
+          self.publicar(otro)
+      try:
+        resultado = trabajo.función(lambda hechos, total: self.progresar(trabajo, hechos, total))
+      except Exception as e:
+        mostrar_excepcion(e)
+        resultado = {'resultado':"SERVER_BUG"}
+      with self.condicion:
+        trabajo.resultado = resultado
+        trabajo.estado = "TERMINADO"
+        trabajo.fin = time.monotonic()
+        trabajo.función = None
+        self.duraciones.append(trabajo.fin - trabajo.inicio)
+        self.avisar(trabajo)
+
+  def progresar(self, trabajo, hechos, total):
+    with self.condicion:
+      trabajo.hechos = hechos
+      trabajo.total = total
+      self.avisar(trabajo)
+
+  def avisar(self, trabajo):
+    trabajo.version += 1
+    self.publicar(trabajo)
+    self.condicion.notify_all()
+
+  def publicar(self, trabajo):
+    # Escribe el estado para los otros procesos (os.replace es atómico: nunca leen un archivo a medias)
+    archivo = archivoDeTrabajo(trabajo.id)
+    try:
+      os.makedirs(CARPETA_COMPARTIDA, exist_ok=True)
+      with open(archivo + "." + str(os.getpid()), "wb") as f:
+        f.write(serializar({"pid":os.getpid(), "estado":self.estadoDe(trabajo)}))
+      os.replace(archivo + "." + str(os.getpid()), archivo)
+    except Exception as e:
+      mostrar_excepcion(e)
+
+  def limpiar(self):
+    ahora = time.monotonic()
+    for id in [id for id in self.trabajos if self.trabajos[id].estado == "TERMINADO" and ahora - self.trabajos[id].fin > TIEMPO_DE_VIDA]:
+      del self.trabajos[id]
+      try:
+        os.remove(archivoDeTrabajo(id))
+      except OSError:
+        pass
+    # Los archivos que dejó un proceso que murió sin limpiar
+    try:
+      for nombre in os.listdir(CARPETA_COMPARTIDA):
+        archivo = os.path.join(CARPETA_COMPARTIDA, nombre)
+        if time.time() - os.path.getmtime(archivo) > TIEMPO_DE_VIDA + ESPERA_MAXIMA:
+          os.remove(archivo)
+    except OSError:
+      pass
+
+  def duracionPromedio(self):
+    return (sum(self.duraciones) / len(self.duraciones)) if len(self.duraciones) > 0 else DURACION_DEFAULT
+
+  def estadoDe(self, trabajo):
+    # Se llama con self.condicion tomada
+    estado = {"resultado":"OK", "trabajo":trabajo.id, "estado":trabajo.estado, "version":trabajo.version,
+      "progreso":{"hechos":trabajo.hechos, "total":trabajo.total}}
+    promedio = self.duracionPromedio()
+    if trabajo.estado == "EN_COLA":
+      posicion = self.cola.index(trabajo) + 1
+      estado["posicion"] = posicion
+      estado["eta"] = round(promedio * ((posicion - 1) // self.cantidadDeHilos + 1), 1)
+    elif trabajo.estado == "CORRIENDO":
+      estado["eta"] = round(max(0, promedio - (time.monotonic() - trabajo.inicio)), 1)
+    else:
+      estado["respuesta"] = trabajo.resultado
+    return estado
+
+  def esperar(self, id, version, timeout=ESPERA_MAXIMA):
+    # Devuelve el estado del trabajo en cuanto tenga una versión posterior a la dada (o al vencer el timeout),
+    # None si el trabajo no existe
+    with self.condicion:
+      trabajo = self.trabajos.get(id)
+      if not (trabajo is None):
+        self.condicion.wait_for(lambda: trabajo.version > version, timeout)
+        return self.estadoDe(trabajo)
+    return self.esperarCompartido(id, version, timeout)
+
+  def esperarCompartido(self, id, version, timeout):
+    # Lo mismo que esperar, para un trabajo de otro proceso: leo su archivo hasta que cambie la versión
+    if not esIdDeTrabajo(id):
+      return None
+    plazo = time.monotonic() + timeout
+    while True:
+      try:
+        with open(archivoDeTrabajo(id), "rb") as f:
+          publicado = cargar(f.read())
+      except (OSError, ValueError):
+        return None
+      estado = publicado["estado"]
+      if estado["estado"] != "TERMINADO" and not procesoVivo(publicado["pid"]):
+        return None # El dueño murió con el trabajo sin terminar
+      if estado["version"] > version or time.monotonic() >= plazo:
+        return estado
+      time.sleep(INTERVALO_COMPARTIDO)
+
+  def eventos(self, id):
+    # Generador de estados para el stream: None cuando pasó ESPERA_MAXIMA sin novedades
+    version = -1
+    while True:
+      estado = self.esperar(id, version)
+      if estado is None:
+        yield {"resultado":"Error", "error":"Trabajo desconocido"}
+        return
+      if estado["version"] == version:
+        yield None
+        continue
+      version = estado["version"]
+      yield estado
+      if estado["estado"] == "TERMINADO":
+        return
+
+TRABAJOS = ColaDeTrabajos(int(os.environ["HILOS_CORRECCION"]) if "HILOS_CORRECCION" in os.environ else (os.cpu_count() or 2))
+
+def encolarTrabajo(función, total):
+  return TRABAJOS.encolar(función, total)
+
+def estado_trabajo(resto):
+  # GET /trabajo/<id>/<version>: long-poll (sin versión, o con una vieja, responde en el momento)
+  partes = resto.split("/")
+  version = -1
+  if len(partes) > 1 and partes[1].isdigit():
+    version = int(partes[1])
+  estado = TRABAJOS.esperar(partes[0], version)
+  if estado is None:
+    return {"resultado":"Error", "error":"Trabajo desconocido"}
+  return estado
+
+def eventos_trabajo(resto):
+  # GET /eventos/<id>: stream de Server-Sent Events con cada cambio de estado
+  return TRABAJOS.eventos(resto.split("/")[0])
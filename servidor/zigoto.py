@@ -0,0 +1,508 @@
+# -*- coding: utf-8 -*-
+
+import os, sys
+import json
+import socket
+import selectors
+import signal
+import tempfile
+import threading
+import time
+import fcntl
+from subprocess import Popen, PIPE
+
+# Zigoto para el corrector de Python: un proceso que ya tiene el intérprete levantado y los módulos del curso
+# importados (por ejemplo numpy) y que, por cada ejecución, hace fork de un hijo que corre src.py.
+# El servidor le habla por un socket unix: le manda la ruta y los extremos de escritura de dos pipes (stdout y
+# stderr), el zigoto contesta con el pid del hijo y, cuando termina, con su errcode. El servidor lee los pipes y
+# maneja el timeout igual que procesos.ejecutar (y si vence, mata al grupo del hijo).
+# Hay un zigoto por cada lista de módulos a precargar, y se levanta recién cuando se lo necesita.
+# Para los lotes (varios casos de una misma entrega que sólo difieren en el final del archivo) el zigoto hace fork
+# de un hijo que corre una sola vez el principio común (el código entregado) y después, por cada caso, hace fork
+# de un nieto que corre el resto. Ese hijo atiende la conexión él mismo, con el mismo protocolo de a un caso.
+
+from procesos import sacarPrivilegios, leerSalidas, LIMITE_SALIDA
+from gruposDeControl import grupoDe
+
+USAR_ZIGOTO = os.environ.get('ZIGOTO', '1') != '0'
+TIMEOUT_INICIO = 60 # segundos que puede tardar el zigoto en importar los módulos
+TIMEOUT_RESPUESTA = 5 # segundos que espero al zigoto para que me conteste
+MAX_FD = 1024
+
+## Lado del servidor
+
+class Zigoto(object):
+  def __init__(self, módulos):
+    self.módulos = módulos
+    self.proceso = None
+    self.rutaSocket = None
+    self.lock = threading.Lock()
+
+  def iniciar(self):
+    # Se llama con self.lock tomado
+    if not (self.proceso is None) and self.proceso.poll() is None:
+      return
+    self.rutaSocket = os.path.join(tempfile.gettempdir(), "zigoto-" + str(os.getpid()) + "-" + "_".join(self.módulos) + ".sock")
+    if os.path.exists(self.rutaSocket):
+      os.remove(self.rutaSocket)
+    # stdin queda abierto: cuando el servidor termina, el zigoto recibe EOF y termina también
+    self.proceso = Popen([sys.executable, os.path.abspath(__file__), self.rutaSocket] + self.módulos,
+      stdin=PIPE, stdout=PIPE, cwd=os.path.dirname(os.path.abspath(__file__)))
+    línea = self.proceso.stdout.readline()
+    if línea.strip() != b"LISTO":
+      self.proceso.kill()
+      self.proceso.wait()
+      self.proceso = None
+      raise OSError("No se pudo iniciar el zigoto " + str(self.módulos))
+
+  def ejecutar(self, archivo, ruta, timeout, topeBytes, cancelado=None):
+    # Devuelve errcode (None si se pasó del timeout), stdout y stderr, como procesos.ejecutar
+    with self.lock:
+      self.iniciar()
+    conexión = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    rOut, wOut = os.pipe()
+    rErr, wErr = os.pipe()
+    try:
+      conexión.connect(self.rutaSocket)
+      try:
+        socket.send_fds(conexión, [json.dumps({"archivo":archivo, "ruta":ruta, "grupo":grupoDe(ruta)}).encode()], [wOut, wErr])
+      finally:
+        os.close(wOut)
+        os.close(wErr)
+      buffer = bytearray()
+      pid = json.loads(recibirLínea(conexión, buffer, TIMEOUT_RESPUESTA))["pid"]
+      plazo = None if timeout is None else time.monotonic() + timeout
+      respuesta = []
+      def terminó():
+        if len(respuesta) == 0:
+          línea = recibirLínea(conexión, buffer, 0)
+          if not (línea is None):
+            respuesta.append(json.loads(línea))
+        return len(respuesta) > 0
+      stdout, stderr, vencido = leerSalidas(rOut, rErr, topeBytes, plazo, terminó, cancelado)
+      if not vencido and len(respuesta) == 0:
+        línea = recibirLínea(conexión, buffer, None if plazo is None else max(0, plazo - time.monotonic()))
+        if línea is None:
+          vencido = True
+        else:
+          respuesta.append(json.loads(línea))
+      if vencido:
+        matarHijo(pid)
+        return None, stdout, stderr
+      return respuesta[0]["errcode"], stdout, stderr
+    finally:
+      os.close(rOut)
+      os.close(rErr)
+      conexión.close()
+
+def recibirLínea(conexión, buffer, timeout):
+  # Devuelve la próxima línea que mandó el zigoto, o None si no llegó a tiempo
+  conexión.settimeout(timeout)
+  while not (b"\n" in buffer):
+    try:
+      datos = conexión.recv(4096)
+    except (socket.timeout, BlockingIOError):
+      return None
+    if len(datos) == 0:
+      raise ConnectionError("El zigoto cerró la conexión")
+    buffer += datos
+  línea, _, resto = bytes(buffer).partition(b"\n")
+  buffer[:] = resto
+  return línea
+
+def matarHijo(pid):
+  # El hijo hace setsid, así que su grupo incluye a todo lo que haya lanzado
+  for matar in [os.killpg, os.kill]:
+    try:
+      matar(pid, signal.SIGKILL)
+    except (ProcessLookupError, PermissionError):
+      pass
+
+class LoteZigoto(object):
+  # Casos cuyo archivo empieza con prefijo: el hijo del zigoto lo corre una vez (la primera ejecución incluye ese
+  # tiempo, y a las siguientes se les suma) y cada caso corre el resto del archivo en un nieto
+  def __init__(self, zigoto, archivo, ruta, prefijo):
+    self.prefijo = prefijo
+    self.casos = 0
+    self.pid = None
+    self.buffer = bytearray()
+    with zigoto.lock:
+      zigoto.iniciar()
+    self.conexión = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+      self.conexión.connect(zigoto.rutaSocket)
+      self.conexión.sendall(json.dumps({"archivo":archivo, "ruta":ruta, "grupo":grupoDe(ruta), "lote":len(prefijo)}).encode())
+      self.pid = json.loads(recibirLínea(self.conexión, self.buffer, TIMEOUT_RESPUESTA))["pid"]
+    except BaseException:
+      self.cerrar()
+      raise
+
+  def ejecutar(self, timeout, topeBytes):
+    # Devuelve errcode (None si se pasó del timeout), stdout, stderr y la duración del caso
+    inicio = time.monotonic()
+    rOut, wOut = os.pipe()
+    rErr, wErr = os.pipe()
+    try:
+      try:
+        socket.send_fds(self.conexión, [json.dumps({"caso":self.casos}).encode()], [wOut, wErr])
+      finally:
+        os.close(wOut)
+        os.close(wErr)
+      # El primer caso espera a que termine el prefijo, así que el timeout ya lo incluye
+      línea = recibirLínea(self.conexión, self.buffer, timeout)
+      if línea is None:
+        matarHijo(self.pid)
+        return None, "", "", None
+      respuesta = json.loads(línea)
+      prefijo = 0 if self.casos == 0 else respuesta["prefijo"]
+      self.casos += 1
+      plazo = None if timeout is None else inicio + timeout - prefijo
+      final = []
+      def terminó():
+        if len(final) == 0:
+          línea = recibirLínea(self.conexión, self.buffer, 0)
+          if not (línea is None):
+            final.append(json.loads(línea))
+        return len(final) > 0
+      stdout, stderr, vencido = leerSalidas(rOut, rErr, topeBytes, plazo, terminó)
+      if not vencido and len(final) == 0:
+        línea = recibirLínea(self.conexión, self.buffer, None if plazo is None else max(0, plazo - time.monotonic()))
+        if línea is None:
+          vencido = True
+        else:
+          final.append(json.loads(línea))
+      if vencido:
+        matarHijo(respuesta["pid"])
+        return None, stdout, stderr, None
+      return final[0]["errcode"], stdout, stderr, time.monotonic() - inicio + prefijo
+    finally:
+      os.close(rOut)
+      os.close(rErr)
+
+  def cerrar(self):
+    self.conexión.close()
+    if not (self.pid is None):
+      matarHijo(self.pid)
+
+ZIGOTOS = {}
+lockZigotos = threading.Lock()
+
+def zigotoPara(módulos):
+  clave = tuple(sorted(módulos))
+  with lockZigotos:
+    if not (clave in ZIGOTOS):
+      ZIGOTOS[clave] = Zigoto(list(clave))
+    return ZIGOTOS[clave]
+
+def abrirLoteEnZigoto(módulos, archivo, ruta, prefijo):
+  # Un LoteZigoto, o None si no se pudo usar el zigoto
+  if not USAR_ZIGOTO:
+    return None
+  try:
+    return LoteZigoto(zigotoPara(módulos), archivo, ruta, prefijo)
+  except (OSError, ValueError, KeyError, TypeError) as e:
+    print("Zigoto " + str(módulos) + ": " + str(e))
+    return None
+
+def ejecutarEnLote(lote, timeout, topeBytes=LIMITE_SALIDA):
+  # Mismo resultado que procesos.ejecutarConTimeout, o None si el lote dejó de funcionar
+  try:
+    errcode, salida, falla, duracion = lote.ejecutar(timeout, topeBytes)
+  except (OSError, ValueError, KeyError, TypeError) as e:
+    print("Lote del zigoto: " + str(e))
+    return None
+  if errcode is None:
+    return {"resultado":"TIMEOUT"}
+  return {
+    "resultado":"OK",
+    "errcode":errcode,
+    "salida":salida,
+    "falla":falla,
+    "duracion":duracion
+  }
+
+def ejecutarEnZigoto(módulos, archivo, timeout, ruta, topeBytes=LIMITE_SALIDA, cancelado=None):
+  # Mismo resultado que procesos.ejecutarConTimeout, o None si no se pudo usar el zigoto
+  if not USAR_ZIGOTO:
+    return None
+  zigoto = zigotoPara(módulos)
+  inicio = time.monotonic()
+  try:
+    errcode, salida, falla = zigoto.ejecutar(archivo, ruta, timeout, topeBytes, cancelado)
+  except (OSError, ValueError, KeyError) as e:
+    print("Zigoto " + str(módulos) + ": " + str(e))
+    return None
+  duracion = time.monotonic() - inicio
+  if errcode is None:
+    return {"resultado":"TIMEOUT"}
+  return {
+    "resultado":"OK",
+    "errcode":errcode,
+    "salida":salida,
+    "falla":falla,
+    "duracion":duracion
+  }
+
+## Lado del zigoto
+
+def servir(rutaSocket, módulos):
+  import importlib
+  for módulo in módulos:
+    try:
+      importlib.import_module(módulo)
+    except Exception as e:
+      print("No se pudo precargar " + módulo + ": " + str(e), file=sys.stderr)
+  servidor = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+  servidor.bind(rutaSocket)
+  os.chmod(rutaSocket, 0o600)
+  servidor.listen(64)
+  selector = selectors.DefaultSelector()
+  selector.register(servidor, selectors.EVENT_READ, "aceptar")
+  selector.register(sys.stdin.fileno(), selectors.EVENT_READ, "servidor")
+  print("LISTO")
+  sys.stdout.flush()
+  while True:
+    for clave, _ in selector.select():
+      if clave.data == "aceptar":
+        conexión, _ = servidor.accept()
+        selector.register(conexión, selectors.EVENT_READ, "pedido")
+      elif clave.data == "servidor":
+        if len(os.read(clave.fd, 1024)) == 0: # El servidor terminó
+          servidor.close()
+          os.remove(rutaSocket)
+          return
+      elif clave.data == "pedido":
+        conexión = clave.fileobj
+        selector.unregister(conexión)
+        pid, responder = atenderPedido(conexión)
+        if not responder: # En los lotes la conexión la atiende el hijo
+          conexión.close()
+        if not (pid is None):
+          selector.register(os.pidfd_open(pid), selectors.EVENT_READ, (pid, conexión if responder else None))
+      else: # Terminó un hijo
+        pid, conexión = clave.data
+        selector.unregister(clave.fd)
+        os.close(clave.fd)
+        _, estado = os.waitpid(pid, 0)
+        if not (conexión is None):
+          try:
+            conexión.sendall((json.dumps({"errcode":os.waitstatus_to_exitcode(estado)}) + "\n").encode())
+          except OSError:
+            pass
+          conexión.close()
+
+def atenderPedido(conexión):
+  # Devuelve el pid del hijo (o None) y si hay que responderle al servidor cuando termine
+  try:
+    mensaje, fds, _, _ = socket.recv_fds(conexión, 65536, 2)
+  except OSError:
+    return None, False
+  pedido = json.loads(mensaje) if len(mensaje) > 0 else {}
+  if len(fds) != (0 if "lote" in pedido else 2):
+    for fd in fds:
+      os.close(fd)
+    return None, False
+  sys.stdout.flush()
+  sys.stderr.flush()
+  pid = os.fork()
+  if pid == 0:
+    if "lote" in pedido:
+      correrLote(conexión, pedido)
+    correrHijo(pedido, fds)
+  if "lote" in pedido:
+    return pid, False
+  for fd in fds:
+    os.close(fd)
+  try:
+    conexión.sendall((json.dumps({"pid":pid}) + "\n").encode())
+  except OSError:
+    pass
+  return pid, True
+
+def correrHijo(pedido, fds):
+  código = 1
+  try:
+    os.dup2(fds[0], 1)
+    os.dup2(fds[1], 2)
+    nulo = os.open(os.devnull, os.O_RDONLY)
+    os.dup2(nulo, 0)
+    os.closerange(3, MAX_FD) # No le dejo al código entregado el socket ni los pipes del zigoto
+    sacarPrivilegios(pedido["ruta"], pedido.get("grupo"))
+    sys.path[0] = pedido["ruta"]
+    sys.argv = [pedido["archivo"]]
+    resembrar()
+    código = correr(pedido["archivo"])
+  except BaseException:
+    import traceback
+    traceback.print_exc()
+  finally:
+    try:
+      sys.stdout.flush()
+      sys.stderr.flush()
+    finally:
+      os._exit(código)
+
+def correrLote(conexión, pedido):
+  # Corre el prefijo (guardando sus salidas en memoria) y después atiende los casos de a uno: por cada uno recibe
+  # los pipes, hace fork de un nieto que repite las salidas del prefijo y corre el resto del archivo, responde
+  # con su pid y, cuando termina, con su errcode. Termina cuando el servidor cierra la conexión.
+  # Si el prefijo escribe más de LIMITE_SALIDA en alguna salida, termina sin atender casos: el lote deja de
+  # funcionar y cada caso se corre aparte, con las salidas acotadas como en procesos.ejecutar.
+  try:
+    fd = conexión.fileno()
+    nulo = os.open(os.devnull, os.O_RDONLY)
+    os.dup2(nulo, 0)
+    os.closerange(3, fd)
+    os.closerange(fd + 1, MAX_FD)
+    for salida in [1, 2]:
+      os.dup2(memoriaAcotada(), salida)
+    sacarPrivilegios(pedido["ruta"], pedido.get("grupo"))
+    conexión.sendall((json.dumps({"pid":os.getpid()}) + "\n").encode())
+    archivo = pedido["archivo"]
+    sys.path[0] = pedido["ruta"]
+    sys.argv = [archivo]
+    resembrar()
+    inicio = time.monotonic()
+    prefijo = leerArchivo(archivo)[:pedido["lote"]]
+    módulo = None
+    salidaPrefijo = None
+    try:
+      códigoPrefijo = compile(prefijo, archivo, 'exec')
+    except (SyntaxError, ValueError): # Cada caso va a mostrar el error de compilar su archivo completo
+      códigoPrefijo = None
+    if not (códigoPrefijo is None):
+      módulo = nuevoMain(archivo)
+      salidaPrefijo = correrEn(códigoPrefijo, módulo)
+    sys.stdout.flush()
+    sys.stderr.flush()
+    escrito = [os.lseek(salida, 0, os.SEEK_CUR) for salida in [1, 2]]
+    if max(escrito) > LIMITE_SALIDA:
+      return
+    capturado = [os.pread(salida, largo, 0) for salida, largo in zip([1, 2], escrito)]
+    duración = time.monotonic() - inicio
+    while True:
+      mensaje, fds, _, _ = socket.recv_fds(conexión, 65536, 2)
+      if len(mensaje) == 0 or len(fds) != 2:
+        break
+      códigoSufijo = None
+      texto = leerArchivo(archivo)
+      sufijo = texto[len(prefijo):]
+      if not (módulo is None) and texto.startswith(prefijo) and empalmaEnLínea(prefijo, sufijo):
+        try:
+          # Con tantas líneas vacías como el prefijo, los errores muestran los números de línea del archivo
+          códigoSufijo = compile("\n" * prefijo.count("\n") + sufijo, archivo, 'exec')
+        except (SyntaxError, ValueError):
+          pass
+      pid = os.fork()
+      if pid == 0:
+        correrCaso(fds, archivo, módulo, capturado, salidaPrefijo, códigoSufijo)
+      for fd in fds:
+        os.close(fd)
+      conexión.sendall((json.dumps({"pid":pid, "prefijo":duración}) + "\n").encode())
+      _, estado = os.waitpid(pid, 0)
+      conexión.sendall((json.dumps({"errcode":os.waitstatus_to_exitcode(estado)}) + "\n").encode())
+  except BaseException:
+    pass
+  finally:
+    os._exit(0)
+
+def memoriaAcotada():
+  # Un archivo en memoria donde no se puede escribir más allá de LIMITE_SALIDA (redondeado a páginas, y al menos
+  # un byte más, para saber si se pasó): las páginas de un memfd no cuentan para RLIMIT_AS, así que sin este tope
+  # un prefijo que imprime sin parar llenaría la RAM. El tamaño queda sellado (el código entregado no lo puede
+  # cambiar) y no ocupa memoria hasta que se escribe
+  página = os.sysconf('SC_PAGE_SIZE')
+  memoria = os.memfd_create("salida", os.MFD_ALLOW_SEALING)
+  os.ftruncate(memoria, (LIMITE_SALIDA // página + 1) * página)
+  fcntl.fcntl(memoria, fcntl.F_ADD_SEALS, fcntl.F_SEAL_GROW | fcntl.F_SEAL_SHRINK | fcntl.F_SEAL_SEAL)
+  return memoria
+
+def correrCaso(fds, archivo, módulo, capturado, salidaPrefijo, códigoSufijo):
+  # Sin códigoSufijo corre el archivo completo, como correrHijo
+  código = 1
+  try:
+    os.dup2(fds[0], 1)
+    os.dup2(fds[1], 2)
+    os.closerange(3, MAX_FD)
+    os.setsid()
+    resembrar()
+    if códigoSufijo is None:
+      código = correr(archivo)
+    else:
+      escribirTodo(1, capturado[0])
+      escribirTodo(2, capturado[1])
+      código = salidaPrefijo if not (salidaPrefijo is None) else correrEn(códigoSufijo, módulo)
+      código = 0 if código is None else código
+  except BaseException:
+    import traceback
+    traceback.print_exc()
+  finally:
+    try:
+      sys.stdout.flush()
+      sys.stderr.flush()
+    finally:
+      os._exit(código)
+
+def empalmaEnLínea(prefijo, sufijo):
+  # El sufijo se puede compilar aparte si empieza en una línea nueva
+  return prefijo == "" or prefijo.endswith("\n") or sufijo == "" or sufijo.startswith("\n")
+
+def leerArchivo(archivo):
+  f = open(archivo, 'r')
+  texto = f.read()
+  f.close()
+  return texto
+
+def escribirTodo(fd, datos):
+  while len(datos) > 0:
+    datos = datos[os.write(fd, datos):]
+
+def resembrar():
+  # Después del fork todos los hijos tendrían el mismo estado del generador de números al azar
+  if "random" in sys.modules:
+    sys.modules["random"].seed()
+  if "numpy" in sys.modules:
+    sys.modules["numpy"].random.seed()
+
+def correr(archivo):
+  # Como "python3 archivo": en un __main__ nuevo, y los errores se muestran sin las líneas del zigoto
+  import traceback
+  módulo = nuevoMain(archivo)
+  try:
+    código = compile(leerArchivo(archivo), archivo, 'exec')
+  except SyntaxError as e:
+    traceback.print_exception(type(e), e, None)
+    return 1
+  código = correrEn(código, módulo)
+  return 0 if código is None else código
+
+def nuevoMain(archivo):
+  import builtins, types
+  módulo = types.ModuleType("__main__")
+  módulo.__file__ = archivo
+  módulo.__builtins__ = builtins
+  sys.modules["__main__"] = módulo
+  return módulo
+
+def correrEn(código, módulo):
+  # Devuelve el código de salida, o None si el código terminó sin exit ni excepciones
+  import traceback
+  try:
+    exec(código, módulo.__dict__)
+  except SystemExit as e:
+    return códigoDeSalida(e.code)
+  except BaseException as e:
+    traceback.print_exception(type(e), e, e.__traceback__.tb_next)
+    return 1
+  return None
+
+def códigoDeSalida(code):
+  if code is None:
+    return 0
+  if isinstance(code, int):
+    return code & 0xFF
+  print(code, file=sys.stderr)
+  return 1
+
+if __name__ == '__main__':
+  servir(sys.argv[1], sys.argv[2:])